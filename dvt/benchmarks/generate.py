@@ -0,0 +1,152 @@
+'''Deterministic synthetic CSV files for the benchmarks.
+
+    python generate.py --size 64MB --shape wide --dialect semicolon out.csv
+
+The same arguments always give the same bytes, so files can be kept
+between runs and results compared across machines.
+'''
+import os
+import bz2
+import csv
+import gzip
+import shutil
+import argparse
+import numpy as np
+import pandas as pd
+
+UNITS = {'B': 1, 'KB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3,
+         'KIB': 1024, 'MIB': 1024 ** 2, 'GIB': 1024 ** 3}
+
+# Number of columns of each shape
+SHAPES = {'narrow': 6, 'wide': 200}
+
+DIALECTS = {
+    'comma': {'sep': ','},
+    'semicolon': {'sep': ';'},
+    'tab': {'sep': '\t'},
+    'quoted': {'sep': ',', 'quoting': csv.QUOTE_ALL}
+}
+
+# clean: valid UTF-8 with a header, bad_encoding: Latin-1 text,
+# no_header: the first row is data
+VARIANTS = ['clean', 'bad_encoding', 'no_header']
+
+KINDS = ['int', 'float', 'text', 'date', 'bool']
+WORDS = ['alpha', 'bravo', 'café', 'delta', 'écho', 'foxtrot', 'golf', 'hôtel',
+         'india', 'juliett', 'kilo', 'lima', 'mike', 'novembre', 'oscar']
+
+# Rows generated at a time, memory use is proportional to this
+ROWS_PER_BLOCK = 20000
+
+# Compressed copies of the files, bzip2 and zstd in members of MEMBER_SIZE
+# like pbzip2 and pzstd write them, so they decompress in parallel
+COMPRESSIONS = {'none': '', 'gzip': '.gz', 'bzip2': '.bz2', 'zstd': '.zst'}
+MEMBER_SIZE = 1024 * 1024
+
+
+def parse_size(text):
+    '''Bytes in a size such as 512KB, 64MB or 3GiB'''
+    text = text.strip().upper()
+    for unit in sorted(UNITS, key=len, reverse=True):
+        if text.endswith(unit):
+            return int(float(text[:-len(unit)]) * UNITS[unit])
+    return int(text)
+
+
+def column_kinds(count):
+    return [KINDS[i % len(KINDS)] for i in range(count)]
+
+
+def column_names(count):
+    return ['%s%d' % (kind, i) for i, kind in enumerate(column_kinds(count))]
+
+
+def make_block(random, kinds, rows):
+    words = np.array(WORDS)
+    data = {}
+    for i, kind in enumerate(kinds):
+        if kind == 'int':
+            values = random.randint(0, 1000000, rows).astype(str)
+        elif kind == 'float':
+            values = np.round(random.normal(100, 25, rows), 3).astype(str)
+        elif kind == 'text':
+            # some fields hold the delimiters and quotes of every dialect
+            values = np.char.add(np.char.add(words[random.randint(0, len(words), rows)], ' '),
+                                 words[random.randint(0, len(words), rows)]).astype(object)
+            odd = random.random_sample(rows) < 0.05
+            values[odd] = values[odd] + ', "x"; y'
+        elif kind == 'date':
+            days = random.randint(0, 3650, rows).astype('timedelta64[D]')
+            values = (np.datetime64('2015-01-01') + days).astype(str)
+        else:
+            values = np.where(random.random_sample(rows) < 0.5, 'true', 'false')
+        values = values.astype(object)
+        values[random.random_sample(rows) < 0.01] = ''
+        data['c%d' % (i)] = values
+    return pd.DataFrame(data)
+
+
+def generate(path, size, shape='narrow', dialect='comma', variant='clean', seed=0):
+    '''Writes at least size bytes of whole rows to path'''
+    kinds = column_kinds(SHAPES[shape])
+    args = dict(DIALECTS[dialect])
+    encoding = 'latin-1' if variant == 'bad_encoding' else 'utf8'
+
+    written = 0
+    with open(path, 'wb') as out:
+        if variant != 'no_header':
+            header = pd.DataFrame(columns=column_names(len(kinds)))
+            written += out.write(header.to_csv(index=False, **args).encode(encoding))
+
+        block = 0
+        while written < size:
+            random = np.random.RandomState([seed, block])
+            frame = make_block(random, kinds, ROWS_PER_BLOCK)
+            text = frame.to_csv(header=False, index=False, **args)
+            if written + len(text) > size:
+                # end on a whole row close to the requested size
+                cut = text.find('\n', max(size - written - 1, 0))
+                text = text[:cut + 1] if cut >= 0 else text
+            written += out.write(text.encode(encoding))
+            block += 1
+    return written
+
+
+def compress(path, out_path, compression):
+    '''Writes the file at path compressed to out_path'''
+    with open(path, 'rb') as f, open(out_path, 'wb') as out:
+        if compression == 'gzip':
+            with gzip.GzipFile(fileobj=out, mode='wb', mtime=0) as compressed:
+                shutil.copyfileobj(f, compressed, MEMBER_SIZE)
+            return
+        if compression == 'zstd':
+            import zstandard
+            compressor = zstandard.ZstdCompressor(write_checksum=True)
+        else:
+            compressor = bz2
+        for member in iter(lambda: f.read(MEMBER_SIZE), b''):
+            out.write(compressor.compress(member))
+
+
+def case_filename(directory, size, shape, dialect, variant, seed=0, compression='none'):
+    return os.path.join(directory, '%s-%s-%s-%d-%d.csv%s' % (
+        shape, dialect, variant, size, seed, COMPRESSIONS[compression]))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('path')
+    parser.add_argument('--size', default='1MB')
+    parser.add_argument('--shape', choices=sorted(SHAPES), default='narrow')
+    parser.add_argument('--dialect', choices=sorted(DIALECTS), default='comma')
+    parser.add_argument('--variant', choices=VARIANTS, default='clean')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--compression', choices=sorted(COMPRESSIONS), default='none')
+    args = parser.parse_args()
+    path = args.path if args.compression == 'none' else args.path + '.tmp'
+    written = generate(path, parse_size(args.size), args.shape, args.dialect,
+                       args.variant, args.seed)
+    if args.compression != 'none':
+        compress(path, args.path, args.compression)
+        os.remove(path)
+    print('Wrote %d bytes to %s' % (written, args.path))
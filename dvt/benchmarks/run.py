@@ -0,0 +1,243 @@
+'''Benchmarks of the validation rules and workers on synthetic CSV files.
+
+    python run.py --sizes 1MB,64MB --shapes narrow,wide --output results.json
+    python run.py --baseline results.json
+
+Every stage of every case runs in a fresh process against the local
+stand-in, so no run sees the memory or the imports of another. Results
+are written as JSON with the throughput, latency percentiles and peak RSS
+of each stage. With --baseline the exit status is 1 when a stage got
+slower or bigger than the baseline by more than the tolerance.
+'''
+import os
+import sys
+import json
+import math
+import time
+import uuid
+import platform
+import argparse
+import tempfile
+import datetime
+import contextlib
+import multiprocessing
+import generate
+
+MiB = 1024 * 1024
+
+RULE_STAGES = ['CsvHeaderRule', 'FileSizeEncodingRule', 'TypeConsistencyRule', 'DuplicateRowRule']
+WORKER_STAGES = ['validation', 'profiling']
+STAGES = RULE_STAGES + WORKER_STAGES
+
+MATRIX_SIZES = '1MB,64MB,512MB,3GiB'
+
+
+def run_stage(path, stage):
+    '''Runs one stage on the file at path in this process, returns its
+    seconds and peak RSS. Meant for a fresh child process.'''
+    from stand_in import StandIn, load_worker, SOURCE_BUCKET_NAME
+
+    workdir = tempfile.mkdtemp(prefix='byod_dvt_bench_')
+    os.chdir(workdir)
+    stand_in = StandIn().start()
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            job_id = str(uuid.uuid4())
+            job = stand_in.add_job(job_id, path)
+            validation = load_worker('validation')
+            from common.metrics import reset_peak_rss, peak_rss
+
+            if stage in RULE_STAGES:
+                from common import get_object
+                rule = validation.rule_registry().rules[stage]()
+
+                def work():
+                    rule.validate(get_object(
+                        validation.s3, Bucket=SOURCE_BUCKET_NAME, Key=job['filename'],
+                        VersionId=job['filename_version'], decompress=True))
+            elif stage == 'validation':
+                def work():
+                    validation.validate_job({'Body': job_id})
+            else:
+                # profiling reads what validation left, which is not timed
+                profiling = load_worker('profiling')
+                validation.validate_job({'Body': job_id})
+
+                def work():
+                    profiling.profile_job(job_id)
+
+            reset_peak_rss()
+            start = time.perf_counter()
+            work()
+            seconds = time.perf_counter() - start
+        return {'seconds': seconds, 'peak_rss': peak_rss()}
+    finally:
+        stand_in.stop()
+
+
+def percentile(values, p):
+    # nearest rank
+    values = sorted(values)
+    return values[max(int(math.ceil(p / 100.0 * len(values))) - 1, 0)]
+
+
+def summarize(case, stage, runs, errors):
+    result = dict(case)
+    result.update({'stage': stage, 'runs': len(runs), 'errors': errors})
+    if runs:
+        seconds = [run['seconds'] for run in runs]
+        p50 = percentile(seconds, 50)
+        result.update({
+            'mb_per_s': round(case['size_bytes'] / MiB / p50, 3) if p50 else None,
+            'latency_s': {
+                'min': round(min(seconds), 4),
+                'p50': round(p50, 4),
+                'p90': round(percentile(seconds, 90), 4),
+                'p99': round(percentile(seconds, 99), 4),
+                'max': round(max(seconds), 4)
+            },
+            'peak_rss_mb': round(max(run['peak_rss'] for run in runs) / MiB, 1)
+        })
+    return result
+
+
+def result_key(result):
+    return (result['size'], result['shape'], result['dialect'], result['variant'],
+            result.get('compression', 'none'), result['seed'], result['stage'])
+
+
+def compare(results, baseline, tolerance):
+    '''Lines describing the stages that regressed against baseline'''
+    previous = dict((result_key(result), result) for result in baseline['results'])
+    regressions = []
+    for result in results:
+        old = previous.get(result_key(result))
+        if old is None or not old.get('runs'):
+            continue
+        name = '/'.join(str(x) for x in result_key(result))
+        if not result.get('runs'):
+            regressions.append('%s: failed, %s' % (name, result['errors'][-1]))
+            continue
+        if old['mb_per_s'] and result['mb_per_s'] < old['mb_per_s'] * (1 - tolerance):
+            regressions.append('%s: %.2f MB/s, was %.2f MB/s' % (
+                name, result['mb_per_s'], old['mb_per_s']))
+        if result['peak_rss_mb'] > old['peak_rss_mb'] * (1 + tolerance):
+            regressions.append('%s: peak RSS %.1f MB, was %.1f MB' % (
+                name, result['peak_rss_mb'], old['peak_rss_mb']))
+    return regressions
+
+
+def split(text):
+    return [x.strip() for x in text.split(',') if x.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', default='1MB,16MB')
+    parser.add_argument('--shapes', default='narrow,wide')
+    parser.add_argument('--dialects', default='comma')
+    parser.add_argument('--variants', default='clean')
+    parser.add_argument('--compressions', default='none',
+                        help='none, gzip, bzip2 or zstd uploads of the same files')
+    parser.add_argument('--stages', default=','.join(STAGES))
+    parser.add_argument('--matrix', action='store_true',
+                        help='every size from 1MB to 3GiB, shape, dialect and variant')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'byod_dvt_bench'),
+                        help='generated files are kept here and reused')
+    parser.add_argument('--output', help='JSON results file, stdout by default')
+    parser.add_argument('--baseline', help='JSON results to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    if args.matrix:
+        args.sizes = MATRIX_SIZES
+        args.shapes = ','.join(sorted(generate.SHAPES))
+        args.dialects = ','.join(sorted(generate.DIALECTS))
+        args.variants = ','.join(generate.VARIANTS)
+    stages = split(args.stages)
+    for stage in stages:
+        if stage not in STAGES:
+            parser.error('unknown stage %s, expected one of %s' % (stage, ', '.join(STAGES)))
+    for compression in split(args.compressions):
+        if compression not in generate.COMPRESSIONS:
+            parser.error('unknown compression %s, expected one of %s' % (
+                compression, ', '.join(sorted(generate.COMPRESSIONS))))
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for size in split(args.sizes):
+        for shape in split(args.shapes):
+            for dialect in split(args.dialects):
+                for variant in split(args.variants):
+                    for compression in split(args.compressions):
+                        size_bytes = generate.parse_size(size)
+                        path = generate.case_filename(
+                            args.data_dir, size_bytes, shape, dialect, variant, args.seed)
+                        if not os.path.exists(path):
+                            print('Generating %s...' % (path), file=sys.stderr)
+                            generate.generate(path + '.tmp', size_bytes, shape, dialect,
+                                              variant, args.seed)
+                            os.rename(path + '.tmp', path)
+                        stored = generate.case_filename(args.data_dir, size_bytes, shape, dialect,
+                                                        variant, args.seed, compression)
+                        if not os.path.exists(stored):
+                            print('Compressing %s...' % (stored), file=sys.stderr)
+                            generate.compress(path, stored + '.tmp', compression)
+                            os.rename(stored + '.tmp', stored)
+                        # throughput is of the CSV, the stored size is what S3 serves
+                        case = {
+                            'size': size,
+                            'size_bytes': os.path.getsize(path),
+                            'stored_bytes': os.path.getsize(stored),
+                            'shape': shape,
+                            'dialect': dialect,
+                            'variant': variant,
+                            'compression': compression,
+                            'seed': args.seed
+                        }
+
+                        for stage in stages:
+                            runs = []
+                            errors = []
+                            for _ in range(args.repeat):
+                                with context.Pool(1) as pool:
+                                    try:
+                                        runs.append(pool.apply(run_stage, (stored, stage)))
+                                    except Exception as e:
+                                        errors.append('%s: %s' % (type(e).__name__, e))
+                            result = summarize(case, stage, runs, errors)
+                            results.append(result)
+                            print('%s %s %s %s %s %s: %s MB/s, p50 %s s, peak RSS %s MB%s' % (
+                                size, shape, dialect, variant, compression, stage, result.get('mb_per_s'),
+                                result.get('latency_s', {}).get('p50'), result.get('peak_rss_mb'),
+                                ', %d errors' % (len(errors)) if errors else ''), file=sys.stderr)
+
+    report = {
+        'created': datetime.datetime.utcnow().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'repeat': args.repeat,
+        'results': results
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print('Regression %s' % (line), file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
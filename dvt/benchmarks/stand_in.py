@@ -0,0 +1,126 @@
+'''Local S3, SQS and DynamoDB for running the workers without a network.
+
+Everything lives in memory through moto, in the current process. Call
+start() before load_worker(), the workers create their boto3 clients and
+read their configuration when they are imported.
+'''
+import os
+import sys
+import datetime
+import importlib.util
+import boto3
+
+try:
+    from moto import mock_aws
+    MOCKS = [mock_aws]
+except ImportError:
+    from moto import mock_s3, mock_sqs, mock_dynamodb2
+    MOCKS = [mock_s3, mock_sqs, mock_dynamodb2]
+
+FARGATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           '..', 'byod_dvt', 'fargate')
+
+REGION = 'us-east-1'
+SOURCE_BUCKET_NAME = 'bench-source'
+TARGET_BUCKET_NAME = 'bench-target'
+TABLE_NAME = 'bench-jobs'
+
+
+class StandIn:
+    '''The buckets, job table and queues the workers expect'''
+
+    def __init__(self):
+        self.mocks = []
+        self.s3 = None
+        self.table = None
+        self.queue_url = None
+        self.profiling_queue_url = None
+
+    def start(self):
+        # moto refuses to run with real credentials around
+        for name in ['AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY', 'AWS_SECURITY_TOKEN',
+                     'AWS_SESSION_TOKEN']:
+            os.environ[name] = 'testing'
+        os.environ['AWS_DEFAULT_REGION'] = REGION
+        self.mocks = [mock() for mock in MOCKS]
+        for mock in self.mocks:
+            mock.start()
+
+        self.s3 = boto3.client('s3', region_name=REGION)
+        self.s3.create_bucket(Bucket=SOURCE_BUCKET_NAME)
+        self.s3.put_bucket_versioning(
+            Bucket=SOURCE_BUCKET_NAME, VersioningConfiguration={'Status': 'Enabled'})
+        self.s3.create_bucket(Bucket=TARGET_BUCKET_NAME)
+
+        dynamodb = boto3.resource('dynamodb', region_name=REGION)
+        self.table = dynamodb.create_table(
+            TableName=TABLE_NAME,
+            KeySchema=[{'AttributeName': 'id', 'KeyType': 'HASH'}],
+            AttributeDefinitions=[{'AttributeName': 'id', 'AttributeType': 'S'}],
+            BillingMode='PAY_PER_REQUEST'
+        )
+
+        sqs = boto3.client('sqs', region_name=REGION)
+        self.queue_url = sqs.create_queue(QueueName='bench-validation')['QueueUrl']
+        self.profiling_queue_url = sqs.create_queue(QueueName='bench-profiling')['QueueUrl']
+
+        os.environ.update({
+            'TABLE_NAME': TABLE_NAME,
+            'QUEUE_URL': self.queue_url,
+            'PROFILING_QUEUE_URL': self.profiling_queue_url,
+            'SOURCE_BUCKET_NAME': SOURCE_BUCKET_NAME,
+            'TARGET_BUCKET_NAME': TARGET_BUCKET_NAME,
+            'REGION': REGION
+        })
+        # every run has to do the work
+        os.environ.pop('CACHE_TABLE_NAME', None)
+        return self
+
+    def stop(self):
+        for mock in reversed(self.mocks):
+            mock.stop()
+        self.mocks = []
+
+    def add_job(self, job_id, path, **extra):
+        '''Uploads the file at path and creates its job, as the trigger does'''
+        key = 'upload/%s' % (os.path.basename(path))
+        self.s3.upload_file(path, SOURCE_BUCKET_NAME, key)
+        version = self.s3.head_object(Bucket=SOURCE_BUCKET_NAME, Key=key)['VersionId']
+
+        d = datetime.datetime.utcnow()
+        item = {
+            'id': job_id,
+            'start_ts': d.isoformat(),
+            'createdAt': d.isoformat() + 'Z',
+            'updatedAt': d.isoformat() + 'Z',
+            'filename': key,
+            'filename_version': version,
+            'status': 'pending',
+            'warnings': 0,
+            'errors': 0,
+            'staged': 'no'
+        }
+        item.update(extra)
+        self.table.put_item(Item=item)
+        return item
+
+    def job(self, job_id):
+        return self.table.get_item(Key={'id': job_id})['Item']
+
+
+def load_worker(name):
+    '''Imports fargate/<name>/src/app.py as <name>_app, the way the
+    container runs it'''
+    module_name = '%s_app' % (name)
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+
+    src = os.path.abspath(os.path.join(FARGATE_DIR, name, 'src'))
+    for path in [os.path.abspath(FARGATE_DIR), src]:
+        if path not in sys.path:
+            sys.path.insert(0, path)
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(src, 'app.py'))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
@@ -13,6 +13,7 @@ from aws_cdk import (
     aws_ecr_assets as _ecr_assets
 )
 from aws_cdk.aws_lambda_event_sources import S3EventSource as _S3EventSource
+from aws_cdk.aws_lambda_event_sources import SqsEventSource as _SqsEventSource
 from aws_cdk.aws_appsync import AuthorizationConfig, AuthorizationMode, AuthorizationType, UserPoolConfig, LogConfig, FieldLogLevel
 from aws_cdk.aws_iam import FederatedPrincipal, PolicyStatement, Effect
 import os
@@ -36,7 +37,23 @@ class ByodDvtStack(core.Stack):
         target_csv_bucket = _s3.Bucket(
             self,
             "BYODValidationTargetBucket",
-            removal_policy=core.RemovalPolicy.RETAIN
+            removal_policy=core.RemovalPolicy.RETAIN,
+            lifecycle_rules=[
+                # parsed rows handed from validation to profiling
+                _s3.LifecycleRule(
+                    prefix="intermediate/",
+                    expiration=core.Duration.days(30)
+                ),
+                # plans and results of shards of jobs that never merged
+                _s3.LifecycleRule(
+                    prefix="shards/",
+                    expiration=core.Duration.days(7)
+                ),
+                # reports and staged copies of jobs that died mid-upload
+                _s3.LifecycleRule(
+                    abort_incomplete_multipart_upload_after=core.Duration.days(1)
+                )
+            ]
         )
 
         ### Cognito ###
@@ -145,6 +162,18 @@ class ByodDvtStack(core.Stack):
             )
         )
 
+        # results of earlier jobs keyed by object content and job settings
+        result_cache_table = _dynamodb.Table(
+            self,
+            "ResultCacheTable",
+            partition_key=_dynamodb.Attribute(
+                name="cache_key",
+                type=_dynamodb.AttributeType.STRING
+            ),
+            billing_mode=_dynamodb.BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute="expires_at"
+        )
+
         ## AppSync ###
 
         api = _appsync.GraphqlApi(
@@ -170,9 +199,32 @@ class ByodDvtStack(core.Stack):
 
         ### SQS ###
 
+        # jobs that keep failing are parked instead of retried forever
+        max_receives = 3
+        validation_job_dlq = _sqs.Queue(
+            self,
+            "ValidationJobDeadLetterQueue"
+        )
+
         validation_job_queue = _sqs.Queue(
             self,
-            "ValidationJobQueue"
+            "ValidationJobQueue",
+            visibility_timeout=core.Duration.minutes(5),
+            dead_letter_queue=_sqs.DeadLetterQueue(
+                max_receive_count=max_receives,
+                queue=validation_job_dlq
+            )
+        )
+
+        # small files, validated by a Lambda function instead of Fargate
+        fast_validation_job_queue = _sqs.Queue(
+            self,
+            "FastValidationJobQueue",
+            visibility_timeout=core.Duration.minutes(6),
+            dead_letter_queue=_sqs.DeadLetterQueue(
+                max_receive_count=max_receives,
+                queue=validation_job_dlq
+            )
         )
 
         profiling_job_queue = _sqs.Queue(
@@ -195,6 +247,9 @@ class ByodDvtStack(core.Stack):
             "TABLE_NAME", validation_job_table.table_name)
         validation_trigger_function.add_environment(
             "QUEUE_URL", validation_job_queue.queue_url)
+        validation_trigger_function.add_environment(
+            "FAST_QUEUE_URL", fast_validation_job_queue.queue_url)
+        validation_trigger_function.add_environment("FAST_PATH_MAX_MB", "16")
 
         validation_trigger_function.add_event_source(
             _S3EventSource(
@@ -206,6 +261,58 @@ class ByodDvtStack(core.Stack):
         source_csv_bucket.grant_read(validation_trigger_function)
         validation_job_table.grant_read_write_data(validation_trigger_function)
         validation_job_queue.grant_send_messages(validation_trigger_function)
+        fast_validation_job_queue.grant_send_messages(validation_trigger_function)
+
+        # the validation app and its rules, without the container
+        validation_function = _lambda.Function(
+            self,
+            "ValidationFunction",
+            runtime=_lambda.Runtime.PYTHON_3_8,
+            code=_lambda.Code.from_asset(
+                os.path.join(dirname, "fargate"),
+                bundling=core.BundlingOptions(
+                    image=_lambda.Runtime.PYTHON_3_8.bundling_docker_image,
+                    command=["bash", "-c", " && ".join([
+                        "pip install -r validation/lambda_requirements.txt -t /asset-output",
+                        # tests and the Arrow modules the rules never load
+                        "find /asset-output -type d -name tests -prune -exec rm -rf {} +",
+                        "rm -f /asset-output/pyarrow/libgandiva* /asset-output/pyarrow/libarrow_flight* /asset-output/pyarrow/libplasma*",
+                        "cp -r validation/src/. /asset-output",
+                        "cp -r common /asset-output",
+                        # the function can not write bytecode, nor check it against
+                        # file times the asset does not keep
+                        "python -m compileall -q --invalidation-mode unchecked-hash /asset-output"
+                    ])]
+                )
+            ),
+            handler='lambda_function.lambda_handler',
+            memory_size=3008,
+            timeout=core.Duration.minutes(1)
+        )
+
+        validation_function.add_environment(
+            "TABLE_NAME", validation_job_table.table_name)
+        validation_function.add_environment(
+            "QUEUE_URL", fast_validation_job_queue.queue_url)
+        validation_function.add_environment(
+            "PROFILING_QUEUE_URL", profiling_job_queue.queue_url)
+        validation_function.add_environment(
+            "SOURCE_BUCKET_NAME", source_csv_bucket.bucket_name)
+        validation_function.add_environment(
+            "TARGET_BUCKET_NAME", target_csv_bucket.bucket_name)
+        validation_function.add_environment("REGION", self.region)
+        validation_function.add_environment(
+            "CACHE_TABLE_NAME", result_cache_table.table_name)
+        validation_function.add_environment("SHARD_SIZE_MB", "0")
+
+        validation_function.add_event_source(
+            _SqsEventSource(fast_validation_job_queue, batch_size=1))
+
+        source_csv_bucket.grant_read(validation_function)
+        target_csv_bucket.grant_read_write(validation_function)
+        validation_job_table.grant_read_write_data(validation_function)
+        result_cache_table.grant_read_write_data(validation_function)
+        profiling_job_queue.grant_send_messages(validation_function)
 
         stager_function = _lambda.Function(
             self,
@@ -213,7 +320,8 @@ class ByodDvtStack(core.Stack):
             runtime=_lambda.Runtime.NODEJS_12_X,
             code=_lambda.Code.from_asset(
                 os.path.join(dirname, "lambda", "stager")),
-            handler='index.handler'
+            handler='index.handler',
+            timeout=core.Duration.minutes(15)
         )
 
         stager_function.add_environment("REGION", self.region)
@@ -221,20 +329,27 @@ class ByodDvtStack(core.Stack):
             "SOURCE_BUCKET", source_csv_bucket.bucket_name)
         stager_function.add_environment(
             "STAGE_BUCKET", target_csv_bucket.bucket_name)
+        stager_function.add_environment(
+            "TABLE_NAME", validation_job_table.table_name)
+        stager_function.add_environment("STAGE_PART_SIZE_MB", "64")
+        stager_function.add_environment("STAGE_CONCURRENCY", "16")
         source_csv_bucket.grant_read(stager_function)
         target_csv_bucket.grant_put(stager_function)
+        validation_job_table.grant_read_write_data(stager_function)
 
         ### ECS Fargate ###
 
         validation_fargate_asset = _ecr_assets.DockerImageAsset(
             self,
             "ValidationBuildImage",
-            directory=os.path.join(dirname, "fargate", "validation")
+            directory=os.path.join(dirname, "fargate"),
+            file=os.path.join("validation", "Dockerfile")
         )
         profiling_fargate_asset = _ecr_assets.DockerImageAsset(
             self,
             "ProfilingBuildImage",
-            directory=os.path.join(dirname, "fargate", "profiling")
+            directory=os.path.join(dirname, "fargate"),
+            file=os.path.join("profiling", "Dockerfile")
         )
 
         vpc = _ec2.Vpc(self, "VPC", max_azs=3)
@@ -256,9 +371,13 @@ class ByodDvtStack(core.Stack):
             environment={
                 "TABLE_NAME": validation_job_table.table_name,
                 "QUEUE_URL": validation_job_queue.queue_url,
+                "PROFILING_QUEUE_URL": profiling_job_queue.queue_url,
                 "SOURCE_BUCKET_NAME": source_csv_bucket.bucket_name,
                 "TARGET_BUCKET_NAME": target_csv_bucket.bucket_name,
-                "REGION": self.region
+                "REGION": self.region,
+                "CACHE_TABLE_NAME": result_cache_table.table_name,
+                "SHARD_SIZE_MB": "256",
+                "MAX_RECEIVES": str(max_receives)
             },
             queue=validation_job_queue,
             max_scaling_capacity=2,
@@ -269,6 +388,11 @@ class ByodDvtStack(core.Stack):
             _iam.ManagedPolicy.from_aws_managed_policy_name("AmazonDynamoDBFullAccess"))
         validation_fargate_service.task_definition.task_role.add_managed_policy(
             _iam.ManagedPolicy.from_aws_managed_policy_name("AmazonS3FullAccess"))
+        profiling_job_queue.grant_send_messages(
+            validation_fargate_service.task_definition.task_role)
+        # shards of large files go back on the validation queue
+        validation_job_queue.grant_send_messages(
+            validation_fargate_service.task_definition.task_role)
 
         profiling_fargate_service = _ecs_patterns.QueueProcessingFargateService(
             self,
@@ -284,7 +408,8 @@ class ByodDvtStack(core.Stack):
                 "QUEUE_URL": profiling_job_queue.queue_url,
                 "SOURCE_BUCKET_NAME": source_csv_bucket.bucket_name,
                 "TARGET_BUCKET_NAME": target_csv_bucket.bucket_name,
-                "REGION": self.region
+                "REGION": self.region,
+                "CACHE_TABLE_NAME": result_cache_table.table_name
             },
             queue=profiling_job_queue,
             max_scaling_capacity=2,
@@ -0,0 +1,13 @@
+from .startup import report_startup
+from .startup import import_modules
+from .startup import preload
+from .s3_reader import RangedS3Reader
+from .s3_reader import get_object
+from .s3_reader import object_url
+from .compression import DecompressionError
+from .sqs_consumer import SqsConsumer
+from .result_cache import ResultCache
+from .result_cache import source_fingerprint
+from .dialect import read_csv_args
+from .dialect import csv_reader_args
+from .metrics import JobMetrics
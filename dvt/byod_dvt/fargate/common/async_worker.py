@@ -0,0 +1,176 @@
+import signal
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from aiobotocore.session import get_session
+from aiobotocore.config import AioConfig
+from boto3.dynamodb.types import TypeDeserializer
+from boto3.dynamodb.types import TypeSerializer
+from .sqs_consumer import cpu_count
+from .sqs_consumer import MAX_BATCH_SIZE
+from .sqs_consumer import MAX_WAIT_TIME
+from .startup import report_startup
+from .startup import import_modules
+
+_serializer = TypeSerializer()
+_deserializer = TypeDeserializer()
+
+
+def to_attributes(values):
+    '''Plain values to DynamoDB attribute values, as the resource API does'''
+    return dict((key, _serializer.serialize(value)) for key, value in values.items())
+
+
+def from_attributes(item):
+    return dict((key, _deserializer.deserialize(value)) for key, value in item.items())
+
+
+class AsyncClients:
+    '''aiobotocore clients sharing one session and connection pool size'''
+
+    def __init__(self, sqs, dynamodb):
+        self.sqs = sqs
+        self.dynamodb = dynamodb
+
+    async def get_item(self, table_name, key):
+        response = await self.dynamodb.get_item(TableName=table_name, Key=to_attributes(key))
+        return from_attributes(response['Item']) if 'Item' in response else None
+
+    async def update_item(self, table_name, key, UpdateExpression, ExpressionAttributeValues,
+                          **kwargs):
+        '''Takes the same plain values as Table.update_item()'''
+        return await self.dynamodb.update_item(
+            TableName=table_name,
+            Key=to_attributes(key),
+            UpdateExpression=UpdateExpression,
+            ExpressionAttributeValues=to_attributes(ExpressionAttributeValues),
+            **kwargs
+        )
+
+
+class AsyncWorker:
+    '''Runs queued jobs with every control-plane call on one asyncio loop.
+
+    A job comes in three parts: the coroutine prepare(clients, message)
+    loads what the job needs and returns the arguments of work(), or None
+    to skip it; work(*args) does the data work in a process pool; and the
+    coroutine complete(clients, message, args, result) writes the outcome.
+    Up to workers + prefetch jobs are in flight, so while the pool works
+    on some jobs the loop already prepares the next ones and completes
+    and deletes the finished ones. Messages are kept invisible by a
+    heartbeat and deleted once complete() returned, a job that raises is
+    left on the queue to be retried. The pool imports the modules in
+    preload as soon as it starts.
+    '''
+
+    def __init__(self, region, queue_url, prepare, work, complete, workers=None,
+                 prefetch=None, visibility_timeout=300, preload=None):
+        self.region = region
+        self.queue_url = queue_url
+        self.prepare = prepare
+        self.work = work
+        self.complete = complete
+        self.workers = workers or cpu_count()
+        self.slots = self.workers + (self.workers if prefetch is None else prefetch)
+        self.visibility_timeout = visibility_timeout
+        self.preload = preload or []
+        self.in_flight = {}
+        self.stopping = None
+
+    def run(self):
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(self._run(loop))
+
+    def stop(self):
+        self.stopping.set()
+
+    async def _run(self, loop):
+        self.stopping = asyncio.Event()
+        loop.add_signal_handler(signal.SIGTERM, self.stop)
+
+        # spawn so that jobs never share connections with the loop
+        pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('spawn'))
+        if self.preload:
+            for _ in range(self.workers):
+                pool.submit(import_modules, self.preload)
+        session = get_session()
+        config = AioConfig(max_pool_connections=max(self.slots * 2, 10))
+        async with session.create_client('sqs', region_name=self.region, config=config) as sqs, \
+                session.create_client('dynamodb', region_name=self.region, config=config) as dynamodb:
+            clients = AsyncClients(sqs, dynamodb)
+            heartbeat = asyncio.ensure_future(self._heartbeat(sqs))
+
+            jobs = set()
+            while not self.stopping.is_set():
+                free = self.slots - len(jobs)
+                if free == 0:
+                    _, jobs = await asyncio.wait(jobs, return_when=asyncio.FIRST_COMPLETED)
+                    continue
+                for message in await self._receive(sqs, min(free, MAX_BATCH_SIZE)):
+                    if message['MessageId'] in self.in_flight:
+                        # redelivered while still running here
+                        self.in_flight[message['MessageId']] = message['ReceiptHandle']
+                        continue
+                    self.in_flight[message['MessageId']] = message['ReceiptHandle']
+                    jobs.add(asyncio.ensure_future(self._job(loop, pool, clients, message)))
+                jobs = set(job for job in jobs if not job.done())
+
+            print('Stopping, waiting for %d running jobs...' % (len(jobs)))
+            if jobs:
+                await asyncio.wait(jobs)
+            heartbeat.cancel()
+        pool.shutdown()
+
+    async def _receive(self, sqs, max_messages):
+        report_startup()
+        try:
+            response = await sqs.receive_message(
+                QueueUrl=self.queue_url,
+                AttributeNames=[
+                    'SentTimestamp',
+                    'ApproximateReceiveCount'
+                ],
+                MaxNumberOfMessages=max_messages,
+                MessageAttributeNames=[
+                    'All'
+                ],
+                VisibilityTimeout=self.visibility_timeout,
+                WaitTimeSeconds=MAX_WAIT_TIME
+            )
+        except Exception as error:
+            print('Receive failed: %s' % (error))
+            await asyncio.sleep(1)
+            return []
+        return response.get('Messages', [])
+
+    async def _job(self, loop, pool, clients, message):
+        try:
+            args = await self.prepare(clients, message)
+            if args is not None:
+                result = await loop.run_in_executor(pool, self.work, *args)
+                await self.complete(clients, message, args, result)
+            await clients.sqs.delete_message(
+                QueueUrl=self.queue_url,
+                ReceiptHandle=self.in_flight[message['MessageId']]
+            )
+        except Exception as error:
+            print('Uncaught exception: %s' % (error))
+        finally:
+            self.in_flight.pop(message['MessageId'], None)
+
+    async def _heartbeat(self, sqs):
+        while True:
+            await asyncio.sleep(self.visibility_timeout / 3)
+            entries = [{'Id': message_id, 'ReceiptHandle': receipt_handle,
+                        'VisibilityTimeout': self.visibility_timeout}
+                       for message_id, receipt_handle in self.in_flight.items()]
+            for i in range(0, len(entries), MAX_BATCH_SIZE):
+                try:
+                    await sqs.change_message_visibility_batch(
+                        QueueUrl=self.queue_url,
+                        Entries=entries[i:i + MAX_BATCH_SIZE]
+                    )
+                except Exception as error:
+                    print('Heartbeat failed: %s' % (error))
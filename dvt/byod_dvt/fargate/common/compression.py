@@ -0,0 +1,512 @@
+import io
+import os
+import re
+import bz2
+import zlib
+import queue
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
+from .sqs_consumer import cpu_count
+
+MiB = 1024 * 1024
+
+# Compressed bytes read at a time, and the most decompressed in one go
+DECOMPRESS_CHUNK_SIZE = int(os.environ.get('DECOMPRESS_CHUNK_MB', '4')) * MiB
+
+# Threads decompressing the members of multi-member files, 0 for every core
+DECOMPRESS_WORKERS = int(os.environ.get('DECOMPRESS_WORKERS', '0'))
+
+# Bytes needed to recognize every codec
+MAGIC_SIZE = 10
+
+EXTENSIONS = {
+    '.gz': 'gzip',
+    '.gzip': 'gzip',
+    '.bz2': 'bzip2',
+    '.zst': 'zstd',
+    '.zstd': 'zstd'
+}
+
+CONTENT_ENCODINGS = {
+    'gzip': 'gzip',
+    'x-gzip': 'gzip',
+    'bzip2': 'bzip2',
+    'x-bzip2': 'bzip2',
+    'zstd': 'zstd'
+}
+
+
+class DecompressionError(ValueError):
+    pass
+
+
+class _BZ2Streams:
+    '''Finds where the streams of a multi-stream bzip2 file start'''
+
+    # a stream header and its first block, or the end of an empty stream
+    SIGNATURE = re.compile(b'BZh[1-9](?:1AY&SY|\x17rE8P\x90)')
+
+    # a signature is only found once all of it came
+    lookahead = MAGIC_SIZE - 1
+
+    def __init__(self):
+        self.offset = 0
+        self.carry = b''
+        self.found = 0
+
+    def feed(self, chunk):
+        data = self.carry + chunk
+        start = self.offset - len(self.carry)
+        self.offset += len(chunk)
+        boundaries = []
+        for match in self.SIGNATURE.finditer(data):
+            position = start + match.start()
+            if position > self.found:
+                boundaries.append(position)
+                self.found = position
+        self.carry = data[-(MAGIC_SIZE - 1):]
+        return boundaries
+
+    def finish(self):
+        pass
+
+
+class _ZstdFrames:
+    '''Finds where zstd frames end by walking their frame and block headers,
+    without decompressing anything'''
+
+    lookahead = 0
+
+    def __init__(self):
+        self.offset = 0
+        self.carry = b''
+        # the next header, of a frame or of a block
+        self.next = 0
+        self.in_frame = False
+        self.checksum = False
+
+    def feed(self, chunk):
+        data = self.carry + chunk
+        start = self.offset - len(self.carry)
+        self.offset += len(chunk)
+        boundaries = []
+        while True:
+            at = self.next - start
+            if self.in_frame:
+                if at + 3 > len(data):
+                    break
+                header = data[at] | data[at + 1] << 8 | data[at + 2] << 16
+                kind = (header >> 1) & 3
+                if kind == 3:
+                    raise DecompressionError('Invalid zstd block at byte %d' % (self.next))
+                # RLE blocks hold a single byte
+                self.next += 3 + (1 if kind == 1 else header >> 3)
+                if header & 1:
+                    self.next += 4 if self.checksum else 0
+                    self.in_frame = False
+                    boundaries.append(self.next)
+            else:
+                if at + 8 > len(data):
+                    if at + 5 > len(data) or data[at:at + 4] != b'\x28\xb5\x2f\xfd':
+                        break
+                magic = data[at:at + 4]
+                if magic[1:] == b'\x2a\x4d\x18' and magic[0] & 0xf0 == 0x50:
+                    # skippable frame, metadata only
+                    self.next += 8 + int.from_bytes(data[at + 4:at + 8], 'little')
+                    boundaries.append(self.next)
+                    continue
+                if magic != b'\x28\xb5\x2f\xfd':
+                    raise DecompressionError('Not zstd data at byte %d' % (self.next))
+                descriptor = data[at + 4]
+                single_segment = descriptor >> 5 & 1
+                self.checksum = bool(descriptor >> 2 & 1)
+                self.next += 5 + (1 - single_segment) + [0, 1, 2, 4][descriptor & 3] + \
+                    [single_segment, 2, 4, 8][descriptor >> 6]
+                self.in_frame = True
+        self.carry = data[self.next - start:] if self.next - start < len(data) else b''
+        return boundaries
+
+    def finish(self):
+        if self.in_frame or self.next != self.offset:
+            raise DecompressionError('zstd data ends in the middle of a frame')
+
+
+class _Gzip:
+    '''Decompresses one gzip member, emitting at most limit bytes at a time.
+
+    feed() returns the input after the end of the member, once eof is set.
+    '''
+
+    def __init__(self, limit):
+        self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self.limit = limit
+        self.eof = False
+
+    def feed(self, data, emit):
+        while True:
+            output = self.decompressor.decompress(data, self.limit)
+            if output:
+                emit(output)
+            # the input that did not fit in limit bytes of output
+            data = self.decompressor.unconsumed_tail
+            if self.decompressor.eof:
+                self.eof = True
+                return self.decompressor.unused_data
+            if not data and len(output) < self.limit:
+                return b''
+
+
+class _BZ2:
+    '''Decompresses one bzip2 stream, like _Gzip'''
+
+    def __init__(self, limit):
+        self.decompressor = bz2.BZ2Decompressor()
+        self.limit = limit
+        self.eof = False
+
+    def feed(self, data, emit):
+        while True:
+            output = self.decompressor.decompress(data, self.limit)
+            if output:
+                emit(output)
+            data = b''
+            if self.decompressor.eof:
+                self.eof = True
+                return self.decompressor.unused_data
+            if self.decompressor.needs_input:
+                return b''
+
+
+class _Zstd:
+    '''Decompresses one zstd frame, like _Gzip, through zstandard's writer
+    that hands out write_size bytes at a time'''
+
+    def __init__(self, limit):
+        try:
+            import zstandard
+        except ImportError:
+            raise DecompressionError('zstd compressed files need the zstandard package')
+        self.writer = zstandard.ZstdDecompressor().stream_writer(self, write_size=limit)
+        self.error = zstandard.ZstdError
+        self.emit = None
+        # frames are always fed whole, the reader knows where they end
+        self.eof = False
+
+    def feed(self, data, emit):
+        self.emit = emit
+        try:
+            self.writer.write(data)
+        except self.error as e:
+            raise DecompressionError('Invalid zstd data: %s' % (e))
+        return b''
+
+    def write(self, data):
+        # called by the writer with the output
+        self.emit(data)
+        return len(data)
+
+
+CODECS = {
+    'gzip': {
+        'name': 'gzip',
+        'magic': re.compile(rb'\x1f\x8b'),
+        'decompressor': _Gzip,
+        # gzip members can not be found without inflating them
+        'splitter': None
+    },
+    'bzip2': {
+        'name': 'bzip2',
+        'magic': _BZ2Streams.SIGNATURE,
+        'decompressor': _BZ2,
+        'splitter': _BZ2Streams
+    },
+    'zstd': {
+        'name': 'zstd',
+        'magic': re.compile(rb'\x28\xb5\x2f\xfd|[\x50-\x5f]\x2a\x4d\x18'),
+        'decompressor': _Zstd,
+        'splitter': _ZstdFrames
+    }
+}
+
+
+def detect_compression(key, content_encoding=None, head=b''):
+    '''Codec of an object from its first bytes, None for plain files.
+
+    The name and Content-Encoding only tell what the object should be,
+    the magic bytes what it is.
+    '''
+    found = None
+    for name, codec in CODECS.items():
+        if codec['magic'].match(head):
+            found = name
+    declared = CONTENT_ENCODINGS.get((content_encoding or '').lower(),
+                                     EXTENSIONS.get(os.path.splitext(key.lower())[1]))
+    if declared is not None and found is None and head:
+        print('%s should be %s compressed but is not, reading it as is' % (key, declared))
+    return found
+
+
+class _Member:
+    '''Decompresses one member fed in pieces, and the members after it in
+    the same pieces when the codec finds its own ends. The output goes to
+    emit, at most limit bytes at a time.'''
+
+    def __init__(self, codec, limit):
+        self.codec = codec
+        self.limit = limit
+        self.decompressor = None
+
+    def feed(self, data, emit):
+        try:
+            while data:
+                if self.decompressor is None:
+                    # gzip pads with zeros after the last member, no member
+                    # starts with one
+                    data = data.lstrip(b'\0')
+                    if not data:
+                        break
+                    self.decompressor = self.codec['decompressor'](self.limit)
+                data = self.decompressor.feed(data, emit)
+                if self.decompressor.eof:
+                    self.decompressor = None
+        except (zlib.error, OSError, EOFError) as e:
+            raise DecompressionError('Invalid %s data: %s' % (self.codec['name'], e))
+
+    def end(self):
+        if self.codec['name'] != 'zstd' and self.decompressor is not None:
+            raise DecompressionError('%s data ends in the middle of a member' % (self.codec['name']))
+        self.decompressor = None
+
+
+def _decompress_members(codec, limit, members, emit):
+    member = _Member(codec, limit)
+    for data in members:
+        member.feed(data, emit)
+        member.end()
+
+
+def _feed_member(member, data, end, emit):
+    member.feed(data, emit)
+    if end:
+        member.end()
+
+
+class _Closed(Exception):
+    pass
+
+
+class _Part:
+    '''The output of one task of the reader, handed over a piece at a time.
+    The task waits while PIECES_AHEAD of its pieces are not read yet.'''
+
+    PIECES_AHEAD = 2
+
+    def __init__(self, closed):
+        self.pieces = queue.Queue(self.PIECES_AHEAD)
+        self.closed = closed
+        self.future = None
+
+    def run(self, work, *args):
+        try:
+            work(*args, emit=self.put)
+            self.put(None)
+        except _Closed:
+            pass
+        except Exception as e:
+            try:
+                self.put(e)
+            except _Closed:
+                pass
+
+    def put(self, piece):
+        while True:
+            if self.closed.is_set():
+                raise _Closed()
+            try:
+                self.pieces.put(piece, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def get(self):
+        '''The next piece, None after the last'''
+        piece = self.pieces.get()
+        if isinstance(piece, Exception):
+            raise piece
+        return piece
+
+
+class DecompressingReader(io.RawIOBase):
+    '''Read-only file object over the decompressed content of another.
+
+    Members that bzip2 and zstd files are made of, streams and frames, are
+    found without decompressing them, and whole members are decompressed
+    by a pool of threads, in order, up to workers at a time. A member
+    bigger than chunk_size, and every gzip file, is decompressed in pieces
+    on one thread instead, still ahead of the reader. No task outputs more
+    than chunk_size bytes at a time or gets far ahead of the reader, so
+    however well the data compresses, memory stays within a few
+    chunk_size per worker.
+    '''
+
+    def __init__(self, raw, codec, chunk_size=DECOMPRESS_CHUNK_SIZE, workers=DECOMPRESS_WORKERS):
+        self.raw = raw
+        self.codec = CODECS[codec]
+        self.chunk_size = chunk_size
+        self.splitter = self.codec['splitter']() if self.codec['splitter'] else None
+        self.workers = workers or cpu_count()
+        self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        # pieces of a member that is too big to wait for, in order
+        self.serial = ThreadPoolExecutor(max_workers=1)
+        self.streamed = _Member(self.codec, chunk_size)
+        self.stopped = threading.Event()
+        self.pending = collections.deque()
+        self.boundaries = collections.deque()
+        self.offset = 0
+        self.member = []
+        self.member_size = 0
+        self.streaming = False
+        self.batch = []
+        self.batch_size = 0
+        self.raw_done = False
+        self.held = b''
+        self.buffer = memoryview(b'')
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return self.readall()
+
+        chunks = []
+        remaining = size
+        while remaining > 0:
+            if not self.buffer and not self._next_part():
+                break
+            chunk = self.buffer[:remaining]
+            self.buffer = self.buffer[len(chunk):]
+            chunks.append(chunk)
+            remaining -= len(chunk)
+
+        data = b''.join(chunks)
+        self.position += len(data)
+        return data
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def readall(self):
+        chunks = []
+        while self.buffer or self._next_part():
+            chunks.append(bytes(self.buffer))
+            self.buffer = memoryview(b'')
+        data = b''.join(chunks)
+        self.position += len(data)
+        return data
+
+    def peek(self, size=1):
+        if not self.buffer:
+            self._next_part()
+        return bytes(self.buffer[:size])
+
+    def close(self):
+        if not self.closed:
+            self.stopped.set()
+            for part in self.pending:
+                part.future.cancel()
+            self.pending.clear()
+            self.executor.shutdown(wait=False)
+            self.serial.shutdown(wait=False)
+            self.raw.close()
+            self.buffer = memoryview(b'')
+        super().close()
+
+    def _next_part(self):
+        while True:
+            self._schedule()
+            if not self.pending:
+                return False
+            piece = self.pending[0].get()
+            if piece is None:
+                self.pending.popleft()
+            elif piece:
+                self.buffer = memoryview(piece)
+                return True
+
+    def _schedule(self):
+        while len(self.pending) <= self.workers and not self.raw_done:
+            chunk = self.raw.read(self.chunk_size)
+            if not chunk:
+                self.raw_done = True
+                if self.splitter is not None:
+                    self.splitter.finish()
+                self._add(self.held)
+                self._end_member()
+                self._flush()
+                break
+
+            data = self.held + chunk
+            start = self.offset - len(self.held)
+            self.offset += len(chunk)
+            safe = self.offset
+            if self.splitter is not None:
+                self.boundaries.extend(self.splitter.feed(chunk))
+                # the bytes a boundary may still be found in wait for the next chunk
+                safe -= self.splitter.lookahead
+            at = 0
+            while self.boundaries and self.boundaries[0] <= safe:
+                end = self.boundaries.popleft() - start
+                self._add(data[at:end])
+                self._end_member()
+                at = end
+            self.held = data[max(safe - start, at):]
+            self._add(data[at:max(safe - start, at)])
+
+    def _add(self, data):
+        if not data:
+            return
+        self.member.append(data)
+        self.member_size += len(data)
+        if self.member_size > self.chunk_size:
+            # too big to hold until its end, decompress what came so far
+            self._flush()
+            self.streaming = True
+            self._stream(b''.join(self.member), end=False)
+            self.member = []
+            self.member_size = 0
+
+    def _end_member(self):
+        if self.streaming:
+            self._stream(b''.join(self.member), end=True)
+            self.streaming = False
+        elif self.member:
+            self.batch.append(b''.join(self.member))
+            self.batch_size += self.member_size
+            if self.batch_size >= self.chunk_size:
+                self._flush()
+        self.member = []
+        self.member_size = 0
+
+    def _flush(self):
+        if self.batch:
+            self._submit(self.executor, _decompress_members, self.codec, self.chunk_size, self.batch)
+            self.batch = []
+            self.batch_size = 0
+
+    def _stream(self, data, end):
+        self._submit(self.serial, _feed_member, self.streamed, data, end)
+
+    def _submit(self, executor, work, *args):
+        # tasks hold no reference to the reader, one that is dropped without
+        # close() is still closed when collected and stops them
+        part = _Part(self.stopped)
+        part.future = executor.submit(part.run, work, *args)
+        self.pending.append(part)
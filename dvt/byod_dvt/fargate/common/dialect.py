@@ -0,0 +1,39 @@
+# Assumed for jobs without a detected dialect
+DEFAULT_DIALECT = {
+    'delimiter': ',',
+    'quotechar': '"',
+    'escapechar': '',
+    'has_header': True
+}
+
+
+def _dialect(dialect):
+    dialect = dict(DEFAULT_DIALECT, **(dialect or {}))
+    # a single column file has no delimiter
+    dialect['delimiter'] = dialect['delimiter'] or ','
+    # no quote character is detected in a sample without quotes, quoted
+    # fields can still come after it
+    dialect['quotechar'] = dialect['quotechar'] or DEFAULT_DIALECT['quotechar']
+    return dialect
+
+
+def read_csv_args(dialect=None):
+    '''pd.read_csv arguments for a dialect stored on a job'''
+    dialect = _dialect(dialect)
+    args = {
+        'sep': dialect['delimiter'],
+        'quotechar': dialect['quotechar'],
+        'header': 0 if dialect['has_header'] else None
+    }
+    if dialect['escapechar']:
+        args['escapechar'] = dialect['escapechar']
+    return args
+
+
+def csv_reader_args(dialect=None):
+    '''csv.reader arguments for a dialect stored on a job'''
+    dialect = _dialect(dialect)
+    args = {'delimiter': dialect['delimiter'], 'quotechar': dialect['quotechar']}
+    if dialect['escapechar']:
+        args['escapechar'] = dialect['escapechar']
+    return args
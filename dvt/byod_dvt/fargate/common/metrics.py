@@ -0,0 +1,150 @@
+import os
+import sys
+import json
+import time
+import resource
+import contextlib
+
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'BYOD-DVT')
+
+
+def reset_peak_rss():
+    # writing 5 resets VmHWM on Linux, ru_maxrss can not be reset
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def peak_rss():
+    '''Peak resident memory of this process in bytes'''
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # kilobytes on Linux, bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def queue_wait_ms(message):
+    '''Time the SQS message spent in the queue, None without SentTimestamp'''
+    sent = ((message or {}).get('Attributes') or {}).get('SentTimestamp')
+    if sent is None:
+        return None
+    return max(int(time.time() * 1000) - int(sent), 0)
+
+
+class JobMetrics:
+    '''Stage timings and counters of one job.
+
+    Wrap each stage in stage(name), the time of a stage that runs more than
+    once adds up. summary() is what gets saved on the job item and emit()
+    logs the same numbers in CloudWatch embedded metric format, one line
+    for the job, one per stage and one per rule.
+    '''
+
+    def __init__(self, service, job_id, message=None):
+        self.service = service
+        self.job_id = job_id
+        self.queue_wait_ms = queue_wait_ms(message)
+        self.stages = {}
+        self.counters = {}
+        self.rules = {}
+        self.started = time.perf_counter()
+        self.peak_rss_bytes = 0
+        self.resume()
+
+    def resume(self):
+        '''Measures memory in this process from now on, for a job handed
+        to a pool after it started'''
+        self.pid = os.getpid()
+        # the pool's processes run one job after another
+        reset_peak_rss()
+
+    def sample_rss(self):
+        # only the process running the job knows its peak
+        if os.getpid() == self.pid:
+            self.peak_rss_bytes = max(self.peak_rss_bytes, peak_rss())
+        return self.peak_rss_bytes
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, (time.perf_counter() - started) * 1000)
+
+    def record(self, name, ms):
+        self.stages[name] = self.stages.get(name, 0) + int(ms)
+
+    def count(self, name, value):
+        self.counters[name] = self.counters.get(name, 0) + int(value)
+
+    def add_rule_metrics(self, metrics):
+        '''Takes the download, parse and rule timings of ValidationEngine.metrics'''
+        for name, stats in metrics.items():
+            if name == 'read':
+                self.record('download', stats['ms'])
+            elif name == 'dialect':
+                self.record('detect_dialect', stats['ms'])
+            elif name == 'parse':
+                self.record('parse', stats['ms'])
+            elif name != 'total':
+                self.rules[name] = stats
+
+    def summary(self):
+        summary = {
+            'total_ms': int((time.perf_counter() - self.started) * 1000),
+            'peak_rss_bytes': self.sample_rss(),
+            'stages': dict(self.stages)
+        }
+        if self.queue_wait_ms is not None:
+            summary['queue_wait_ms'] = self.queue_wait_ms
+        summary.update(self.counters)
+        return summary
+
+    def emit(self):
+        summary = self.summary()
+        job = {
+            'Duration': (summary['total_ms'], 'Milliseconds'),
+            'PeakRSS': (summary['peak_rss_bytes'], 'Bytes')
+        }
+        if self.queue_wait_ms is not None:
+            job['QueueWait'] = (self.queue_wait_ms, 'Milliseconds')
+        if 'bytes_read' in self.counters:
+            job['BytesRead'] = (self.counters['bytes_read'], 'Bytes')
+        if 'rows' in self.counters:
+            job['Rows'] = (self.counters['rows'], 'Count')
+        self._log({}, job)
+
+        for name, ms in self.stages.items():
+            self._log({'Stage': name}, {'StageDuration': (ms, 'Milliseconds')})
+        for name, stats in self.rules.items():
+            self._log({'Rule': name}, {
+                'RuleDuration': (stats['ms'], 'Milliseconds'),
+                'RuleCpuTime': (stats['cpu_ms'], 'Milliseconds')
+            })
+
+    def _log(self, dimensions, values):
+        dimensions = dict(dimensions, Service=self.service)
+        record = {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': METRICS_NAMESPACE,
+                    'Dimensions': [sorted(dimensions)],
+                    'Metrics': [{'Name': name, 'Unit': unit}
+                                for name, (value, unit) in values.items()]
+                }]
+            },
+            'JobId': self.job_id
+        }
+        record.update(dimensions)
+        record.update((name, value) for name, (value, unit) in values.items())
+        print(json.dumps(record))
@@ -0,0 +1,53 @@
+import os
+import time
+import json
+import hashlib
+import inspect
+
+CACHE_TTL_DAYS = int(os.environ.get('CACHE_TTL_DAYS', '30'))
+
+
+def source_fingerprint(*objects):
+    '''Hash of the source files defining the given classes or modules'''
+    digest = hashlib.sha256()
+    for obj in objects:
+        with open(inspect.getsourcefile(obj), 'rb') as source:
+            digest.update(source.read())
+    return digest.hexdigest()
+
+
+class ResultCache:
+    '''Results of earlier jobs keyed by object content and job configuration.
+
+    An entry is keyed by the stage, the object's ETag and size and a
+    fingerprint of everything else that affects the result (rule set,
+    profiler settings...). Entries expire through DynamoDB TTL.
+    '''
+
+    def __init__(self, table, ttl_days=CACHE_TTL_DAYS):
+        self.table = table
+        self.ttl = ttl_days * 24 * 60 * 60
+
+    @staticmethod
+    def key(stage, etag, size, fingerprint):
+        return hashlib.sha256(json.dumps(
+            [stage, etag, int(size), fingerprint]).encode('utf8')).hexdigest()
+
+    def get(self, cache_key):
+        response = self.table.get_item(Key={'cache_key': cache_key})
+        item = response.get('Item')
+        # TTL deletion is lazy, expired entries can still be returned
+        if item is None or item['expires_at'] < time.time():
+            return None
+        return item['result']
+
+    def put(self, cache_key, job_id, result):
+        self.table.put_item(Item={
+            'cache_key': cache_key,
+            'job_id': job_id,
+            'result': result,
+            'expires_at': int(time.time()) + self.ttl
+        })
+
+    def delete(self, cache_key):
+        self.table.delete_item(Key={'cache_key': cache_key})
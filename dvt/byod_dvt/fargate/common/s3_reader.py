@@ -0,0 +1,166 @@
+import io
+import os
+import collections
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor
+from .compression import MAGIC_SIZE
+from .compression import DecompressingReader
+from .compression import detect_compression
+
+MiB = 1024 * 1024
+
+# Defaults can be tuned per task without rebuilding the image
+PART_SIZE = int(os.environ.get('S3_PART_SIZE_MB', '16')) * MiB
+CONCURRENCY = int(os.environ.get('S3_CONCURRENCY', '8'))
+MAX_MEMORY = int(os.environ.get('S3_MAX_MEMORY_MB', '512')) * MiB
+PART_RETRIES = 3
+
+
+class RangedS3Reader(io.RawIOBase):
+    '''Read-only file object over an S3 object version.
+
+    The object is fetched as concurrent byte-range GETs of part_size bytes on
+    a thread pool and handed back in order. At most max_memory bytes of parts
+    are downloaded ahead of the reader, which also caps the concurrency.
+    start and end limit the reader to that byte range of the object.
+    '''
+
+    def __init__(self, client, bucket, key, version_id=None, size=None,
+                 etag=None, part_size=PART_SIZE, concurrency=CONCURRENCY,
+                 max_memory=MAX_MEMORY, start=0, end=None):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.version_id = version_id
+        self.etag = etag
+        self.part_size = part_size
+        self.size = size
+        if self.size is None:
+            head = client.head_object(**self._object_args())
+            self.size = head['ContentLength']
+            self.etag = head['ETag']
+        self.start = start
+        self.end = self.size if end is None else min(end, self.size)
+
+        self.window = max(1, min(concurrency, max_memory // part_size))
+        self.executor = ThreadPoolExecutor(max_workers=self.window)
+        self.pending = collections.deque()
+        self.next_offset = start
+        self.buffer = memoryview(b'')
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return self.readall()
+
+        chunks = []
+        remaining = size
+        while remaining > 0:
+            if not self.buffer and not self._next_part():
+                break
+            chunk = self.buffer[:remaining]
+            self.buffer = self.buffer[len(chunk):]
+            chunks.append(chunk)
+            remaining -= len(chunk)
+
+        data = b''.join(chunks)
+        self.position += len(data)
+        return data
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def readall(self):
+        return self.read(self.end - self.start - self.position)
+
+    def peek(self, size=1):
+        if not self.buffer:
+            self._next_part()
+        return bytes(self.buffer[:size])
+
+    def close(self):
+        if not self.closed:
+            for future in self.pending:
+                future.cancel()
+            self.pending.clear()
+            self.executor.shutdown(wait=False)
+            self.buffer = memoryview(b'')
+        super().close()
+
+    def _object_args(self):
+        args = {'Bucket': self.bucket, 'Key': self.key}
+        if self.version_id is not None:
+            args['VersionId'] = self.version_id
+        elif self.etag is not None:
+            # without a version, make sure every part comes from the same object
+            args['IfMatch'] = self.etag
+        return args
+
+    def _schedule(self):
+        while len(self.pending) < self.window and self.next_offset < self.end:
+            end = min(self.next_offset + self.part_size, self.end) - 1
+            self.pending.append(self.executor.submit(
+                self._fetch, self.next_offset, end))
+            self.next_offset = end + 1
+
+    def _next_part(self):
+        # nothing is downloaded until the first read
+        self._schedule()
+        if not self.pending:
+            return False
+        part = self.pending.popleft().result()
+        self._schedule()
+        self.buffer = memoryview(part)
+        return True
+
+    def _fetch(self, start, end):
+        for attempt in range(PART_RETRIES):
+            try:
+                response = self.client.get_object(
+                    Range='bytes=%d-%d' % (start, end), **self._object_args())
+                data = response['Body'].read()
+                if len(data) == end - start + 1:
+                    return data
+                error = IOError('Short read for bytes %d-%d of s3://%s/%s' % (
+                    start, end, self.bucket, self.key))
+            except Exception as e:
+                error = e
+        raise error
+
+
+def get_object(client, Bucket, Key, VersionId=None, decompress=False, **kwargs):
+    '''Drop-in for client.get_object() with a RangedS3Reader as the Body.
+
+    With decompress, the Body of a gzip, bzip2 or zstd object reads its
+    decompressed content and Compression names the codec, ContentLength
+    stays the size of the object.
+    '''
+    args = {'Bucket': Bucket, 'Key': Key}
+    if VersionId is not None:
+        args['VersionId'] = VersionId
+    head = client.head_object(**args)
+
+    obj = dict(head)
+    obj['Body'] = RangedS3Reader(
+        client, Bucket, Key, version_id=VersionId, size=head['ContentLength'],
+        etag=head['ETag'], **kwargs)
+    if decompress:
+        obj['Compression'] = detect_compression(
+            Key, head.get('ContentEncoding'), obj['Body'].peek(MAGIC_SIZE))
+        if obj['Compression'] is not None:
+            obj['Body'] = DecompressingReader(obj['Body'], obj['Compression'])
+    return obj
+
+
+def object_url(region, bucket, key):
+    '''HTTPS URL of an object, virtual-hosted style, valid in every region'''
+    domain = 'amazonaws.com.cn' if region.startswith('cn-') else 'amazonaws.com'
+    return 'https://%s.s3.%s.%s/%s' % (bucket, region, domain, quote(key))
@@ -0,0 +1,163 @@
+import os
+import signal
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import wait
+from .startup import report_startup
+from .startup import import_modules
+
+# SQS limits for a single receive/delete/change visibility batch
+MAX_BATCH_SIZE = 10
+MAX_WAIT_TIME = 20
+
+
+def cpu_count():
+    '''Number of cores this task may run on'''
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+class SqsConsumer:
+    '''Long-polls a queue in batches and runs handler(message) on a pool.
+
+    Messages stay invisible for as long as their job runs: a heartbeat
+    thread keeps extending their visibility timeout, and messages are only
+    deleted, in batches, once the handler returned. A handler that raises
+    leaves its message on the queue to be retried after the timeout.
+    The modules in preload are imported by the pool as soon as it starts,
+    while the first messages are being polled.
+    '''
+
+    def __init__(self, client, queue_url, handler, workers=None,
+                 visibility_timeout=300, use_processes=True, preload=None):
+        self.client = client
+        self.queue_url = queue_url
+        self.handler = handler
+        self.workers = workers or cpu_count()
+        self.visibility_timeout = visibility_timeout
+        self.heartbeat_interval = visibility_timeout / 3
+        self.use_processes = use_processes
+        self.preload = preload or []
+        self.in_flight = {}
+        self.to_delete = {}
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.finished = threading.Event()
+
+    def run(self):
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.stop())
+
+        heartbeat = threading.Thread(target=self._heartbeat, daemon=True)
+        heartbeat.start()
+
+        # spawn so that jobs never share boto3 connections with this process
+        if self.use_processes:
+            pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'))
+        else:
+            pool = ThreadPoolExecutor(max_workers=self.workers)
+
+        futures = {}
+        with pool:
+            # starts the processes too, jobs queue up behind the imports
+            if self.preload:
+                for _ in range(self.workers):
+                    pool.submit(import_modules, self.preload)
+
+            while not self.stopping.is_set():
+                free = self.workers - len(futures)
+                if free == 0:
+                    done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    self._collect(futures, done)
+                    self._flush_deletes()
+                    continue
+
+                for message in self._receive(min(free, MAX_BATCH_SIZE)):
+                    with self.lock:
+                        if message['MessageId'] in self.in_flight:
+                            # redelivered while still running here
+                            self.in_flight[message['MessageId']] = message['ReceiptHandle']
+                            continue
+                        self.in_flight[message['MessageId']] = message['ReceiptHandle']
+                    futures[pool.submit(self.handler, message)] = message
+
+                done = [future for future in futures if future.done()]
+                self._collect(futures, done)
+                self._flush_deletes()
+
+            print('Stopping, waiting for %d running jobs...' % (len(futures)))
+            done, _ = wait(futures)
+            self._collect(futures, done)
+            self._flush_deletes()
+
+        self.finished.set()
+
+    def stop(self):
+        self.stopping.set()
+
+    def _receive(self, max_messages):
+        report_startup()
+        response = self.client.receive_message(
+            QueueUrl=self.queue_url,
+            AttributeNames=[
+                'SentTimestamp',
+                'ApproximateReceiveCount'
+            ],
+            MaxNumberOfMessages=max_messages,
+            MessageAttributeNames=[
+                'All'
+            ],
+            VisibilityTimeout=self.visibility_timeout,
+            WaitTimeSeconds=MAX_WAIT_TIME
+        )
+        return response.get('Messages', [])
+
+    def _collect(self, futures, done):
+        for future in done:
+            message = futures.pop(future)
+            with self.lock:
+                receipt_handle = self.in_flight.pop(message['MessageId'])
+                try:
+                    future.result()
+                except Exception as error:
+                    print('Uncaught exception: %s' % (error))
+                    continue
+                self.to_delete[message['MessageId']] = receipt_handle
+
+    def _flush_deletes(self):
+        with self.lock:
+            entries = [{'Id': message_id, 'ReceiptHandle': receipt_handle}
+                       for message_id, receipt_handle in self.to_delete.items()]
+            self.to_delete.clear()
+
+        for i in range(0, len(entries), MAX_BATCH_SIZE):
+            print('Deleting %d SQS messages from queue...' % (len(entries[i:i + MAX_BATCH_SIZE])))
+            response = self.client.delete_message_batch(
+                QueueUrl=self.queue_url,
+                Entries=entries[i:i + MAX_BATCH_SIZE]
+            )
+            for failed in response.get('Failed', []):
+                print('Failed to delete message %s: %s' % (failed['Id'], failed.get('Message')))
+
+    def _heartbeat(self):
+        while not self.finished.wait(self.heartbeat_interval):
+            with self.lock:
+                receipt_handles = dict(self.in_flight)
+                receipt_handles.update(self.to_delete)
+            entries = [{'Id': message_id, 'ReceiptHandle': receipt_handle,
+                        'VisibilityTimeout': self.visibility_timeout}
+                       for message_id, receipt_handle in receipt_handles.items()]
+
+            for i in range(0, len(entries), MAX_BATCH_SIZE):
+                try:
+                    self.client.change_message_visibility_batch(
+                        QueueUrl=self.queue_url,
+                        Entries=entries[i:i + MAX_BATCH_SIZE]
+                    )
+                except Exception as error:
+                    print('Heartbeat failed: %s' % (error))
@@ -0,0 +1,107 @@
+import os
+import sys
+import time
+import builtins
+import importlib
+import threading
+
+# STARTUP_PROFILE=1 times the imports of the worker and reports them with
+# the time it took to get to its first receive_message
+STARTUP_PROFILE = os.environ.get('STARTUP_PROFILE') == '1'
+
+# Modules listed in the startup report, the slowest first
+STARTUP_REPORT_MODULES = 15
+
+
+def process_age():
+    '''Seconds since this process started, None where /proc is missing'''
+    try:
+        with open('/proc/self/stat') as f:
+            # the command in parentheses may hold spaces, starttime is field 22
+            started = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+    return uptime - started / os.sysconf('SC_CLK_TCK')
+
+
+class ImportTimer:
+    '''Times every import statement that loads a new module.
+
+    Only the outermost import of each thread is counted, with the time of
+    the modules it pulled in, so the times add up to the time spent
+    importing.
+    '''
+
+    def __init__(self):
+        self.seconds = {}
+        self.local = threading.local()
+        self.original = None
+
+    def install(self):
+        self.original = builtins.__import__
+        builtins.__import__ = self._import
+
+    def total(self):
+        return sum(self.seconds.values())
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        depth = getattr(self.local, 'depth', 0)
+        if depth or level or name in sys.modules:
+            self.local.depth = depth + 1
+            try:
+                return self.original(name, globals, locals, fromlist, level)
+            finally:
+                self.local.depth = depth
+
+        self.local.depth = 1
+        started = time.perf_counter()
+        try:
+            return self.original(name, globals, locals, fromlist, level)
+        finally:
+            self.local.depth = 0
+            self.seconds[name] = self.seconds.get(name, 0) + time.perf_counter() - started
+
+
+import_timer = ImportTimer()
+if STARTUP_PROFILE:
+    # before the worker imports anything else, common is its first import
+    import_timer.install()
+_reported = False
+
+
+def report_startup():
+    '''Prints the startup profile the first time it is called, right
+    before the first receive_message'''
+    global _reported
+    if not STARTUP_PROFILE or _reported:
+        return
+    _reported = True
+
+    age = process_age()
+    print('Startup: %s ms to the first receive_message, %d ms importing' % (
+        '%d' % (age * 1000) if age is not None else 'unknown', import_timer.total() * 1000))
+    slowest = sorted(import_timer.seconds.items(), key=lambda item: -item[1])
+    for name, seconds in slowest[:STARTUP_REPORT_MODULES]:
+        if seconds < 0.001:
+            break
+        print('Startup import %s: %d ms' % (name, seconds * 1000))
+
+
+def import_modules(names):
+    '''Imports the modules a job needs before the job comes'''
+    for name in names:
+        started = time.perf_counter()
+        importlib.import_module(name)
+        if STARTUP_PROFILE:
+            print('Preloaded %s in %d ms (pid %d)' % (
+                name, (time.perf_counter() - started) * 1000, os.getpid()))
+
+
+def preload(names):
+    '''Imports the modules in a thread while the worker waits for its first
+    message, join() the thread before running a job'''
+    thread = threading.Thread(target=import_modules, args=(names,), daemon=True)
+    thread.start()
+    return thread
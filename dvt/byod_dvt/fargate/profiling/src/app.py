@@ -1,51 +1,341 @@
-import pandas as pd
+from common import get_object
+from common import object_url
+from common import ResultCache
+from common import read_csv_args
+from common import csv_reader_args
+from common import JobMetrics
+from common import preload
+from common import report_startup
 import boto3
-from botocore.config import Config
-from pandas_profiling import ProfileReport
-from io import StringIO
+from botocore.exceptions import ClientError
 import io
+import csv
 import time
 import os
+import shutil
 import datetime
-import http.client
-import json
-import pytz
+
+# pandas, pandas_profiling and the profiler are imported by the jobs that
+# need them, a new task polls its queue while they load
+PRELOAD = ['profiler', 'pandas_profiling']
 
 TABLE_NAME = os.environ['TABLE_NAME']
 QUEUE_URL = os.environ['QUEUE_URL']
 SOURCE_BUCKET_NAME = os.environ['SOURCE_BUCKET_NAME']
 TARGET_BUCKET_NAME = os.environ['TARGET_BUCKET_NAME']
 REGION = os.environ['REGION']
+CACHE_TABLE_NAME = os.environ.get('CACHE_TABLE_NAME')
+
+# 'async' overlaps the DynamoDB and SQS calls of jobs with the profiling of others
+WORKER_MODE = os.environ.get('WORKER_MODE', 'sync')
+# profiles run one at a time by default, they take most of the task's memory
+WORKER_COUNT = int(os.environ.get('WORKER_COUNT', '1'))
+VISIBILITY_TIMEOUT = int(os.environ.get('VISIBILITY_TIMEOUT', '300'))
 
 sqs = boto3.client('sqs', region_name=REGION)
 s3c = boto3.client('s3')
 dynamodb = boto3.resource('dynamodb', region_name=REGION)
+result_cache = ResultCache(dynamodb.Table(CACHE_TABLE_NAME)) if CACHE_TABLE_NAME else None
+
+
+def profile_update(s3link, start_time_ts, end_time_ts, preset, cached_from=None, job_metrics=None):
+    '''Arguments of update_item() that record a finished profile'''
+    # profile_preset is the job's own choice, keep it for reruns
+    expression = "set profile_uri = :u, profile_start_ts = :st, profile_end_ts = :et, profile_preset_used = :p"
+    values = {
+        ':u': s3link,
+        ':st': start_time_ts,
+        ':et': end_time_ts,
+        ':p': preset['preset']
+    }
+    if cached_from is not None:
+        expression += ", profile_cached_from = :c"
+        values[':c'] = cached_from
+    if job_metrics is not None:
+        expression += ", profiling_metrics = :pm, profiling_ms = :pt"
+        values.update({
+            ':pm': job_metrics,
+            ':pt': job_metrics['total_ms']
+        })
+    return {
+        'UpdateExpression': expression,
+        'ExpressionAttributeValues': values,
+        'ReturnValues': "UPDATED_NEW"
+    }
 
 
-def updateS3link(jobID, s3link, start_time_ts, end_time_ts):
+def updateS3link(jobID, s3link, start_time_ts, end_time_ts, preset, cached_from=None, job_metrics=None):
     table = dynamodb.Table(TABLE_NAME)
-    response = table.get_item(Key={'id': jobID})
     response = table.update_item(
         Key={
             'id': jobID
         },
-        UpdateExpression="set profile_uri = :u, profile_start_ts = :st, profile_end_ts = :et",
-        ExpressionAttributeValues={
-            ':u': s3link,
-            ':st': start_time_ts,
-            ':et': end_time_ts
-        },
-        ReturnValues="UPDATED_NEW"
+        **profile_update(s3link, start_time_ts, end_time_ts, preset, cached_from, job_metrics)
     )
     print('DynamoDB response: %s' % (response))
 
 
-if __name__ == "__main__":
+def download_intermediate(key, path):
+    '''Downloads the parsed rows to path, a directory of one file per shard
+    for a key ending in /. Returns False when there are none.'''
+    if not key.endswith('/'):
+        s3c.download_file(TARGET_BUCKET_NAME, key, path)
+        return True
+
+    keys = []
+    for page in s3c.get_paginator('list_objects_v2').paginate(Bucket=TARGET_BUCKET_NAME, Prefix=key):
+        keys.extend(item['Key'] for item in page.get('Contents', []))
+    if not keys:
+        return False
+    os.makedirs(path, exist_ok=True)
+    for name in keys:
+        s3c.download_file(TARGET_BUCKET_NAME, name, os.path.join(path, os.path.basename(name)))
+    return True
+
+
+def run_profile(jobID, job, metrics):
+    '''Profiles the job's data and uploads the report, returns the keyword
+    arguments of updateS3link() for the caller to write'''
+    import pandas as pd
+    from profiler import StreamingProfiler
+    from profiler import choose_preset
+    from profiler import report_args
+    from profiler import sample_csv
+    from profiler import sample_frames
+    from profiler import parquet_files
+    from profiler import parquet_frames
+    from profiler import parquet_columns
+    from profiler import infer_numeric
+    from profiler import fingerprint
+
+    print('Retrieving csv file from S3...')
+    filename = '%s.csv' % (jobID)
+    with metrics.stage('get_object'):
+        obj = get_object(
+            s3c,
+            Bucket=SOURCE_BUCKET_NAME,
+            Key=job['filename'],
+            VersionId=job['filename_version'],
+            decompress=True
+        )
+    # what a compressed file decompressed to in validation
+    size = int(job.get('uncompressed_size') or obj['ContentLength'])
+
+    start_time_ts = datetime.datetime.utcnow().isoformat()
+
+    # the same bytes profiled with the same settings give the same report
+    cache_key = None
+    cached = None
+    if result_cache is not None:
+        cache_key = ResultCache.key(
+            'profiling', obj['ETag'], obj['ContentLength'], fingerprint(job))
+        if not job.get('force_rerun'):
+            with metrics.stage('cache'):
+                cached = result_cache.get(cache_key)
+
+    if cached is not None:
+        print('Reusing profile of job %s' % (cached['job_id']))
+        obj['Body'].close()
+        return {
+            's3link': cached['profile_uri'],
+            'start_time_ts': start_time_ts,
+            'end_time_ts': datetime.datetime.utcnow().isoformat(),
+            'preset': {'preset': cached['profile_preset']},
+            'cached_from': cached['job_id']
+        }
+
+    # parse with the dialect detected during validation
+    dialect = job.get('dialect')
+    csv_args = read_csv_args(dialect)
+
+    # read the rows validation parsed, the CSV only when they are missing
+    parquet_filename = None
+    if job.get('intermediate_key'):
+        parquet_filename = jobID + '.parquet'
+        try:
+            with metrics.stage('download_intermediate'):
+                if not download_intermediate(job['intermediate_key'], parquet_filename):
+                    print('Parsed rows not available, reading the CSV')
+                    parquet_filename = None
+        except ClientError as e:
+            print('Parsed rows not available, reading the CSV: %s' % (e))
+            shutil.rmtree(parquet_filename, ignore_errors=True)
+            parquet_filename = None
+
+    # pick a preset from the object size and the header's column count
+    if parquet_filename is not None:
+        obj['Body'].close()
+        columns = parquet_columns(parquet_filename)
+        metrics.count('bytes_read', sum(
+            os.path.getsize(path) for path in parquet_files(parquet_filename)))
+    else:
+        metrics.count('bytes_read', obj['ContentLength'])
+        body = io.BufferedReader(obj['Body'], buffer_size=1024 * 1024)
+        header = body.peek(64 * 1024).split(b'\n', 1)[0].decode('utf8', 'replace')
+        columns = len(next(csv.reader([header], **csv_reader_args(dialect)), []))
+    preset = choose_preset(size, columns, job)
+    print('Profiling %d bytes and %d columns with the %s preset from %s...' % (
+        size, columns, preset['preset'],
+        'Parquet' if parquet_filename is not None else 'CSV'))
+
+    #--------------------PROFILING CODE --------------------------#
+    filename = jobID+'_profiling_report.html'
+    if preset['preset'] == 'streaming':
+        # constant memory profile from chunked sketches
+        with metrics.stage('profile'):
+            if parquet_filename is not None:
+                profile = StreamingProfiler().profile_frames(
+                    parquet_frames(parquet_filename))
+            else:
+                profile = StreamingProfiler().profile_csv(
+                    body, encoding='utf8', **csv_args)
+        metrics.count('rows', profile.rows)
+        with metrics.stage('render'):
+            profile.to_html(filename, title="Streaming Profiling Report")
+
+            json_filename = jobID+'_profile.json'
+            profile.to_json(json_filename)
+        print('Uploading to S3...')
+        with metrics.stage('upload_report'):
+            response = s3c.upload_file(
+                json_filename, TARGET_BUCKET_NAME, 'profiling/%s' % (json_filename))
+        print('S3 response: %s' % (response))
+        os.remove(json_filename)
+    else:
+        title = "Pandas Profiling Report"
+        with metrics.stage('read'):
+            if preset['preset'] == 'sampled':
+                if parquet_filename is not None:
+                    df, total_rows = sample_frames(
+                        parquet_frames(parquet_filename), preset['sample_rows'],
+                        seed=preset['seed'])
+                    df = infer_numeric(df)
+                else:
+                    df, total_rows = sample_csv(
+                        body, preset['sample_rows'], seed=preset['seed'],
+                        encoding='utf8', **csv_args)
+                title = "Pandas Profiling Report (sample of %d of %d rows, seed %d)" % (
+                    len(df), total_rows, preset['seed'])
+            elif parquet_filename is not None:
+                df = infer_numeric(pd.read_parquet(parquet_filename))
+                total_rows = len(df)
+            else:
+                # parse straight from the ranged download stream
+                df = pd.read_csv(
+                    body, encoding='utf8', **csv_args)
+                total_rows = len(df)
+        metrics.count('rows', total_rows)
+
+        # generate html report, streaming profiles never load pandas_profiling
+        from pandas_profiling import ProfileReport
+        with metrics.stage('profile'):
+            profile = ProfileReport(
+                df, title=title, **report_args(preset['preset'], columns))
+            profile.to_file(filename)
+
+    # upload html report to S3
+    print('Uploading to S3...')
+    with metrics.stage('upload_report'):
+        response = s3c.upload_file(
+            filename, TARGET_BUCKET_NAME, 'profiling/%s' % (filename))
+    print('S3 response: %s' % (response))
+    #--------------------/PROFILING CODE -------------------------#
+
+    # delete file from local directory
+    os.remove(filename)
+    if parquet_filename is not None and os.path.isdir(parquet_filename):
+        shutil.rmtree(parquet_filename)
+    elif parquet_filename is not None:
+        os.remove(parquet_filename)
+
+    path = object_url(REGION, TARGET_BUCKET_NAME, 'profiling/%s' % (filename))
+
+    end_time_ts = datetime.datetime.utcnow().isoformat()
+    if cache_key is not None:
+        with metrics.stage('cache'):
+            result_cache.put(cache_key, jobID, {
+                'job_id': jobID,
+                'profile_uri': path,
+                'profile_preset': preset['preset']
+            })
+    return {
+        's3link': path,
+        'start_time_ts': start_time_ts,
+        'end_time_ts': end_time_ts,
+        'preset': preset
+    }
+
+
+def profile_job(jobID, message=None):
+    metrics = JobMetrics('profiling', jobID, message)
+
+    # get job from DDB
+    print('Retrieving job %s from DynamoDB...' % (jobID))
+    table = dynamodb.Table(TABLE_NAME)
+    with metrics.stage('get_job'):
+        response = table.get_item(Key={'id': jobID})
+    job = response['Item']
+
+    update = run_profile(jobID, job, metrics)
+
+    # updateDynamoDB with location of s3 profiling report
+    with metrics.stage('update_job'):
+        updateS3link(jobID, job_metrics=metrics.summary(), **update)
+    metrics.emit()
+
+
+async def prepare_profile(clients, message):
+    jobID = message['MessageAttributes']['jobid']['StringValue']
+    metrics = JobMetrics('profiling', jobID, message)
+    print('Retrieving job %s from DynamoDB...' % (jobID))
+    with metrics.stage('get_job'):
+        job = await clients.get_item(TABLE_NAME, {'id': jobID})
+    return jobID, job, metrics
+
+
+def work_profile(jobID, job, metrics):
+    # runs in the pool, the metrics travel there and back
+    metrics.resume()
+    update = run_profile(jobID, job, metrics)
+    metrics.sample_rss()
+    return update, metrics
+
+
+async def complete_profile(clients, message, args, outcome):
+    jobID = args[0]
+    update, metrics = outcome
+    with metrics.stage('update_job'):
+        response = await clients.update_item(
+            TABLE_NAME, {'id': jobID}, **profile_update(job_metrics=metrics.summary(), **update))
+    print('DynamoDB response: %s' % (response))
+    metrics.emit()
+    print('Profling job done')
+
+
+if __name__ == "__main__" and WORKER_MODE == 'async':
+    # control-plane calls on an event loop, profiles on the pool
+    from common.async_worker import AsyncWorker
+    AsyncWorker(
+        REGION,
+        QUEUE_URL,
+        prepare_profile,
+        work_profile,
+        complete_profile,
+        workers=WORKER_COUNT,
+        visibility_timeout=VISIBILITY_TIMEOUT,
+        preload=PRELOAD
+    ).run()
+
+elif __name__ == "__main__":
+
+    # the first job waits for these imports instead of starting them
+    preloading = preload(PRELOAD)
 
     # Infinite Loop to poll queue
     while True:
 
         # visibility timeout of 12 Hours to prevent other consumers from processing same file
+        report_startup()
         response = sqs.receive_message(
             QueueUrl=QUEUE_URL,
             AttributeNames=[
@@ -65,47 +355,8 @@ if __name__ == "__main__":
             receipt_handle = response['Messages'][0]['ReceiptHandle']
             jobID = response['Messages'][0]['MessageAttributes']['jobid']['StringValue']
 
-            # get job from DDB
-            print('Retrieving job %s from DynamoDB...' % (jobID))
-            table = dynamodb.Table(TABLE_NAME)
-            response = table.get_item(Key={'id': jobID})
-
-            print('Retrieving csv file from S3...')
-            filename = '%s.csv' % (jobID)
-            obj = s3c.get_object(
-                Bucket=SOURCE_BUCKET_NAME,
-                Key=response['Item']['filename'],
-                VersionId=response['Item']['filename_version']
-            )
-
-            df = pd.read_csv(io.BytesIO(
-                obj['Body'].read()), encoding='utf8', header=0, sep=",")
-            start_time_ts = datetime.datetime.utcnow().isoformat()
-
-            #--------------------PROFILING CODE --------------------------#
-            # generate html report
-            profile = ProfileReport(df, title="Pandas Profiling Report")
-            profile.to_file(jobID+"_profiling_report.html")
-
-            # upload to s3
-            filename = jobID+'_profiling_report.html'
-
-            # upload csv to S3
-            print('Uploading to S3...')
-            response = s3c.upload_file(
-                filename, TARGET_BUCKET_NAME, 'profiling/%s' % (filename))
-            print('S3 response: %s' % (response))
-            #--------------------/PROFILING CODE -------------------------#
-
-            # delete file from local directory
-            os.remove(filename)
-
-            path = 'https://%s.s3-%s.amazonaws.com/validation/%s' % (
-                TARGET_BUCKET_NAME, REGION, filename)
-
-            # updateDynamoDB with location of s3 profiling report
-            end_time_ts = datetime.datetime.utcnow().isoformat()
-            updateS3link(jobID, path, start_time_ts, end_time_ts)
+            preloading.join()
+            profile_job(jobID, response['Messages'][0])
 
             # Delete message from queue after processing
             print('Deleting SQS message from queue...')
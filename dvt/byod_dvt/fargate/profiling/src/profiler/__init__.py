@@ -0,0 +1,11 @@
+from .streaming_profiler import StreamingProfiler
+from .column_profile import ColumnProfile
+from .presets import choose_preset
+from .presets import report_args
+from .presets import sample_csv
+from .presets import sample_frames
+from .presets import fingerprint
+from .intermediate import parquet_files
+from .intermediate import parquet_frames
+from .intermediate import parquet_columns
+from .intermediate import infer_numeric
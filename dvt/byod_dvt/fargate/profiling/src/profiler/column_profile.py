@@ -0,0 +1,86 @@
+import pandas as pd
+from profiler.sketches import Moments
+from profiler.sketches import HyperLogLog
+from profiler.sketches import QuantileSketch
+from profiler.sketches import TopK
+from profiler.sketches import histogram
+
+QUANTILES = [0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99]
+
+
+class ColumnProfile:
+    '''Mergeable summary of one column, updated one chunk at a time.
+
+    Chunks are expected as strings so that a value hashes and counts the
+    same whichever chunk it appears in. Values that parse as numbers also
+    feed the numeric sketches, until a value of the column does not.
+    '''
+
+    def __init__(self, name, top_k=10, seed=0):
+        self.name = name
+        self.top_k = top_k
+        self.rows = 0
+        self.nulls = 0
+        self.distinct = HyperLogLog()
+        self.top_values = TopK(capacity=max(100, 10 * top_k))
+        self.lengths = Moments()
+        self.numeric = Moments()
+        self.quantiles = QuantileSketch(seed=seed)
+        self.maybe_numeric = True
+
+    def update(self, values):
+        self.rows += len(values)
+        present = values.dropna()
+        self.nulls += len(values) - len(present)
+        if len(present) == 0:
+            return
+
+        self.distinct.update(present)
+        self.top_values.update(present)
+        self.lengths.update(present.str.len().values)
+
+        # parsing numbers is the costliest step, skip it for text columns
+        if not self.maybe_numeric:
+            return
+        numbers = pd.to_numeric(present, errors='coerce').dropna()
+        if len(numbers) < len(present):
+            self.maybe_numeric = False
+            return
+        self.numeric.update(numbers.values)
+        self.quantiles.update(numbers.values)
+
+    def merge(self, other):
+        self.rows += other.rows
+        self.nulls += other.nulls
+        self.distinct.merge(other.distinct)
+        self.top_values.merge(other.top_values)
+        self.lengths.merge(other.lengths)
+        self.numeric.merge(other.numeric)
+        self.quantiles.merge(other.quantiles)
+        self.maybe_numeric = self.maybe_numeric and other.maybe_numeric
+
+    def to_dict(self):
+        count = self.rows - self.nulls
+        profile = {
+            'name': self.name,
+            'count': count,
+            'nulls': self.nulls,
+            'null_ratio': float(self.nulls) / self.rows if self.rows else 0.0,
+            'distinct': min(self.distinct.estimate(), count),
+            'top_values': [{'value': value, 'count': frequency}
+                           for value, frequency in self.top_values.top(self.top_k)],
+            'length': self.lengths.to_dict(),
+            'numeric': None
+        }
+
+        # only describe as numeric the columns where every value is a number
+        if count and self.maybe_numeric:
+            numeric = self.numeric.to_dict()
+            numeric['quantiles'] = dict(zip(
+                ['%g' % (fraction) for fraction in QUANTILES],
+                self.quantiles.quantiles(QUANTILES)))
+            numeric['histogram'] = histogram(
+                self.quantiles, self.numeric.min, self.numeric.max)
+            profile['numeric'] = numeric
+
+        return profile
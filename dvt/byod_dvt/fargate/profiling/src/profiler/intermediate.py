@@ -0,0 +1,35 @@
+import os
+import pandas as pd
+import pyarrow.parquet as pq
+
+
+def parquet_files(path):
+    '''The Parquet file at path, or the files of a sharded job in order
+    when path is a directory'''
+    if os.path.isdir(path):
+        return [os.path.join(path, name) for name in sorted(os.listdir(path))]
+    return [path]
+
+
+def parquet_frames(path):
+    '''The row groups of the Parquet files written by validation, as frames
+    of strings with NaN for empty fields'''
+    for filename in parquet_files(path):
+        parquet = pq.ParquetFile(filename)
+        for i in range(parquet.num_row_groups):
+            yield parquet.read_row_group(i).to_pandas()
+
+
+def parquet_columns(path):
+    return len(pq.ParquetFile(parquet_files(path)[0]).schema_arrow.names)
+
+
+def infer_numeric(frame):
+    '''Turns the columns that hold only numbers into numbers, as
+    pd.read_csv would have done'''
+    for name in frame.columns:
+        try:
+            frame[name] = pd.to_numeric(frame[name])
+        except (ValueError, TypeError):
+            pass
+    return frame
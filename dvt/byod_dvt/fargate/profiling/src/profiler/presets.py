@@ -0,0 +1,119 @@
+import os
+import sys
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+from profiler.streaming_profiler import CHUNK_ROWS
+
+MiB = 1024 * 1024
+
+# full: pandas-profiling defaults, minimal: pandas-profiling minimal mode,
+# sampled: default report on a row sample, streaming: chunked sketches
+PRESETS = ['full', 'minimal', 'sampled', 'streaming']
+
+# auto picks a preset from these limits, PROFILE_MODE forces one instead
+PROFILE_MODE = os.environ.get('PROFILE_MODE', 'auto')
+SAMPLE_THRESHOLD = int(os.environ.get('SAMPLE_THRESHOLD_MB', '256')) * MiB
+STREAMING_THRESHOLD = int(os.environ.get('STREAMING_THRESHOLD_MB', '1024')) * MiB
+WIDE_COLUMNS = int(os.environ.get('WIDE_COLUMNS', '50'))
+SAMPLE_ROWS = int(os.environ.get('SAMPLE_ROWS', '100000'))
+SAMPLE_SEED = int(os.environ.get('SAMPLE_SEED', '0'))
+
+
+def choose_preset(size, columns, job):
+    '''Pick the profiling preset for an object of size bytes and columns.
+
+    The job item may override the choice with profile_preset,
+    profile_sample_rows and profile_seed. Returns a dict with the preset
+    name, sample_rows and seed.
+    '''
+    preset = job.get('profile_preset') or PROFILE_MODE
+    if preset not in PRESETS:
+        if size > STREAMING_THRESHOLD:
+            preset = 'streaming'
+        elif size > SAMPLE_THRESHOLD:
+            preset = 'sampled'
+        elif columns > WIDE_COLUMNS:
+            preset = 'minimal'
+        else:
+            preset = 'full'
+
+    return {
+        'preset': preset,
+        'sample_rows': int(job_setting(job, 'profile_sample_rows', SAMPLE_ROWS)),
+        'seed': int(job_setting(job, 'profile_seed', SAMPLE_SEED))
+    }
+
+
+def job_setting(job, name, default):
+    # null when the API wrote the job without it, a seed of 0 is a seed
+    value = job.get(name)
+    return default if value is None else value
+
+
+def fingerprint(job):
+    '''Identifies everything besides the object that affects its profile'''
+    from common import source_fingerprint
+    import pandas_profiling
+
+    settings = [PROFILE_MODE, SAMPLE_THRESHOLD, STREAMING_THRESHOLD, WIDE_COLUMNS,
+                SAMPLE_ROWS, SAMPLE_SEED, pandas_profiling.__version__]
+    settings += [str(job.get(name)) for name in
+                 ['profile_preset', 'profile_sample_rows', 'profile_seed']]
+    settings.append(json.dumps(job.get('dialect'), sort_keys=True, default=str))
+    modules = sorted(name for name in sys.modules
+                     if name == 'profiler' or name.startswith('profiler.'))
+    settings.append(source_fingerprint(*[sys.modules[name] for name in modules]))
+    return hashlib.sha256(json.dumps(settings).encode('utf8')).hexdigest()
+
+
+def report_args(preset, columns=0):
+    '''Keyword arguments for ProfileReport for a pandas-profiling preset
+    and a file of columns'''
+    if preset == 'minimal':
+        return {'minimal': True}
+    if preset == 'sampled':
+        # correlations are quadratic in the number of columns as well,
+        # wide files get the minimal report as when they are small
+        if columns > WIDE_COLUMNS:
+            return {'minimal': True}
+        # interactions are quadratic in the number of columns
+        return {'interactions': {'continuous': False}}
+    return {}
+
+
+def sample_csv(stream, sample_rows, seed=0, chunk_rows=CHUNK_ROWS, **read_csv_args):
+    '''Uniform sample of sample_rows rows of a CSV stream, in file order'''
+    return sample_frames(pd.read_csv(stream, chunksize=chunk_rows, **read_csv_args),
+                         sample_rows, seed=seed)
+
+
+def sample_frames(frames, sample_rows, seed=0):
+    '''Uniform sample of sample_rows rows of a sequence of frames, in order.
+
+    Every row gets a random key and the rows with the smallest keys are
+    kept, so memory stays at one frame plus the sample. Returns the sample
+    and the total number of rows.
+    '''
+    random = np.random.RandomState(seed)
+    sample = None
+    keys = None
+    total_rows = 0
+
+    for chunk in frames:
+        total_rows += len(chunk)
+        chunk_keys = random.random_sample(len(chunk))
+        if sample is not None:
+            chunk = pd.concat([sample, chunk])
+            chunk_keys = np.concatenate([keys, chunk_keys])
+
+        if len(chunk) > sample_rows:
+            keep = np.sort(np.argpartition(chunk_keys, sample_rows)[:sample_rows])
+            chunk = chunk.iloc[keep]
+            chunk_keys = chunk_keys[keep]
+        sample, keys = chunk, chunk_keys
+
+    if sample is None:
+        return pd.DataFrame(), 0
+    return sample.reset_index(drop=True), total_rows
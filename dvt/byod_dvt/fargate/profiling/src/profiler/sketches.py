@@ -0,0 +1,203 @@
+import math
+import numpy as np
+import pandas as pd
+
+
+class Moments:
+    '''Count, min, max, mean and variance, merged with Chan's formula'''
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+
+    def update(self, values):
+        values = np.asarray(values, dtype='float64')
+        if len(values) == 0:
+            return
+        other = Moments()
+        other.count = len(values)
+        other.mean = float(values.mean())
+        other.m2 = float(((values - other.mean) ** 2).sum())
+        other.min = float(values.min())
+        other.max = float(values.max())
+        self.merge(other)
+
+    def merge(self, other):
+        if other.count == 0:
+            return
+        if self.count == 0:
+            self.count, self.mean, self.m2 = other.count, other.mean, other.m2
+            self.min, self.max = other.min, other.max
+            return
+
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * other.count / count
+        self.m2 = self.m2 + other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    @property
+    def variance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'min': self.min,
+            'max': self.max,
+            'mean': self.mean if self.count else None,
+            'std': math.sqrt(self.variance) if self.count else None
+        }
+
+
+class HyperLogLog:
+    '''Distinct count estimate over 64-bit hashes of the values'''
+
+    def __init__(self, precision=14):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype='uint8')
+
+    def update(self, values):
+        if len(values) == 0:
+            return
+        hashes = pd.util.hash_pandas_object(
+            pd.Series(values), index=False).values
+        p = self.precision
+        index = (hashes >> np.uint64(64 - p)).astype('int64')
+        rest = hashes & np.uint64((1 << (64 - p)) - 1)
+        # rank is the position of the leftmost 1 bit in the remaining bits
+        _, bit_length = np.frexp(rest.astype('float64'))
+        rank = (64 - p) - bit_length + 1
+        np.maximum.at(self.registers, index, rank.astype('uint8'))
+
+    def merge(self, other):
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def estimate(self):
+        m = float(len(self.registers))
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.power(2.0, -self.registers.astype('float64')).sum()
+        zeros = int((self.registers == 0).sum())
+        if estimate <= 2.5 * m and zeros > 0:
+            # linear counting is more accurate for small cardinalities
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+
+class QuantileSketch:
+    '''Mergeable quantile summary that keeps at most k values per level.
+
+    Values at level h stand for 2 ** h input values. A full level is sorted
+    and every other value, starting at a random offset, is promoted to the
+    next level, so the rank error grows with log(n) / k.
+    '''
+
+    def __init__(self, k=512, seed=0):
+        self.k = k
+        self.levels = [np.empty(0)]
+        self.count = 0
+        self.random = np.random.RandomState(seed)
+
+    def update(self, values):
+        values = np.asarray(values, dtype='float64')
+        if len(values) == 0:
+            return
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self.count += len(values)
+        self._compress()
+
+    def merge(self, other):
+        for height, items in enumerate(other.levels):
+            if height == len(self.levels):
+                self.levels.append(np.empty(0))
+            self.levels[height] = np.concatenate([self.levels[height], items])
+        self.count += other.count
+        self._compress()
+
+    def _compress(self):
+        height = 0
+        while height < len(self.levels):
+            items = self.levels[height]
+            if len(items) > self.k:
+                if height + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                items = np.sort(items)
+                # an odd item out stays behind at this level
+                kept = items[len(items) - len(items) % 2:]
+                pairs = items[:len(items) - len(items) % 2]
+                promoted = pairs[self.random.randint(2)::2]
+                self.levels[height] = kept
+                self.levels[height + 1] = np.concatenate(
+                    [self.levels[height + 1], promoted])
+            height += 1
+
+    def _weighted(self):
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level), 2 ** height, dtype='float64')
+                                  for height, level in enumerate(self.levels)])
+        order = np.argsort(items, kind='mergesort')
+        return items[order], np.cumsum(weights[order])
+
+    def quantiles(self, fractions):
+        if self.count == 0:
+            return [None for _ in fractions]
+        items, cumulative = self._weighted()
+        total = cumulative[-1]
+        positions = np.searchsorted(cumulative, np.asarray(fractions) * total)
+        positions = np.minimum(positions, len(items) - 1)
+        return [float(items[position]) for position in positions]
+
+    def cdf(self, values):
+        items, cumulative = self._weighted()
+        positions = np.searchsorted(items, values, side='right')
+        below = np.concatenate([[0.0], cumulative])[positions]
+        return below / cumulative[-1]
+
+
+class TopK:
+    '''Misra-Gries heavy hitters, counts are lower bounds off by at most error'''
+
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
+        self.counts = {}
+        self.error = 0
+
+    def update(self, values):
+        self._add(pd.Series(values).value_counts())
+
+    def merge(self, other):
+        self.error += other.error
+        self._add(pd.Series(other.counts, dtype='int64'))
+
+    def _add(self, counts):
+        merged = pd.Series(self.counts, dtype='int64').add(counts, fill_value=0)
+        if len(merged) > self.capacity:
+            merged = merged.sort_values(ascending=False)
+            cutoff = merged.iloc[self.capacity]
+            self.error += int(cutoff)
+            merged = merged.iloc[:self.capacity] - cutoff
+            merged = merged[merged > 0]
+        self.counts = {key: int(count) for key, count in merged.items()}
+
+    def top(self, k):
+        return sorted(self.counts.items(), key=lambda item: -item[1])[:k]
+
+
+def histogram(sketch, minimum, maximum, bins=20):
+    '''Equal-width histogram estimated from a quantile sketch'''
+    if sketch.count == 0 or minimum is None:
+        return None
+    if minimum == maximum:
+        return {'edges': [minimum, maximum], 'counts': [sketch.count]}
+
+    edges = np.linspace(minimum, maximum, bins + 1)
+    cdf = sketch.cdf(edges)
+    cdf[0] = 0.0
+    cdf[-1] = 1.0
+    counts = np.round(np.diff(cdf) * sketch.count).astype('int64')
+    return {'edges': [float(edge) for edge in edges], 'counts': [int(count) for count in counts]}
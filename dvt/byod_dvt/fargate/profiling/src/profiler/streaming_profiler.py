@@ -0,0 +1,108 @@
+import html
+import json
+import pandas as pd
+from profiler.column_profile import ColumnProfile
+
+# Rows per pd.read_csv chunk, memory use is proportional to this
+CHUNK_ROWS = 100000
+
+
+class StreamingProfiler:
+    '''Profiles a CSV stream chunk by chunk in constant memory'''
+
+    def __init__(self, chunk_rows=CHUNK_ROWS, top_k=10):
+        self.chunk_rows = chunk_rows
+        self.top_k = top_k
+        self.columns = {}
+        self.rows = 0
+
+    def profile_csv(self, stream, **read_csv_args):
+        # read every column as strings so chunks agree on the values' types
+        reader = pd.read_csv(stream, dtype=str, chunksize=self.chunk_rows,
+                             **read_csv_args)
+        return self.profile_frames(reader)
+
+    def profile_frames(self, frames):
+        for chunk in frames:
+            self.update(chunk)
+        return self
+
+    def update(self, chunk):
+        self.rows += len(chunk)
+        for name in chunk.columns:
+            if name not in self.columns:
+                self.columns[name] = ColumnProfile(
+                    name, top_k=self.top_k, seed=len(self.columns))
+            self.columns[name].update(chunk[name])
+
+    def merge(self, other):
+        self.rows += other.rows
+        for name, column in other.columns.items():
+            if name in self.columns:
+                self.columns[name].merge(column)
+            else:
+                self.columns[name] = column
+
+    def to_dict(self):
+        return {
+            'rows': self.rows,
+            'columns': [column.to_dict() for column in self.columns.values()]
+        }
+
+    def to_json(self, filename):
+        with open(filename, mode='w') as profile_json:
+            json.dump(self.to_dict(), profile_json)
+
+    def to_html(self, filename, title="Profiling Report"):
+        profile = self.to_dict()
+        with open(filename, mode='w') as profile_html:
+            profile_html.write(_render_html(profile, title))
+
+
+def _format(value):
+    if value is None:
+        return ''
+    if isinstance(value, float):
+        return '%.6g' % (value)
+    return html.escape(str(value))
+
+
+def _render_html(profile, title):
+    parts = [
+        '<!DOCTYPE html><html><head><meta charset="utf-8"><title>%s</title>' % (html.escape(title)),
+        '<style>body{font-family:sans-serif}table{border-collapse:collapse;margin-bottom:2em}'
+        'td,th{border:1px solid #ccc;padding:4px 8px;text-align:left}</style></head><body>',
+        '<h1>%s</h1>' % (html.escape(title)),
+        '<p>%d rows, %d columns. Distinct counts, quantiles and top values are estimates.</p>' % (
+            profile['rows'], len(profile['columns'])),
+        '<table><tr><th>Column</th><th>Count</th><th>Nulls</th><th>Distinct</th>'
+        '<th>Min</th><th>Max</th><th>Mean</th><th>Std</th><th>Median</th></tr>'
+    ]
+    for column in profile['columns']:
+        numeric = column['numeric'] or {}
+        parts.append('<tr>' + ''.join('<td>%s</td>' % (_format(value)) for value in [
+            column['name'], column['count'], column['nulls'], column['distinct'],
+            numeric.get('min'), numeric.get('max'), numeric.get('mean'), numeric.get('std'),
+            (numeric.get('quantiles') or {}).get('0.5')
+        ]) + '</tr>')
+    parts.append('</table>')
+
+    for column in profile['columns']:
+        parts.append('<h2>%s</h2><table><tr><th>Top value</th><th>Count</th></tr>' % (
+            html.escape(str(column['name']))))
+        for top in column['top_values']:
+            parts.append('<tr><td>%s</td><td>%d</td></tr>' % (
+                _format(top['value']), top['count']))
+        parts.append('</table>')
+
+        histogram = (column['numeric'] or {}).get('histogram')
+        if histogram:
+            parts.append('<table><tr><th>Bin</th><th>Count</th></tr>')
+            edges = histogram['edges']
+            for i, count in enumerate(histogram['counts']):
+                parts.append('<tr><td>%s &ndash; %s</td><td>%d</td></tr>' % (
+                    _format(edges[i]), _format(edges[i + 1]), count))
+            parts.append('</table>')
+
+    parts.append('</body></html>')
+    return '\n'.join(parts)
@@ -1,149 +1,835 @@
-from clevercsv import read_dataframe
-from rules import CsvHeaderRule
-from rules import FileSizeEncodingRule
+from common import get_object
+from common import object_url
+from common import SqsConsumer
+from common import ResultCache
+from common import source_fingerprint
+from common import JobMetrics
+from common import read_csv_args
+from common import DecompressionError
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
 import boto3
-import s3fs
-import csv
 import os
+import gzip
+import json
 import time
+import shutil
 import datetime
 
+# pandas, clevercsv and pyarrow are imported by the jobs that need them,
+# so a new task polls its queue while the pool imports them
+PRELOAD = ['rules', 'error_report', 'sharding', 'batch', 'parquet_converter']
+
 TABLE_NAME = os.environ['TABLE_NAME']
 QUEUE_URL = os.environ['QUEUE_URL']
 SOURCE_BUCKET_NAME = os.environ['SOURCE_BUCKET_NAME']
 TARGET_BUCKET_NAME = os.environ['TARGET_BUCKET_NAME']
 REGION = os.environ['REGION']
+WORKER_COUNT = int(os.environ.get('WORKER_COUNT', '0'))
+VISIBILITY_TIMEOUT = int(os.environ.get('VISIBILITY_TIMEOUT', '300'))
+CACHE_TABLE_NAME = os.environ.get('CACHE_TABLE_NAME')
+PROFILING_QUEUE_URL = os.environ.get('PROFILING_QUEUE_URL')
+
+# 'async' overlaps the DynamoDB and SQS calls of jobs with the work of others
+WORKER_MODE = os.environ.get('WORKER_MODE', 'sync')
+
+# Keep the parsed rows as Parquet in the target bucket for the later stages
+WRITE_INTERMEDIATE = os.environ.get('WRITE_INTERMEDIATE', '1') == '1'
+
+# Files of two shards or more are split into parts of about SHARD_SIZE_MB
+# that any task can validate, 0 turns sharding off
+SHARD_SIZE = int(os.environ.get('SHARD_SIZE_MB', '256')) * 1024 * 1024
+
+# Receives of a message before SQS moves it to the dead-letter queue, a
+# shard that fails on the last one is recorded as failed instead
+MAX_RECEIVES = int(os.environ.get('MAX_RECEIVES', '3'))
+
+# Files of a batch job validated at the same time by one task
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', '8'))
+
+# Messages of a rule kept per file of a batch, so that one bad file does
+# not fill the report
+BATCH_MAX_STORED_PER_FILE = int(os.environ.get('BATCH_MAX_STORED_PER_FILE', '100'))
 
 sqs = boto3.client('sqs', region_name=REGION)
 s3 = boto3.client('s3')
 dynamodb = boto3.resource('dynamodb', region_name=REGION)
+result_cache = ResultCache(dynamodb.Table(CACHE_TABLE_NAME)) if CACHE_TABLE_NAME else None
+_registry = None
 
-if __name__ == "__main__":
-    # collecting queue message one by one until queue is empty
-    while True:
-        response = sqs.receive_message(
-            QueueUrl=QUEUE_URL,
-            AttributeNames=[
-                'SentTimestamp'
-            ],
-            MaxNumberOfMessages=1,
-            MessageAttributeNames=[
-                'All'
-            ],
-            VisibilityTimeout=0,
-            WaitTimeSeconds=0
+
+def rule_registry():
+    global _registry
+    if _registry is None:
+        from rules import RuleRegistry
+        _registry = RuleRegistry()
+    return _registry
+
+
+def job_update(result, cached_from=None, rule_metrics=None, job_metrics=None):
+    '''Arguments of update_item() that record a finished job'''
+    values = {
+        ':s': result['status'],
+        ':d': datetime.datetime.utcnow().isoformat()
+    }
+    expression = "set #status = :s, end_ts = :d"
+    if 'result_uri' in result:
+        expression += ", result_uri = :r, warnings = :w, errors = :e"
+        values.update({
+            ':r': result['result_uri'],
+            ':w': result['warnings'],
+            ':e': result['errors']
+        })
+    if result.get('error_counts') is not None:
+        # exact counts by rule, the report itself is capped
+        expression += ", error_counts = :n"
+        values[':n'] = result['error_counts']
+    if result.get('dialect') is not None:
+        # read back by the later stages instead of detecting it again
+        expression += ", dialect = :l"
+        values[':l'] = result['dialect']
+    if result.get('parquet_uri') is not None:
+        expression += ", parquet_uri = :q"
+        values[':q'] = result['parquet_uri']
+    if result.get('parquet_error') is not None:
+        expression += ", parquet_error = :x"
+        values[':x'] = result['parquet_error']
+    if result.get('intermediate_key') is not None:
+        expression += ", intermediate_key = :i"
+        values[':i'] = result['intermediate_key']
+    if result.get('compression') is not None:
+        expression += ", compression = :z"
+        values[':z'] = result['compression']
+    if result.get('uncompressed_size') is not None:
+        # sizes the profiling task, ContentLength is the compressed size
+        expression += ", uncompressed_size = :u"
+        values[':u'] = result['uncompressed_size']
+    if result.get('batch_files') is not None:
+        expression += ", batch_files = :bf, batch_failed = :bx"
+        values.update({
+            ':bf': result['batch_files'],
+            ':bx': result['batch_failed']
+        })
+    if cached_from is not None:
+        expression += ", cached_from = :c"
+        values[':c'] = cached_from
+    if rule_metrics is not None:
+        expression += ", rule_metrics = :m"
+        values[':m'] = rule_metrics
+    if job_metrics is not None:
+        expression += ", validation_metrics = :vm, validation_ms = :vt"
+        values.update({
+            ':vm': job_metrics,
+            ':vt': job_metrics['total_ms']
+        })
+
+    return {
+        'UpdateExpression': expression,
+        'ExpressionAttributeValues': values,
+        'ExpressionAttributeNames': {
+            '#status': 'status'
+        },
+        'ReturnValues': "UPDATED_NEW"
+    }
+
+
+def started_update():
+    '''Marks the job as started, the trigger does not queue it again for a
+    redelivered event'''
+    return {
+        'UpdateExpression': "set started_ts = if_not_exists(started_ts, :t)",
+        'ExpressionAttributeValues': {
+            ':t': datetime.datetime.utcnow().isoformat()
+        }
+    }
+
+
+def update_job(table, job_id, result, cached_from=None, rule_metrics=None, job_metrics=None):
+    # update DDB table
+    print('Updating job in DynamoDB...')
+    response = table.update_item(
+        Key={
+            'id': job_id
+        },
+        **job_update(result, cached_from, rule_metrics, job_metrics)
+    )
+    print('DynamoDB response: %s' % (response))
+
+
+def profiling_message(job_id):
+    return {
+        'QueueUrl': PROFILING_QUEUE_URL,
+        'MessageAttributes': {
+            'jobid': {
+                'DataType': 'String',
+                'StringValue': job_id
+            }
+        },
+        'MessageBody': job_id
+    }
+
+
+def enqueue_profiling(job_id):
+    print('Sending job %s to profiling...' % (job_id))
+    response = sqs.send_message(**profiling_message(job_id))
+    print('SQS response: %s' % (response))
+
+
+def convert_to_parquet(job_id, rules, source, options):
+    '''Writes the parsed rows as typed Parquet under curated/<job>/ in the
+    target bucket, returns its S3 URI'''
+    from rules import TypeConsistencyRule
+    from parquet_converter import ParquetConverter
+
+    schema = {}
+    for rule in rules:
+        # isinstance() would go through ValidationRule.__subclasshook__
+        if TypeConsistencyRule in type(rule).__mro__:
+            schema = rule.schema
+
+    target_dir = '%s_parquet' % (job_id)
+    prefix = 'curated/%s/' % (job_id)
+    try:
+        converter = ParquetConverter(schema, **options)
+        files = converter.convert(source, target_dir)
+        print('Uploading %d rows in %d Parquet files to S3...' % (converter.rows, len(files)))
+        for path in files:
+            s3.upload_file(os.path.join(target_dir, path), TARGET_BUCKET_NAME, prefix + path)
+    finally:
+        shutil.rmtree(target_dir, ignore_errors=True)
+    return 's3://%s/%s' % (TARGET_BUCKET_NAME, prefix)
+
+
+def report_result(report, has_error, metrics):
+    '''Completes or drops the error report, returns the job's result'''
+    # if there are errors...
+    if has_error:
+        print('Error found')
+        return close_report(report, metrics)
+    print('No error found')
+    # warnings are reported even when no rule failed, notes alone are not
+    if report.totals.get('warning', 0) + report.totals.get('error', 0) > 0:
+        return close_report(report, metrics)
+    report.abort()
+    return {
+        'status': 'success'
+    }
+
+
+def close_report(report, metrics):
+    '''Uploads the report, returns the job's result'''
+    errors = report.totals.get('error', 0)
+    warnings = report.totals.get('warning', 0)
+    print('Uploading error messages to S3...')
+    with metrics.stage('upload_report'):
+        report.close()
+    print('Found %d warnings and %d errors' % (warnings, errors))
+
+    return {
+        'result_uri': object_url(REGION, TARGET_BUCKET_NAME, report.key),
+        'warnings': warnings,
+        'errors': errors,
+        'error_counts': report.counts,
+        'status': 'failed' if errors > 0 else 'success'
+    }
+
+
+def intermediate_exists(key):
+    # a Parquet file, or the folder of one per shard
+    response = s3.list_objects_v2(Bucket=TARGET_BUCKET_NAME, Prefix=key, MaxKeys=1)
+    return response['KeyCount'] > 0
+
+
+def shard_key(job_id, name):
+    return 'shards/%s/%s.json.gz' % (job_id, name)
+
+
+def put_json(key, value):
+    s3.put_object(Bucket=TARGET_BUCKET_NAME, Key=key,
+                  Body=gzip.compress(json.dumps(value).encode('utf8')))
+
+
+def get_json(key):
+    response = s3.get_object(Bucket=TARGET_BUCKET_NAME, Key=key)
+    return json.loads(gzip.decompress(response['Body'].read()).decode('utf8'))
+
+
+def shard_index(message):
+    attributes = message.get('MessageAttributes') or {}
+    if 'shard' not in attributes:
+        return None
+    return int(attributes['shard']['StringValue'])
+
+
+def last_receive(message):
+    attributes = message.get('Attributes') or {}
+    return int(attributes.get('ApproximateReceiveCount', '1')) >= MAX_RECEIVES
+
+
+def delete_shard_state(job_id, count):
+    s3.delete_objects(Bucket=TARGET_BUCKET_NAME, Delete={
+        'Objects': [{'Key': shard_key(job_id, name)} for name in ['plan'] + list(range(count))]
+    })
+
+
+def start_shards(job_id, obj, cache_key):
+    '''Splits the object into shards and queues them, False when it can
+    not be split'''
+    from rules.dialect import DIALECT_SAMPLE_SIZE
+    from rules.dialect import detect_dialect
+    from sharding import plan_shards
+    from sharding import shard_read_csv_args
+
+    head = obj['Body'].read(DIALECT_SAMPLE_SIZE)
+    dialect = detect_dialect(head, complete=len(head) < DIALECT_SAMPLE_SIZE)
+    shards = plan_shards(obj['Body'], obj['ContentLength'], dialect, SHARD_SIZE, head=head)
+    obj['Body'].close()
+    if shards is None:
+        return False
+
+    print('Splitting into %d shards...' % (len(shards)))
+    put_json(shard_key(job_id, 'plan'), {
+        'dialect': dialect,
+        'read_csv_args': shard_read_csv_args(head, read_csv_args(dialect)),
+        'shards': shards,
+        'started': time.time(),
+        'cache_key': cache_key
+    })
+    dynamodb.Table(TABLE_NAME).update_item(
+        Key={
+            'id': job_id
+        },
+        UpdateExpression="set shards = :n remove shards_done, shards_failed",
+        ExpressionAttributeValues={
+            ':n': len(shards)
+        }
+    )
+    entries = [{
+        'Id': str(shard['index']),
+        'MessageBody': job_id,
+        'MessageAttributes': {
+            'shard': {
+                'DataType': 'Number',
+                'StringValue': str(shard['index'])
+            }
+        }
+    } for shard in shards]
+    for i in range(0, len(entries), 10):
+        response = sqs.send_message_batch(QueueUrl=QUEUE_URL, Entries=entries[i:i + 10])
+        if response.get('Failed'):
+            raise IOError('Could not queue shards: %s' % (response['Failed']))
+    return True
+
+
+def run_shard(job_id, job, index, metrics, last_try=False):
+    '''Validates one shard of the job's object, the shard that completes
+    the set merges them all into the job's result. Returns what run_job()
+    does, or None and False for the other shards.
+
+    A shard that raises on the last try of its message is counted as
+    failed, and a job with failed shards ends as failed once every shard
+    is done or failed, instead of waiting for them forever.
+    '''
+    plan = None
+    counted = 'shards_done'
+    try:
+        plan = validate_shard(job_id, job, index, metrics)
+    except Exception as e:
+        if not last_try:
+            raise
+        print('Shard %d failed on its last try: %s' % (index, e))
+        put_json(shard_key(job_id, index), {'error': str(e)})
+        counted = 'shards_failed'
+
+    # a set, so a redelivered shard is only counted once
+    with metrics.stage('update_job'):
+        response = dynamodb.Table(TABLE_NAME).update_item(
+            Key={
+                'id': job_id
+            },
+            UpdateExpression="add %s :i" % (counted),
+            ExpressionAttributeValues={
+                ':i': set([index])
+            },
+            ReturnValues="ALL_NEW"
         )
+    job = response['Attributes']
+    settled = job.get('shards_done', set()) | job.get('shards_failed', set())
+    if len(settled) < job['shards']:
+        return None, False
+    if job.get('shards_failed'):
+        return fail_shards(job_id, job, metrics)
+    return merge_shards(job_id, job, plan, metrics)
+
+
+def validate_shard(job_id, job, index, metrics):
+    '''Validates one shard and keeps its state for the merge, returns
+    the plan of the shards'''
+    from rules import ValidationEngine
+    from rules import IntermediateWriter
+    from error_report import MAX_STORED_ERRORS_PER_RULE
+    from sharding import ShardReport
+
+    with metrics.stage('get_plan'):
+        plan = get_json(shard_key(job_id, 'plan'))
+    shard = plan['shards'][index]
+    print('Retrieving bytes %d to %d of the csv file from S3...' % (shard['offset'], shard['end']))
+    with metrics.stage('get_object'):
+        obj = get_object(
+            s3,
+            Bucket=SOURCE_BUCKET_NAME,
+            Key=job['filename'],
+            VersionId=job['filename_version'],
+            start=shard['offset'],
+            end=shard['end']
+        )
+
+    rules = rule_registry().create(job)
+    intermediate = None
+    if WRITE_INTERMEDIATE:
+        intermediate = IntermediateWriter('%s-%05d.parquet' % (job_id, index))
+        rules.append(intermediate)
+    report = ShardReport(MAX_STORED_ERRORS_PER_RULE)
+    engine = ValidationEngine(
+        rules, reporter=report, dialect=plan['dialect'], shard=shard,
+        read_csv_args=plan['read_csv_args'] if index > 0 else None)
+
+    print('Validating shard %d of %d...' % (index + 1, shard['count']))
+    with metrics.stage('validate'):
+        has_error, _ = engine.run(obj)
+    metrics.add_rule_metrics(engine.metrics)
+    metrics.count('bytes_read', engine.bytes_read)
+    metrics.count('rows', engine.rows)
+
+    if intermediate is not None and os.path.exists(intermediate.filename):
+        if engine.parsed:
+            with metrics.stage('upload_intermediate'):
+                s3.upload_file(intermediate.filename, TARGET_BUCKET_NAME,
+                               'intermediate/%s/%05d.parquet' % (job_id, index))
+        os.remove(intermediate.filename)
 
+    with metrics.stage('put_state'):
+        put_json(shard_key(job_id, index), {
+            'has_error': has_error,
+            'parsed': engine.parsed,
+            'counts': report.counts,
+            'messages': report.messages,
+            'rule_states': engine.shard_states,
+            'metrics': engine.metrics
+        })
+    return plan
+
+
+def fail_shards(job_id, job, metrics):
+    '''Ends a job that lost shards, its report says which and why'''
+    from error_report import S3ErrorReport
+
+    count = int(job['shards'])
+    report = S3ErrorReport(s3, TARGET_BUCKET_NAME, 'validation/%s.csv.gz' % (job_id))
+    for index in sorted(int(index) for index in job['shards_failed']):
         try:
-            # read SQS message
-            receipt_handle = response['Messages'][0]['ReceiptHandle']
-            job_id = response['Messages'][0]['Body']
-
-            # get job from DDB
-            print('Retrieving job %s from DynamoDB...' % (job_id))
-            table = dynamodb.Table(TABLE_NAME)
-            response = table.get_item(Key={'id': job_id})
-
-            print('Retrieving csv file from S3...')
-            filename = '%s.csv' % (job_id)
-            obj = s3.get_object(
-                Bucket=SOURCE_BUCKET_NAME,
-                Key=response['Item']['filename'],
-                VersionId=response['Item']['filename_version']
-            )
-
-            # run validation rules
-            rule1 = CsvHeaderRule()
-            print('Validating if header exist and header names...')
-            r1_err, r1_messages = rule1.validate(obj)
-            rule2 = FileSizeEncodingRule()
-            print('Validating file size and encoding...')
-            r2_err, r2_messages = rule2.validate(obj)
-            print('Validation done')
-
-            # if there are errors...
-            if (r1_err or r2_err):
-                print('Error found')
-
-                # generate csv
-                print('Generating error messages csv file...')
-                error_messages = r1_messages + r2_messages
-                with open(filename, mode='w') as result_csv:
-                    writer = csv.writer(
-                        result_csv, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
-                    writer.writerow(['type', 'message'])
-                    for err in error_messages:
-                        writer.writerow(err)
-
-                # upload csv to S3
-                print('Uploading to S3...')
+            error = get_json(shard_key(job_id, index)).get('error')
+        except ClientError as e:
+            error = str(e)
+        report.add('ShardedJob', 'error', 'Shard %d of %d could not be validated: %s' % (
+            index + 1, count, error))
+    result = close_report(report, metrics)
+    delete_shard_state(job_id, count)
+    return {'result': result}, False
+
+
+def merge_metrics(all_metrics):
+    merged = {}
+    for metrics in all_metrics:
+        for name, stats in metrics.items():
+            totals = merged.setdefault(name, {})
+            for key, value in stats.items():
+                totals[key] = totals.get(key, 0) + value
+    return merged
+
+
+def merge_shards(job_id, job, plan, metrics):
+    from rules import ValidationEngine
+    from error_report import S3ErrorReport
+
+    print('Merging %d shards...' % (len(plan['shards'])))
+    with metrics.stage('merge_shards'):
+        states = [get_json(shard_key(job_id, shard['index'])) for shard in plan['shards']]
+        report = S3ErrorReport(s3, TARGET_BUCKET_NAME, 'validation/%s.csv.gz' % (job_id))
+        for state in states:
+            report.merge(state['counts'], state['messages'])
+        engine = ValidationEngine(
+            rule_registry().create(job), reporter=report, dialect=plan['dialect'])
+        has_error = engine.merge_shards([state['rule_states'] for state in states])
+        has_error = has_error or any(state['has_error'] for state in states)
+    parsed = all(state['parsed'] for state in states)
+
+    result = report_result(report, has_error, metrics)
+    result['dialect'] = plan['dialect']
+    if parsed and WRITE_INTERMEDIATE:
+        # one Parquet file per shard
+        result['intermediate_key'] = 'intermediate/%s/' % (job_id)
+    rule_metrics = merge_metrics(state['metrics'] for state in states)
+    metrics.count('shards', len(states))
+
+    # the job took from its planning to now
+    metrics.started = time.perf_counter() - (time.time() - plan['started'])
+    if plan['cache_key'] is not None:
+        with metrics.stage('cache'):
+            result_cache.put(plan['cache_key'], job_id, dict(result, job_id=job_id, parsed=parsed))
+    delete_shard_state(job_id, len(plan['shards']))
+    return {'result': result, 'rule_metrics': rule_metrics}, parsed
+
+
+def run_job(job_id, job, metrics):
+    '''Validates the job's object and uploads what it produced.
+
+    Returns the keyword arguments of update_job() and whether the job goes
+    on to profiling, the caller writes them.
+    '''
+    from rules import ValidationEngine
+    from rules import IntermediateWriter
+    from parquet_converter import ParquetConverter
+    from parquet_converter import conversion_options
+    from error_report import S3ErrorReport
+    import pyarrow as pa
+
+    print('Retrieving csv file from S3...')
+    with metrics.stage('get_object'):
+        obj = get_object(
+            s3,
+            Bucket=SOURCE_BUCKET_NAME,
+            Key=job['filename'],
+            VersionId=job['filename_version'],
+            decompress=True
+        )
+
+    rules = rule_registry().create(job)
+    options = conversion_options(job)
+    intermediate = None
+    if WRITE_INTERMEDIATE or options is not None:
+        intermediate = IntermediateWriter('%s.parquet' % (job_id))
+        rules.append(intermediate)
+    # messages are compressed and uploaded while the rules run
+    report = S3ErrorReport(s3, TARGET_BUCKET_NAME, 'validation/%s.csv.gz' % (job_id))
+    engine = ValidationEngine(rules, reporter=report)
+
+    # the same bytes checked by the same rules give the same result
+    cache_key = None
+    if result_cache is not None:
+        fingerprint = engine.fingerprint()
+        if options is not None:
+            fingerprint = [fingerprint, options, source_fingerprint(ParquetConverter)]
+        cache_key = ResultCache.key(
+            'validation', obj['ETag'], obj['ContentLength'], fingerprint)
+        with metrics.stage('cache'):
+            cached = None if job.get('force_rerun') else result_cache.get(cache_key)
+            # the parsed rows can expire before the entry
+            if cached is not None and cached.get('intermediate_key') and \
+                    not intermediate_exists(cached['intermediate_key']):
+                print('Parsed rows of job %s expired, dropping its cached result' % (cached['job_id']))
+                result_cache.delete(cache_key)
+                cached = None
+        if cached is not None:
+            print('Reusing validation result of job %s' % (cached['job_id']))
+            obj['Body'].close()
+            return {'result': cached, 'cached_from': cached['job_id']}, bool(cached.get('parsed'))
+
+    # large files are split for every task to validate a part of them,
+    # compressed ones can only be read from their start
+    if (SHARD_SIZE and obj['ContentLength'] >= 2 * SHARD_SIZE and options is None and
+            obj['Compression'] is None and
+            all(rule.sharding is not None for rule in rules)):
+        report.abort()
+        with metrics.stage('plan_shards'):
+            planned = start_shards(job_id, obj, cache_key)
+        if planned:
+            return None, False
+        print('Could not split the file, validating it whole')
+        obj = get_object(
+            s3,
+            Bucket=SOURCE_BUCKET_NAME,
+            Key=job['filename'],
+            VersionId=job['filename_version'],
+            decompress=True
+        )
+
+    # run validation rules over a single pass of the object body
+    print('Validating with %s...' % (', '.join(type(rule).__name__ for rule in engine.rules)))
+    with metrics.stage('validate'):
+        has_error, _ = engine.run(obj)
+    # download, detect_dialect and parse are the parts of validate
+    metrics.add_rule_metrics(engine.metrics)
+    metrics.count('bytes_read', engine.bytes_read)
+    metrics.count('rows', engine.rows)
+    if obj['Compression'] is not None:
+        print('Validation done, read %d bytes of %s data' % (engine.bytes_read, obj['Compression']))
+    else:
+        print('Validation done, read %d bytes' % (engine.bytes_read))
+    print('Detected dialect: %s' % (engine.dialect))
+    print('Rule metrics: %s' % (engine.metrics))
+
+    # files that pass validation are also written as Parquet for Athena
+    parquet_uri = None
+    parquet_error = None
+    errors = report.totals.get('error', 0)
+    passed = engine.parsed and (not has_error or errors == 0)
+    if options is not None and passed and os.path.exists(intermediate.filename):
+        try:
+            with metrics.stage('convert_parquet'):
+                parquet_uri = convert_to_parquet(job_id, rules, intermediate.filename, options)
+        except (ValueError, OverflowError, pa.ArrowException) as e:
+            # the file itself is fine, report it apart from the validation result
+            parquet_error = str(e)
+            print('Could not convert to Parquet: %s' % (parquet_error))
+
+    result = report_result(report, has_error, metrics)
+    result['dialect'] = engine.dialect
+    result['parquet_uri'] = parquet_uri
+    result['parquet_error'] = parquet_error
+    if obj['Compression'] is not None:
+        result['compression'] = obj['Compression']
+        if engine.parsed:
+            result['uncompressed_size'] = engine.bytes_read
+
+    # parsed rows for profiling, only when every row made it through
+    if intermediate is not None and os.path.exists(intermediate.filename):
+        if engine.parsed and WRITE_INTERMEDIATE:
+            result['intermediate_key'] = 'intermediate/%s' % (intermediate.filename)
+            print('Uploading %d parsed rows to S3...' % (intermediate.rows))
+            with metrics.stage('upload_intermediate'):
                 response = s3.upload_file(
-                    filename, TARGET_BUCKET_NAME, 'validation/%s' % (filename))
-                print('S3 response: %s' % (response))
-
-                # count errors and warnings
-                errors = 0
-                warnings = 0
-                for err in error_messages:
-                    if err[0] == 'error':
-                        errors = errors + 1
-                    else:
-                        warnings = warnings + 1
-                print('Found %d warnings and %d errors' % (warnings, errors))
-
-                # update DDB table
-                print('Updating job in DynamoDB...')
-                response = table.update_item(
-                    Key={
-                        'id': job_id
-                    },
-                    UpdateExpression="set result_uri = :r, warnings = :w, errors = :e, #status = :s, end_ts = :d",
-                    ExpressionAttributeValues={
-                        ':r': 'https://%s.s3-%s.amazonaws.com/validation/%s' % (TARGET_BUCKET_NAME, REGION, filename),
-                        ':w': warnings,
-                        ':e': errors,
-                        ':s': 'failed' if errors > 0 else 'success',
-                        ':d': datetime.datetime.utcnow().isoformat()
-                    },
-                    ExpressionAttributeNames={
-                        '#status': 'status'
-                    },
-                    ReturnValues="UPDATED_NEW"
-                )
-                print('DynamoDB response: %s' % (response))
-            else:
-                print('No error found')
-                print('Updating job in DynamoDB...')
-                response = table.update_item(
-                    Key={
-                        'id': job_id
-                    },
-                    UpdateExpression="set #status = :s, end_ts = :d",
-                    ExpressionAttributeValues={
-                        ':s': 'success',
-                        ':d': datetime.datetime.utcnow().isoformat()
-                    },
-                    ExpressionAttributeNames={
-                        '#status': 'status'
-                    },
-                    ReturnValues="UPDATED_NEW"
-                )
-                print('DynamoDB response: %s' % (response))
-
-            # Delete received message from queue
-            print('Deleting SQS message from queue...')
-            sqs.delete_message(
-                QueueUrl=QUEUE_URL,
-                ReceiptHandle=receipt_handle
-            )
-
-            print('Validation job done')
-
-        # Manage case queue is empty
-        except KeyError:
-            print('No messages anymore')
-
-        except Exception as error:
-            print('Uncaught exception: %s' % (error))
-
-        time.sleep(1)
+                    intermediate.filename, TARGET_BUCKET_NAME, result['intermediate_key'])
+            print('S3 response: %s' % (response))
+        os.remove(intermediate.filename)
+
+    if cache_key is not None:
+        with metrics.stage('cache'):
+            result_cache.put(cache_key, job_id, dict(result, job_id=job_id, parsed=engine.parsed))
+    return {'result': result, 'rule_metrics': engine.metrics}, engine.parsed
+
+
+def read_head(entry, size):
+    '''The first size bytes of a batch file, empty when it can not be read'''
+    try:
+        obj = get_object(s3, Bucket=SOURCE_BUCKET_NAME, Key=entry['key'],
+                         VersionId=entry['version_id'], decompress=True)
+        head = obj['Body'].read(size)
+        obj['Body'].close()
+    except (ClientError, IOError, DecompressionError) as e:
+        print('Could not read the head of %s: %s' % (entry['key'], e))
+        return b''
+    return head
+
+
+def validate_batch_file(entry, job, dialect, columns):
+    '''Validates one file of a batch with the dialect and columns of the
+    batch, returns its result and the collector of its messages'''
+    from rules import ValidationEngine
+    from rules import SchemaRule
+    from sharding import ShardReport
+
+    collector = ShardReport(BATCH_MAX_STORED_PER_FILE)
+    result = {'rows': 0, 'bytes': 0}
+    try:
+        # the files are read at the same time, each with fewer parts ahead
+        obj = get_object(s3, Bucket=SOURCE_BUCKET_NAME, Key=entry['key'],
+                         VersionId=entry['version_id'], decompress=True, concurrency=2)
+        rules = rule_registry().create(job)
+        if columns is not None:
+            rules.append(SchemaRule(columns))
+        # the files run in parallel, their rules in turn
+        engine = ValidationEngine(rules, reporter=collector, parallel=False, dialect=dialect)
+        has_error, _ = engine.run(obj)
+        result.update(rows=engine.rows, bytes=engine.bytes_read)
+    except (ClientError, IOError) as e:
+        has_error = True
+        collector.add('BatchJob', 'error', 'Could not read the file: %s' % (e))
+    if not has_error and not collector.totals.get('warning'):
+        # only the notes of a file that passed, left out of the batch report
+        collector = ShardReport(BATCH_MAX_STORED_PER_FILE)
+
+    result['errors'] = collector.totals.get('error', 0)
+    result['warnings'] = collector.totals.get('warning', 0)
+    result['status'] = 'failed' if result['errors'] > 0 else 'passed'
+    return result, collector
+
+
+def run_batch(job_id, job, metrics):
+    '''Validates the files of a batch job's manifest into one report, with
+    one dialect and header for all of them and several files at a time.
+    Returns what run_job() does, batches are not profiled.
+    '''
+    from rules.dialect import DIALECT_SAMPLE_SIZE
+    from rules.dialect import detect_dialect
+    from error_report import BatchReport
+    from batch import BATCH_SETTINGS
+    from batch import read_manifest
+    from batch import batch_files
+    from batch import header_columns
+
+    report = BatchReport(s3, TARGET_BUCKET_NAME, 'validation/%s.csv.gz' % (job_id))
+    print('Reading the batch manifest from S3...')
+    try:
+        with metrics.stage('list_files'):
+            manifest = read_manifest(
+                s3, SOURCE_BUCKET_NAME, job['filename'], job['filename_version'])
+            files = batch_files(s3, SOURCE_BUCKET_NAME, manifest)
+    except (ValueError, ClientError) as e:
+        report.add('BatchJob', 'error', 'Could not read the manifest: %s' % (e))
+        return {'result': close_report(report, metrics)}, False
+
+    # the manifest's rule settings apply to every file
+    settings = dict(job)
+    settings.update((name, manifest[name]) for name in BATCH_SETTINGS if name in manifest)
+
+    # the dialect and header of the batch, given or from the first file
+    dialect = manifest.get('dialect')
+    columns = manifest.get('columns')
+    if dialect is None or columns is None:
+        with metrics.stage('detect_dialect'):
+            head = read_head(files[0], DIALECT_SAMPLE_SIZE)
+            if dialect is None:
+                dialect = detect_dialect(head, complete=len(head) < DIALECT_SAMPLE_SIZE)
+            if columns is None and dialect is not None and head:
+                columns = header_columns(head, dialect)
+    print('Validating %d files with dialect %s and columns %s...' % (len(files), dialect, columns))
+
+    # built once here rather than by the first threads at the same time
+    rule_registry()
+    failed = 0
+    with metrics.stage('validate'):
+        with ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY) as executor:
+            results = executor.map(
+                lambda entry: validate_batch_file(entry, settings, dialect, columns), files)
+            # in the order of the manifest, whichever file finishes first
+            for entry, (result, collector) in zip(files, results):
+                report.add_file(entry['key'], result, collector)
+                failed += result['status'] == 'failed'
+                metrics.count('bytes_read', result['bytes'])
+                metrics.count('rows', result['rows'])
+    print('%d of %d files failed' % (failed, len(files)))
+
+    # the report has a result row for every file, kept even without errors
+    result = close_report(report, metrics)
+    result['dialect'] = dialect
+    result['batch_files'] = len(files)
+    result['batch_failed'] = failed
+    return {'result': result}, False
+
+
+def validate_job(message):
+    job_id = message['Body']
+    metrics = JobMetrics('validation', job_id, message)
+
+    # get job from DDB
+    print('Retrieving job %s from DynamoDB...' % (job_id))
+    table = dynamodb.Table(TABLE_NAME)
+    with metrics.stage('get_job'):
+        # small files are queued as soon as the trigger wrote their job
+        response = table.get_item(Key={'id': job_id}, ConsistentRead=True)
+    job = response['Item']
+
+    # a redelivered message for a job that already finished is a no-op
+    if 'end_ts' in job:
+        print('Job %s already done, skipping' % (job_id))
+        return
+
+    shard = shard_index(message)
+    if shard is None:
+        with metrics.stage('mark_started'):
+            table.update_item(Key={'id': job_id}, **started_update())
+    if shard is not None:
+        update, parsed = run_shard(job_id, job, shard, metrics, last_receive(message))
+    elif job.get('job_type') == 'batch':
+        update, parsed = run_batch(job_id, job, metrics)
+    else:
+        update, parsed = run_job(job_id, job, metrics)
+    # a split job or a shard, the last shard writes the result
+    if update is None:
+        metrics.emit()
+        return
+
+    with metrics.stage('update_job'):
+        update_job(table, job_id, job_metrics=metrics.summary(), **update)
+    if PROFILING_QUEUE_URL and parsed:
+        with metrics.stage('enqueue'):
+            enqueue_profiling(job_id)
+
+    metrics.emit()
+    print('Validation job done')
+
+
+async def prepare_job(clients, message):
+    job_id = message['Body']
+    metrics = JobMetrics('validation', job_id, message)
+    print('Retrieving job %s from DynamoDB...' % (job_id))
+    with metrics.stage('get_job'):
+        job = await clients.get_item(TABLE_NAME, {'id': job_id})
+    if 'end_ts' in job:
+        print('Job %s already done, skipping' % (job_id))
+        return None
+    shard = shard_index(message)
+    if shard is None:
+        with metrics.stage('mark_started'):
+            await clients.update_item(TABLE_NAME, {'id': job_id}, **started_update())
+    return job_id, job, metrics, shard, last_receive(message)
+
+
+def work_job(job_id, job, metrics, shard, last_try=False):
+    # runs in the pool, the metrics travel there and back
+    metrics.resume()
+    if shard is not None:
+        update, parsed = run_shard(job_id, job, shard, metrics, last_try)
+    elif job.get('job_type') == 'batch':
+        update, parsed = run_batch(job_id, job, metrics)
+    else:
+        update, parsed = run_job(job_id, job, metrics)
+    metrics.sample_rss()
+    return update, parsed, metrics
+
+
+async def complete_job(clients, message, args, outcome):
+    job_id = args[0]
+    update, parsed, metrics = outcome
+    if update is None:
+        metrics.emit()
+        return
+    print('Updating job in DynamoDB...')
+    with metrics.stage('update_job'):
+        await clients.update_item(
+            TABLE_NAME, {'id': job_id}, **job_update(job_metrics=metrics.summary(), **update))
+    if PROFILING_QUEUE_URL and parsed:
+        print('Sending job %s to profiling...' % (job_id))
+        with metrics.stage('enqueue'):
+            await clients.sqs.send_message(**profiling_message(job_id))
+
+    metrics.emit()
+    print('Validation job done')
+
+
+if __name__ == "__main__":
+    if WORKER_MODE == 'async':
+        # control-plane calls on an event loop, data work on the pool
+        from common.async_worker import AsyncWorker
+        worker = AsyncWorker(
+            REGION,
+            QUEUE_URL,
+            prepare_job,
+            work_job,
+            complete_job,
+            workers=WORKER_COUNT or None,
+            visibility_timeout=VISIBILITY_TIMEOUT,
+            preload=PRELOAD
+        )
+    else:
+        # long-poll the queue in batches and run jobs on a pool sized to the task
+        worker = SqsConsumer(
+            sqs,
+            QUEUE_URL,
+            validate_job,
+            workers=WORKER_COUNT or None,
+            visibility_timeout=VISIBILITY_TIMEOUT,
+            preload=PRELOAD
+        )
+    worker.run()
@@ -0,0 +1,76 @@
+import io
+import os
+import csv
+import json
+from common import csv_reader_args
+
+# Batch jobs are created by uploading a manifest, a JSON object with the
+# prefix of the files or a list of their keys
+MANIFEST_SUFFIX = '.manifest.json'
+
+# Files in one batch job at most
+MAX_BATCH_FILES = int(os.environ.get('MAX_BATCH_FILES', '10000'))
+
+# Job settings a manifest can give for all of its files
+BATCH_SETTINGS = ['constraints', 'enabled_rules', 'disabled_rules', 'rule_options']
+
+
+def read_manifest(client, bucket, key, version_id=None):
+    '''The manifest object as a dict, ValueError when it is not one'''
+    args = {'Bucket': bucket, 'Key': key}
+    if version_id is not None:
+        args['VersionId'] = version_id
+    body = client.get_object(**args)['Body'].read()
+    try:
+        manifest = json.loads(body.decode('utf8'))
+    except ValueError as e:
+        raise ValueError('Manifest is not valid JSON: %s' % (e))
+    if not isinstance(manifest, dict) or ('prefix' in manifest) == ('files' in manifest):
+        raise ValueError('Manifest needs either a prefix or a list of files')
+    if 'prefix' in manifest and not isinstance(manifest['prefix'], str):
+        raise ValueError('Manifest prefix is not a string')
+    if 'files' in manifest and not isinstance(manifest['files'], list):
+        raise ValueError('Manifest files are not a list')
+    if not isinstance(manifest.get('dialect', {}), dict):
+        raise ValueError('Manifest dialect is not an object')
+    columns = manifest.get('columns', [])
+    if not isinstance(columns, list) or not all(isinstance(column, str) for column in columns):
+        raise ValueError('Manifest columns are not a list of names')
+    return manifest
+
+
+def batch_files(client, bucket, manifest):
+    '''The files of a manifest as dicts of key and version_id, in the order
+    of the manifest or of their keys under the prefix'''
+    if 'files' in manifest:
+        files = []
+        for i, entry in enumerate(manifest['files']):
+            if isinstance(entry, str):
+                entry = {'key': entry}
+            if not isinstance(entry, dict) or not isinstance(entry.get('key'), str) or \
+                    not isinstance(entry.get('version_id') or '', str):
+                raise ValueError('Manifest file %d is neither a key nor an object with a key '
+                                 'and optional version_id' % (i + 1))
+            files.append({'key': entry['key'], 'version_id': entry.get('version_id')})
+    else:
+        files = []
+        paginator = client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket, Prefix=manifest['prefix']):
+            for obj in page.get('Contents', []):
+                # folders and the manifests of other batches
+                if obj['Key'].endswith('/') or obj['Key'].endswith(MANIFEST_SUFFIX):
+                    continue
+                files.append({'key': obj['Key'], 'version_id': None})
+
+    if not files:
+        raise ValueError('Manifest lists no files')
+    if len(files) > MAX_BATCH_FILES:
+        raise ValueError('Manifest lists %d files, a batch takes at most %d' % (
+            len(files), MAX_BATCH_FILES))
+    return files
+
+
+def header_columns(head, dialect):
+    '''Fields of the first row of head'''
+    text = head.decode('utf8', 'replace').lstrip('\ufeff')
+    return next(csv.reader(io.StringIO(text), **csv_reader_args(dialect)), [])
@@ -0,0 +1,136 @@
+import io
+import os
+import csv
+import gzip
+from rules import ErrorCollector
+
+# Messages of a single rule written to the report, all are counted
+MAX_STORED_ERRORS_PER_RULE = int(os.environ.get('MAX_STORED_ERRORS_PER_RULE', '10000'))
+
+# Compressed bytes uploaded at a time, S3 takes parts of at least 5 MB
+REPORT_PART_SIZE = max(int(os.environ.get('REPORT_PART_SIZE_MB', '8')), 5) * 1024 * 1024
+
+
+class S3ErrorReport(ErrorCollector):
+    '''Streams the messages as a gzip compressed CSV to S3.
+
+    Rows are compressed as they are added and every REPORT_PART_SIZE bytes
+    of output are sent as one part of a multipart upload, so neither memory
+    nor disk grow with the number of messages. Nothing is kept in
+    messages, read the counts instead. close() finishes the upload, a
+    report that is never closed is aborted.
+    '''
+
+    columns = ['type', 'message', 'rule']
+
+    def __init__(self, client, bucket, key, max_per_rule=MAX_STORED_ERRORS_PER_RULE,
+                 part_size=REPORT_PART_SIZE):
+        super().__init__(max_per_rule)
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        self.upload_id = None
+        self.parts = []
+        self.buffer = io.BytesIO()
+        self.text = io.TextIOWrapper(
+            gzip.GzipFile(fileobj=self, mode='wb'), encoding='utf8', newline='')
+        self.writer = csv.writer(self.text, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+        self.writer.writerow(self.columns)
+
+    def _store(self, rule, kind, message):
+        self.writer.writerow(self._row(rule, kind, message))
+
+    def _row(self, rule, kind, message):
+        return [kind, message, rule]
+
+    def write(self, data):
+        # called by GzipFile with compressed bytes
+        self.buffer.write(data)
+        if self.buffer.tell() >= self.part_size:
+            self._upload_part()
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        '''Notes what the caps left out and completes the upload'''
+        with self.lock:
+            for rule, count in sorted(self.dropped().items()):
+                self.writer.writerow(self._row(
+                    rule, 'warning', '%d more messages not stored, the report keeps the first %d' % (
+                        count, self.max_per_rule)))
+            self.text.close()
+
+            if self.upload_id is None:
+                self.client.put_object(Body=self.buffer.getvalue(), **self._object_args())
+                return
+            try:
+                self._upload_part()
+                self.client.complete_multipart_upload(
+                    Bucket=self.bucket,
+                    Key=self.key,
+                    UploadId=self.upload_id,
+                    MultipartUpload={'Parts': self.parts}
+                )
+            except Exception:
+                self.abort()
+                raise
+
+    def abort(self):
+        if self.upload_id is not None:
+            self.client.abort_multipart_upload(
+                Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+            self.upload_id = None
+
+    def _object_args(self):
+        # served as CSV, browsers decompress it on download
+        return {
+            'Bucket': self.bucket,
+            'Key': self.key,
+            'ContentType': 'text/csv',
+            'ContentEncoding': 'gzip'
+        }
+
+    def _upload_part(self):
+        if self.upload_id is None:
+            self.upload_id = self.client.create_multipart_upload(
+                **self._object_args())['UploadId']
+        response = self.client.upload_part(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            PartNumber=len(self.parts) + 1,
+            Body=self.buffer.getvalue()
+        )
+        self.parts.append({'ETag': response['ETag'], 'PartNumber': len(self.parts) + 1})
+        self.buffer = io.BytesIO()
+
+
+class BatchReport(S3ErrorReport):
+    '''One report for all the files of a batch job.
+
+    Every message says which file it is about, and every file gets a
+    result row with its status and counts. Files are added whole with
+    add_file(), one at a time, the caps apply to the batch.
+    '''
+
+    columns = ['file', 'type', 'message', 'rule']
+
+    def __init__(self, *args, **kwargs):
+        self.file = ''
+        super().__init__(*args, **kwargs)
+
+    def add_file(self, key, result, collector):
+        '''Adds the messages a file's collector kept and counted, then
+        the file's result: status, errors, warnings, rows and bytes'''
+        self.file = key
+        self.merge(collector.counts, collector.messages)
+        with self.lock:
+            self.writer.writerow(self._row('BatchJob', 'result', '%s: %d errors, %d warnings, %d rows, %d bytes' % (
+                result['status'], result['errors'], result['warnings'], result['rows'], result['bytes'])))
+        self.file = ''
+
+    def _row(self, rule, kind, message):
+        return [self.file, kind, message, rule]
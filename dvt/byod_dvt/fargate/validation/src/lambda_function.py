@@ -0,0 +1,26 @@
+import os
+import app
+from common import import_modules
+
+# during the init phase, which runs with the full CPU of the function
+import_modules(app.PRELOAD)
+
+
+def sqs_message(record):
+    '''An SQS record of a Lambda event as the message validate_job() takes'''
+    return {
+        'MessageId': record['messageId'],
+        'Body': record['body'],
+        'Attributes': record.get('attributes') or {},
+        'MessageAttributes': dict(
+            (name, {'DataType': value['dataType'], 'StringValue': value.get('stringValue')})
+            for name, value in (record.get('messageAttributes') or {}).items())
+    }
+
+
+def lambda_handler(event, context):
+    # the function's code is read-only, jobs write their files in /tmp
+    os.chdir('/tmp')
+    print('Received %d jobs' % (len(event['Records'])))
+    for record in event['Records']:
+        app.validate_job(sqs_message(record))
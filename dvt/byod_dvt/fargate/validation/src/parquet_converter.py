@@ -0,0 +1,171 @@
+import os
+import re
+from urllib.parse import quote
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pandas as pd
+
+# Convert the files that pass validation to Parquet, jobs can override it
+CONVERT_TO_PARQUET = os.environ.get('CONVERT_TO_PARQUET', '0') == '1'
+PARQUET_ROW_GROUP_ROWS = int(os.environ.get('PARQUET_ROW_GROUP_ROWS', '1000000'))
+PARQUET_COMPRESSION = os.environ.get('PARQUET_COMPRESSION', 'snappy')
+
+# Files written at once when partitioning, one per partition value
+MAX_PARTITIONS = int(os.environ.get('PARQUET_MAX_PARTITIONS', '1000'))
+
+ARROW_TYPES = {
+    'integer': pa.int64(),
+    'float': pa.float64(),
+    'boolean': pa.bool_(),
+    'date': pa.timestamp('ns'),
+    'string': pa.string()
+}
+
+TRUE_VALUES = ['true', 'yes']
+
+# Hive's name for the partition of null values
+NULL_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+
+
+def canonical(x):
+    # invalid characters in column names are replaced by _, as in the ingestion lab
+    return re.sub("[ ,;{}()\n\t=]+", '_', x.lower())
+
+
+def canonical_names(names):
+    '''canonical() of every name, with a suffix for names it made equal'''
+    columns = []
+    for name in names:
+        column = canonical(name)
+        n = 1
+        while column in columns:
+            n += 1
+            column = '%s_%d' % (canonical(name), n)
+        columns.append(column)
+    return columns
+
+
+def conversion_options(job):
+    '''Parquet settings of a job, None when it is not converted'''
+    if not job.get('convert_to_parquet', CONVERT_TO_PARQUET):
+        return None
+    return {
+        'partition_by': list(job.get('parquet_partition_by') or []),
+        'row_group_rows': int(job.get('parquet_row_group_rows', PARQUET_ROW_GROUP_ROWS)),
+        'compression': job.get('parquet_compression', PARQUET_COMPRESSION)
+    }
+
+
+def to_arrow(values, type_name):
+    '''Arrow array of the given type from a Series of strings and NaN'''
+    present = values.notna().values
+    if type_name == 'integer':
+        data = np.zeros(len(values), dtype='int64')
+        data[present] = values.values[present].astype('int64')
+        return pa.array(data, mask=~present)
+    if type_name == 'float':
+        return pa.array(pd.to_numeric(values).values, mask=~present)
+    if type_name == 'boolean':
+        return pa.array(values.str.lower().isin(TRUE_VALUES).values, mask=~present)
+    if type_name == 'date':
+        return pa.array(pd.to_datetime(values, errors='coerce'), type=ARROW_TYPES['date'])
+    return pa.array(values, type=pa.string(), from_pandas=True)
+
+
+class ParquetConverter:
+    '''Writes the rows parsed during validation as typed Parquet files.
+
+    Reads the row groups of strings written by IntermediateWriter, casts
+    every column to its type in schema (TypeConsistencyRule.schema) and
+    renames the columns with canonical(). With partition_by the rows are
+    split into <column>=<value>/ directories, Hive style. Rows are buffered
+    per file up to row_group_rows, and all buffers are written out once
+    they hold twice that many rows together.
+    '''
+
+    def __init__(self, schema, partition_by=None, row_group_rows=PARQUET_ROW_GROUP_ROWS,
+                 compression=PARQUET_COMPRESSION):
+        self.schema = schema
+        self.partition_by = list(partition_by or [])
+        self.row_group_rows = row_group_rows
+        self.compression = compression
+        self.types = []
+        self.arrow_schema = None
+        self.buffers = {}
+        self.buffered_rows = 0
+        self.writers = {}
+        self.files = []
+        self.rows = 0
+
+    def convert(self, source, target_dir):
+        '''Converts the Parquet file source, returns the paths written
+        relative to target_dir'''
+        parquet = pq.ParquetFile(source)
+        names = parquet.schema_arrow.names
+        columns = canonical_names(names)
+
+        partition_by = [canonical(name) for name in self.partition_by]
+        for name, column in zip(self.partition_by, partition_by):
+            if column not in columns:
+                raise ValueError('Unknown partition column %s' % (name))
+        self.types = [(column, self.schema.get(name) or 'string')
+                      for name, column in zip(names, columns) if column not in partition_by]
+        self.arrow_schema = pa.schema([pa.field(column, ARROW_TYPES[type_name])
+                                       for column, type_name in self.types])
+
+        try:
+            for i in range(parquet.num_row_groups):
+                frame = parquet.read_row_group(i).to_pandas()
+                frame.columns = columns
+                self._add_frame(frame, partition_by, target_dir)
+            for path in list(self.buffers):
+                self._flush(path, target_dir)
+        finally:
+            for writer in self.writers.values():
+                writer.close()
+        return self.files
+
+    def _add_frame(self, frame, partition_by, target_dir):
+        self.rows += len(frame)
+        table = pa.Table.from_arrays(
+            [to_arrow(frame[column], type_name) for column, type_name in self.types],
+            schema=self.arrow_schema)
+        if not partition_by:
+            self._add('part-00000.parquet', table, target_dir)
+            return
+
+        keys = frame[partition_by].fillna(NULL_PARTITION)
+        for values, rows in keys.groupby(partition_by, sort=False).indices.items():
+            if not isinstance(values, tuple):
+                values = (values,)
+            path = '/'.join('%s=%s' % (column, quote(value, safe=''))
+                            for column, value in zip(partition_by, values))
+            self._add(path + '/part-00000.parquet', table.take(pa.array(rows)), target_dir)
+
+    def _add(self, path, table, target_dir):
+        if path not in self.writers and path not in self.buffers:
+            if len(set(self.writers).union(self.buffers)) >= MAX_PARTITIONS:
+                raise ValueError('More than %d partitions' % (MAX_PARTITIONS))
+        buffered = self.buffers.setdefault(path, [])
+        buffered.append(table)
+        self.buffered_rows += len(table)
+
+        if sum(len(table) for table in buffered) >= self.row_group_rows:
+            self._flush(path, target_dir)
+        elif self.buffered_rows >= 2 * self.row_group_rows:
+            for path in list(self.buffers):
+                self._flush(path, target_dir)
+
+    def _flush(self, path, target_dir):
+        table = pa.concat_tables(self.buffers.pop(path))
+        self.buffered_rows -= len(table)
+        if path not in self.writers:
+            filename = os.path.join(target_dir, path)
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            # Athena reads timestamps written the way Hive does
+            self.writers[path] = pq.ParquetWriter(
+                filename, self.arrow_schema, compression=self.compression,
+                use_deprecated_int96_timestamps=True)
+            self.files.append(path)
+        self.writers[path].write_table(table, row_group_size=self.row_group_rows)
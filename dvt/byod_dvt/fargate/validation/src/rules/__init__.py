@@ -1,2 +1,10 @@
 from .csv_header_rule import CsvHeaderRule
 from .filesize_encoding_rule import FileSizeEncodingRule
+from .type_consistency_rule import TypeConsistencyRule
+from .constraint_rule import ConstraintRule
+from .duplicate_row_rule import DuplicateRowRule
+from .schema_rule import SchemaRule
+from .intermediate_writer import IntermediateWriter
+from .engine import ValidationEngine
+from .report import ErrorCollector
+from .registry import RuleRegistry
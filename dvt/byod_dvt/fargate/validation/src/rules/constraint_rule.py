@@ -0,0 +1,282 @@
+import re
+import numpy as np
+import pandas as pd
+from rules.validation_rule import ValidationRule
+
+
+class Constraint:
+    '''A check of the values of one column, over a whole frame at once.
+
+    violations() gets the column as strings with NaN for empty fields and
+    returns a boolean mask of the rows that break the constraint. Checks
+    other than not_null pass empty fields.
+    '''
+
+    def __init__(self, column, argument):
+        self.column = column
+        self.argument = argument
+
+    def violations(self, values):
+        raise NotImplementedError
+
+    def describe(self):
+        raise NotImplementedError
+
+
+class ValueConstraint(Constraint):
+    '''Decides once per distinct value, the answer is spread to the rows'''
+
+    def violations(self, values):
+        codes, uniques = pd.factorize(values)
+        if not len(uniques):
+            return np.zeros(len(values), dtype=bool)
+        bad = np.append(self.bad_values(pd.Series(uniques, dtype=object)), False)
+        # code -1 (empty) picks the trailing False
+        return bad[codes]
+
+    def bad_values(self, uniques):
+        raise NotImplementedError
+
+
+class NotNull(Constraint):
+    def violations(self, values):
+        return values.isna().values
+
+    def describe(self):
+        return 'must not be empty'
+
+
+class Range(Constraint):
+    '''Built from the min and max of a column's spec.
+
+    Numbers are mostly distinct, so every row is converted rather than
+    the distinct values.
+    '''
+
+    def __init__(self, column, argument):
+        super().__init__(column, argument)
+        self.minimum = None if argument.get('min') is None else float(argument['min'])
+        self.maximum = None if argument.get('max') is None else float(argument['max'])
+
+    def violations(self, values):
+        present = values.notna().values
+        try:
+            numbers = values.values.astype('float64')
+        except (ValueError, TypeError):
+            numbers = pd.to_numeric(values, errors='coerce').values.astype('float64')
+        bad = np.isnan(numbers)
+        if self.minimum is not None:
+            bad |= numbers < self.minimum
+        if self.maximum is not None:
+            bad |= numbers > self.maximum
+        return bad & present
+
+    def describe(self):
+        if self.maximum is None:
+            return 'must be a number of at least %g' % (self.minimum)
+        if self.minimum is None:
+            return 'must be a number of at most %g' % (self.maximum)
+        return 'must be a number between %g and %g' % (self.minimum, self.maximum)
+
+
+class Pattern(ValueConstraint):
+    def __init__(self, column, argument):
+        super().__init__(column, argument)
+        # fails early on a bad pattern
+        re.compile(argument)
+
+    def bad_values(self, uniques):
+        return ~uniques.str.fullmatch(self.argument).values.astype(bool)
+
+    def describe(self):
+        return 'must match %s' % (self.argument)
+
+
+class AllowedValues(ValueConstraint):
+    def __init__(self, column, argument):
+        if not isinstance(argument, list):
+            raise TypeError('expected a list of values')
+        super().__init__(column, argument)
+
+    def bad_values(self, uniques):
+        return ~uniques.isin([str(value) for value in self.argument]).values
+
+    def describe(self):
+        return 'must be one of %s' % (', '.join(str(value) for value in self.argument))
+
+
+class DateFormat(ValueConstraint):
+    def __init__(self, column, argument):
+        if not isinstance(argument, str):
+            raise TypeError('expected a format such as %Y-%m-%d')
+        super().__init__(column, argument)
+
+    def bad_values(self, uniques):
+        return pd.to_datetime(uniques, format=self.argument, errors='coerce').isna().values
+
+    def describe(self):
+        return 'must be a date formatted as %s' % (self.argument)
+
+
+class Unique(Constraint):
+    '''Flags every repeat of a value seen earlier in the file.
+
+    Values are kept as 64 bit hashes in at most MAX_RUNS sorted runs, a
+    run is merged into the one before it once it is as large, so memory is
+    8 bytes per distinct value.
+    '''
+
+    MAX_RUNS = 8
+
+    def __init__(self, column, argument):
+        super().__init__(column, argument)
+        self.runs = []
+
+    def violations(self, values):
+        present = values.notna().values
+        hashes = pd.util.hash_array(values.values[present].astype(object), categorize=False)
+
+        # sorted lookups walk the runs in order, far fewer cache misses
+        order = np.argsort(hashes, kind='stable')
+        hashes = hashes[order]
+        repeated = np.zeros(len(hashes), dtype=bool)
+        repeated[1:] = hashes[1:] == hashes[:-1]
+        for run in self.runs:
+            found = np.searchsorted(run, hashes).clip(max=len(run) - 1)
+            repeated |= run[found] == hashes
+
+        # only values not seen before need keeping
+        new = hashes[~repeated]
+        if len(new):
+            self.runs.append(new)
+        while len(self.runs) > 1 and (len(self.runs[-1]) >= len(self.runs[-2]) or
+                                      len(self.runs) > self.MAX_RUNS):
+            run = self.runs.pop()
+            self.runs[-1] = np.sort(np.concatenate([self.runs[-1], run]))
+
+        bad = np.zeros(len(values), dtype=bool)
+        bad[np.flatnonzero(present)[order[repeated]]] = True
+        return bad
+
+    def describe(self):
+        return 'must be unique'
+
+
+CONSTRAINTS = {
+    'not_null': NotNull,
+    'min': Range,
+    'max': Range,
+    'pattern': Pattern,
+    'allowed': AllowedValues,
+    'date_format': DateFormat,
+    'unique': Unique
+}
+
+
+class ConstraintRule(ValidationRule):
+    '''Checks every row against a per-upload spec of column constraints.
+
+    constraints maps a column name (or its position for files without a
+    header) to its checks, for example
+
+        {"age": {"not_null": true, "min": 0, "max": 130},
+         "email": {"pattern": "[^@]+@[^@]+"},
+         "country": {"allowed": ["FR", "DE"]},
+         "born": {"date_format": "%Y-%m-%d"},
+         "id": {"unique": true}}
+
+    The first max_rows violations of each check are reported with their
+    row numbers as they are found, and finish() adds the exact count of
+    each check. Mistakes in the spec are reported as errors.
+    '''
+
+    uses_bytes = False
+    uses_frames = True
+
+    def __init__(self, constraints=None, severity='error', max_rows=1000):
+        self.constraints = constraints or {}
+        self.severity = severity
+        self.max_rows = max_rows
+        self.spec_errors = []
+        self.checks = []
+        for column, spec in sorted(self.constraints.items()):
+            if not isinstance(spec, dict):
+                self.spec_errors.append('Constraints of column <%s> are not a map' % (column))
+                continue
+            names = sorted(name for name, argument in spec.items() if argument is not False)
+            for name in names:
+                if name not in CONSTRAINTS:
+                    self.spec_errors.append('Unknown constraint %s for column <%s>' % (name, column))
+                    continue
+                if name == 'max' and 'min' in names:
+                    continue
+                try:
+                    argument = spec if CONSTRAINTS[name] is Range else spec[name]
+                    self.checks.append(CONSTRAINTS[name](str(column), argument))
+                except (re.error, TypeError, ValueError) as e:
+                    self.spec_errors.append('Invalid %s for column <%s>: %s' % (name, column, e))
+        self.counts = [0] * len(self.checks)
+        self.samples = [[] for _ in self.checks]
+        self.missing = None
+
+    @property
+    def sharding(self):
+        # repeats of a unique column can be in any two shards
+        if any(isinstance(check, Unique) for check in self.checks):
+            return None
+        return 'merge'
+
+    def config(self):
+        return {'constraints': self.constraints, 'severity': self.severity,
+                'max_rows': self.max_rows}
+
+    def process_frame(self, frame, first_row):
+        columns = dict((str(name), name) for name in frame.columns)
+        if self.missing is None:
+            self.missing = sorted(set(check.column for check in self.checks) - set(columns))
+
+        for i, check in enumerate(self.checks):
+            if check.column not in columns:
+                continue
+            values = frame[columns[check.column]]
+            rows = np.flatnonzero(check.violations(values))
+            if not len(rows):
+                continue
+
+            reported = max(min(self.max_rows - self.counts[i], len(rows)), 0)
+            self.counts[i] += len(rows)
+            for row in rows[:reported]:
+                value = values.iloc[row]
+                message = 'Row %d: column <%s> %s, got %s' % (
+                    first_row + row + 1, check.column, check.describe(),
+                    'an empty field' if pd.isna(value) else '<%s>' % (str(value)[:100]))
+                if self.shard is None:
+                    self.report(self.severity, message)
+                else:
+                    # the first max_rows of the whole file are picked at the merge
+                    self.samples[i].append(message)
+
+    def shard_state(self):
+        return {'counts': self.counts, 'samples': self.samples, 'missing': self.missing}
+
+    def merge_shards(self, states):
+        for state in states:
+            for i, (count, samples) in enumerate(zip(state['counts'], state['samples'])):
+                for message in samples[:max(self.max_rows - self.counts[i], 0)]:
+                    self.report(self.severity, message)
+                self.counts[i] += count
+            if self.missing is None:
+                self.missing = state['missing']
+
+    def finish(self):
+        error_messages = [['error', message] for message in self.spec_errors]
+        for column in self.missing or []:
+            error_messages.append(['error', 'Column <%s> of the constraints is not in the file' % (column)])
+        for check, count in zip(self.checks, self.counts):
+            if count:
+                error_messages.append([self.severity, 'Column <%s> %s, found %d violations' % (
+                    check.column, check.describe(), count)])
+
+        has_error = bool(self.spec_errors or self.missing) or (
+            self.severity == 'error' and any(self.counts))
+        return has_error, error_messages
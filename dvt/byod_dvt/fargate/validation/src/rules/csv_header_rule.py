@@ -1,39 +1,53 @@
-import boto3
-import pandas as pd
-import os
 import io
 import re
 import csv
+from common import csv_reader_args
 from rules.validation_rule import ValidationRule
 
 
 class CsvHeaderRule(ValidationRule):
-    def validate(self, obj):
-        error_messages = []
+    # the header is on the first shard
+    sharding = 'local'
+
+    def __init__(self, sample_size=64 * 1024):
+        self.sample_size = sample_size
+        self.sample = b''
 
-        # Read a portion of the object body
-        sample_size = 1024
+    def config(self):
+        return {'sample_size': self.sample_size}
 
-        df = pd.read_csv(io.BytesIO(
-            obj['Body'].read(sample_size)), encoding='utf8')
+    @property
+    def wants_more(self):
+        # only the first row is needed
+        if self.shard is not None and self.shard['index'] > 0:
+            return False
+        return b'\n' not in self.sample and len(self.sample) < self.sample_size
 
-        df.to_csv("test.csv", index=False)
+    def process_chunk(self, chunk):
+        # Keep only a portion of the object body
+        self.sample += chunk[:self.sample_size - len(self.sample)]
 
-        has_header = None
+    def finish(self):
+        error_messages = []
+        if self.shard is not None and self.shard['index'] > 0:
+            return False, error_messages
 
-        with open('test.csv', 'r') as csvfile:
-            sniffer = csv.Sniffer()
-            has_header = sniffer.has_header(csvfile.read())
+        if self.dialect is None:
+            return True, [['error', 'Could not detect the CSV dialect (delimiter and quote character)']]
 
+        has_header = self.dialect['has_header']
         if not has_header:
             error_messages.append(['error', 'File has no headers'])
 
         # Validate column names
+        text = self.sample.decode('utf8', 'replace').lstrip('\ufeff')
+        columns = next(csv.reader(io.StringIO(text), **csv_reader_args(self.dialect)), [])
+
         pattern = re.compile('^[0-9]|[@_!#$%^&*()<>?/|}{~: ]')
         col_status = []
         col_name = []
 
-        for col in df.columns:
+        for col in columns:
             col_name.append(col)
             if(pattern.search(col) == None):
                 col_status.append(True)
@@ -41,10 +55,10 @@ class CsvHeaderRule(ValidationRule):
                 col_status.append(False)
 
         has_valid_col_name = True if sum(
-            bool(stat) for stat in col_status) == len(df.columns) else False
+            bool(stat) for stat in col_status) == len(columns) else False
 
         for name, status in zip(col_name, col_status):
-            error_messages.append(["error",
+            error_messages.append(["info" if status == True else "error",
                                    "Column name <{}>".format(name) + (
                                        " is valid" if status == True else " is not valid")])
 
@@ -0,0 +1,38 @@
+import os
+import clevercsv
+
+# Bytes from the start of the file used to detect its dialect
+DIALECT_SAMPLE_SIZE = int(os.environ.get('DIALECT_SAMPLE_SIZE', str(64 * 1024)))
+
+
+def detect_dialect(sample, complete=False):
+    '''Detects the delimiter, quote and escape characters and whether the
+    first row is a header from the first bytes of a file, in memory.
+
+    complete tells whether the sample is the whole file, otherwise the row
+    cut off at its end is dropped. Returns None when no dialect fits.
+    '''
+    if not complete:
+        end = sample.rfind(b'\n')
+        if end > 0:
+            sample = sample[:end + 1]
+
+    text = sample.decode('utf8', 'replace').lstrip('\ufeff')
+    if not text.strip():
+        return None
+
+    sniffer = clevercsv.Sniffer()
+    try:
+        dialect = sniffer.detect(text)
+        if dialect is None:
+            return None
+        has_header = sniffer.has_header(text)
+    except clevercsv.Error:
+        return None
+
+    return {
+        'delimiter': dialect.delimiter,
+        'quotechar': dialect.quotechar,
+        'escapechar': dialect.escapechar,
+        'has_header': bool(has_header)
+    }
@@ -0,0 +1,173 @@
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+from rules.validation_rule import ValidationRule
+
+# Bytes of row hashes kept in memory before they are spilled to disk
+DUPLICATE_MEMORY_MB = int(os.environ.get('DUPLICATE_MEMORY_MB', '256'))
+
+# Local directory for the spilled hashes, the system default when unset
+DUPLICATE_SPILL_DIR = os.environ.get('DUPLICATE_SPILL_DIR') or None
+
+# A row is its 64 bit hash and its row number
+RECORD = np.dtype([('hash', '<u8'), ('row', '<i8')])
+
+# Spilled hashes are split by their top bits, one file per partition
+PARTITION_BITS = 8
+
+
+def _first_of_groups(hashes, rows):
+    '''For sorted hashes, marks the repeats and gives each row the row
+    number of the first of its group'''
+    repeated = np.zeros(len(hashes), dtype=bool)
+    repeated[1:] = hashes[1:] == hashes[:-1]
+    starts = np.flatnonzero(~repeated)
+    earlier = rows[starts][np.cumsum(~repeated) - 1]
+    return repeated, earlier
+
+
+class DuplicateRowRule(ValidationRule):
+    '''Counts rows that repeat an earlier row, whole or on key columns.
+
+    Every row is reduced to a 64 bit hash kept with its row number in
+    sorted runs, 16 bytes per distinct row. Past memory_mb the runs are
+    written to partition files on local disk and memory starts over,
+    finish() then reads the partitions back one at a time to find the
+    repeats across spills, so memory stays within memory_mb plus one
+    partition whatever the size of the file. The first max_samples
+    repeats are reported with the row they repeat.
+    '''
+
+    uses_bytes = False
+    uses_frames = True
+
+    MAX_RUNS = 8
+
+    def __init__(self, columns=None, severity='warning', max_samples=20,
+                 memory_mb=DUPLICATE_MEMORY_MB, spill_dir=DUPLICATE_SPILL_DIR):
+        self.columns = [str(column) for column in columns or []]
+        self.severity = severity
+        self.max_samples = max_samples
+        self.memory_bytes = memory_mb * 1024 * 1024
+        self.spill_dir = spill_dir
+        self.runs = []
+        self.size = 0
+        self.duplicates = 0
+        self.samples = 0
+        self.missing = None
+        self.directory = None
+        self.spills = 0
+
+    def config(self):
+        return {'columns': self.columns, 'severity': self.severity,
+                'max_samples': self.max_samples}
+
+    def process_frame(self, frame, first_row):
+        if self.missing is None:
+            names = set(str(name) for name in frame.columns)
+            self.missing = [column for column in self.columns if column not in names]
+        if self.missing or not len(frame):
+            return
+        if self.columns:
+            frame = frame[[name for name in frame.columns if str(name) in self.columns]]
+
+        # most rows are distinct, factorizing them first only costs time
+        hashes = pd.util.hash_pandas_object(frame, index=False, categorize=False).values
+        rows = np.arange(first_row + 1, first_row + len(frame) + 1, dtype='int64')
+
+        order = np.argsort(hashes, kind='stable')
+        hashes = hashes[order]
+        rows = rows[order]
+        repeated, earlier = _first_of_groups(hashes, rows)
+
+        # a hash is in one run at most, with the row it was first seen in
+        found_in_run = np.zeros(len(hashes), dtype=bool)
+        for run_hashes, run_rows in self.runs:
+            found = np.searchsorted(run_hashes, hashes).clip(max=len(run_hashes) - 1)
+            hit = run_hashes[found] == hashes
+            earlier[hit] = run_rows[found[hit]]
+            found_in_run |= hit
+
+        duplicate = repeated | found_in_run
+        self.duplicates += int(duplicate.sum())
+        self._sample(rows[duplicate], earlier[duplicate])
+
+        if not duplicate.all():
+            self._add_run(hashes[~duplicate], rows[~duplicate])
+        if self.size * RECORD.itemsize > self.memory_bytes:
+            self._spill()
+
+    def finish(self):
+        error_messages = []
+        for column in self.missing or []:
+            error_messages.append(['error', 'Key column <%s> is not in the file' % (column)])
+
+        try:
+            if self.spills:
+                self._spill()
+                for path in sorted(os.listdir(self.directory)):
+                    records = np.fromfile(os.path.join(self.directory, path), dtype=RECORD)
+                    # each spill only holds rows new to it, repeats are across spills
+                    records = records[np.lexsort((records['row'], records['hash']))]
+                    repeated, earlier = _first_of_groups(records['hash'], records['row'])
+                    self.duplicates += int(repeated.sum())
+                    error_messages.extend(
+                        self._sample(records['row'][repeated], earlier[repeated], report=False))
+        finally:
+            if self.directory is not None:
+                shutil.rmtree(self.directory, ignore_errors=True)
+            self.runs = []
+
+        if self.duplicates:
+            error_messages.append([self.severity, 'Found %d duplicate rows%s' % (
+                self.duplicates, ' on %s' % (', '.join(self.columns)) if self.columns else '')])
+        has_error = bool(self.missing) or (self.severity == 'error' and self.duplicates > 0)
+        return has_error, error_messages
+
+    def _sample(self, rows, earlier, report=True):
+        count = max(min(self.max_samples - self.samples, len(rows)), 0)
+        if not count:
+            return []
+        order = np.argsort(rows, kind='stable')[:count]
+        self.samples += count
+        messages = []
+        for row, first in zip(rows[order], earlier[order]):
+            message = 'Row %d duplicates row %d' % (row, first)
+            if report:
+                self.report(self.severity, message)
+            else:
+                messages.append([self.severity, message])
+        return messages
+
+    def _add_run(self, hashes, rows):
+        self.runs.append((hashes, rows))
+        self.size += len(hashes)
+        while len(self.runs) > 1 and (len(self.runs[-1][0]) >= len(self.runs[-2][0]) or
+                                      len(self.runs) > self.MAX_RUNS):
+            hashes, rows = self.runs.pop()
+            older_hashes, older_rows = self.runs[-1]
+            hashes = np.concatenate([older_hashes, hashes])
+            rows = np.concatenate([older_rows, rows])
+            order = np.argsort(hashes, kind='stable')
+            self.runs[-1] = (hashes[order], rows[order])
+
+    def _spill(self):
+        '''Appends the runs to the partition files and empties memory'''
+        if self.directory is None:
+            self.directory = tempfile.mkdtemp(prefix='duplicates-', dir=self.spill_dir)
+        for hashes, rows in self.runs:
+            records = np.empty(len(hashes), dtype=RECORD)
+            records['hash'] = hashes
+            records['row'] = rows
+
+            # runs are sorted, so each partition is one slice
+            partitions = (records['hash'] >> np.uint64(64 - PARTITION_BITS)).astype('int64')
+            bounds = np.searchsorted(partitions, np.arange((1 << PARTITION_BITS) + 1))
+            for partition in np.flatnonzero(np.diff(bounds)):
+                with open(os.path.join(self.directory, '%03d' % (partition)), 'ab') as f:
+                    records[bounds[partition]:bounds[partition + 1]].tofile(f)
+        self.runs = []
+        self.size = 0
+        self.spills += 1
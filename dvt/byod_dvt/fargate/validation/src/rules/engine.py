@@ -0,0 +1,342 @@
+import os
+import re
+import sys
+import json
+import time
+import queue
+import hashlib
+import threading
+import tracemalloc
+import pandas as pd
+from common import source_fingerprint
+from common import read_csv_args
+from common import DecompressionError
+from rules.validation_rule import DEFAULT_CHUNK_SIZE
+from rules.dialect import DIALECT_SAMPLE_SIZE
+from rules.dialect import detect_dialect
+from rules.report import ErrorCollector
+
+# Rows per parsed frame handed to the rules that use frames
+FRAME_ROWS = 100000
+
+# Chunks or frames queued per rule when rules run in parallel
+QUEUE_SIZE = 4
+
+# Run every rule on its own thread, or all of them in turn on this one
+PARALLEL_RULES = os.environ.get('PARALLEL_RULES', '1') == '1'
+
+# Measure each rule's peak memory with tracemalloc, runs rules in turn
+RULE_MEMORY_PROFILING = os.environ.get('RULE_MEMORY_PROFILING', '0') == '1'
+
+
+class RuleStats:
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.retained_bytes = 0
+        self.peak_bytes = None
+
+    def to_dict(self):
+        stats = {
+            'calls': self.calls,
+            'ms': int(self.seconds * 1000),
+            'cpu_ms': int(self.cpu_seconds * 1000)
+        }
+        if self.peak_bytes is not None:
+            stats['peak_bytes'] = self.peak_bytes
+        return stats
+
+
+class _RuleLane:
+    '''Runs the calls to one rule, on its own thread or inline'''
+
+    def __init__(self, rule, threaded, trace_memory):
+        self.rule = rule
+        self.stats = RuleStats(type(rule).__name__)
+        self.trace_memory = trace_memory
+        self.error = None
+        self.thread = None
+        if threaded:
+            self.queue = queue.Queue(QUEUE_SIZE)
+            self.thread = threading.Thread(target=self._work, daemon=True)
+            self.thread.start()
+
+    @property
+    def wants_more(self):
+        return self.error is None and self.rule.wants_more
+
+    def send(self, method, *args):
+        if not self.wants_more:
+            return
+        if self.thread is not None:
+            self.queue.put((method, args))
+        else:
+            self._call(method, args)
+
+    def finish(self, method='finish'):
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+
+        result = self._call(method, ())
+        if self.error is not None:
+            return True, [['error', 'Rule %s failed: %s' % (self.stats.name, self.error)]]
+        return result
+
+    def _work(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            if self.error is None:
+                self._call(*item)
+
+    def _call(self, method, args):
+        if self.error is not None:
+            return None
+
+        if self.trace_memory:
+            tracemalloc.start()
+        started = time.perf_counter()
+        cpu_started = time.thread_time()
+        try:
+            return getattr(self.rule, method)(*args)
+        except Exception as e:
+            self.error = e
+        finally:
+            stats = self.stats
+            stats.calls += 1
+            stats.seconds += time.perf_counter() - started
+            stats.cpu_seconds += time.thread_time() - cpu_started
+            if self.trace_memory:
+                # peak of this call on top of what earlier calls kept
+                current, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                stats.peak_bytes = max(stats.peak_bytes or 0, stats.retained_bytes + peak)
+                stats.retained_bytes += current
+
+
+class _TeeReader:
+    '''File object over the S3 body that hands every chunk read to the byte
+    rules. A compressed body that turns out to be broken ends where it
+    breaks, with the error kept for the report.'''
+
+    def __init__(self, body, lanes):
+        self.body = body
+        self.lanes = lanes
+        self.head = b''
+        self.error = None
+        self.bytes_read = 0
+        self.seconds = 0.0
+
+    def peek(self, size):
+        '''Read ahead up to size bytes without handing them to the rules yet'''
+        started = time.perf_counter()
+        while len(self.head) < size:
+            chunk = self._read_body(size - len(self.head))
+            if not chunk:
+                break
+            self.head += chunk
+        self.seconds += time.perf_counter() - started
+        return self.head
+
+    def read(self, size=-1):
+        started = time.perf_counter()
+        if not self.head:
+            chunk = self._read_body(size)
+        elif size is None or size < 0:
+            chunk = self.head + self._read_body()
+            self.head = b''
+        else:
+            chunk, self.head = self.head[:size], self.head[size:]
+        self.seconds += time.perf_counter() - started
+        self.bytes_read += len(chunk)
+        for lane in self.lanes:
+            lane.send('process_chunk', chunk)
+        return chunk
+
+    def _read_body(self, size=-1):
+        if self.error is not None:
+            return b''
+        try:
+            return self.body.read(size)
+        except DecompressionError as e:
+            self.error = e
+            return b''
+
+
+class ValidationEngine:
+    '''Reads the S3 object body once and feeds it to all rules.
+
+    Rules that use bytes get every chunk of the body, rules that use frames
+    get the rows parsed by a single pd.read_csv over the same stream. The
+    dialect is detected from the first bytes before any rule starts, it is
+    given to the rules and used for the parse unless read_csv_args is. Each
+    rule runs on its own thread with a small bounded queue, so a slow rule
+    does not hold up the others beyond the queue size, and a rule that
+    raises is reported as an error without stopping the other rules.
+    Messages go to reporter as each rule finishes, or as soon as the rule
+    reports them; by default they are all kept in memory.
+
+    A known dialect skips the detection. With shard, the body is that part
+    of the file: rows are numbered from the shard's first_row and the
+    rules that merge their shards leave their state in shard_states
+    instead of finishing, see merge_shards().
+    '''
+
+    def __init__(self, rules, chunk_size=DEFAULT_CHUNK_SIZE, frame_rows=FRAME_ROWS,
+                 parallel=PARALLEL_RULES, trace_memory=RULE_MEMORY_PROFILING,
+                 read_csv_args=None, dialect_sample_size=DIALECT_SAMPLE_SIZE, reporter=None,
+                 dialect=None, shard=None):
+        self.rules = list(rules)
+        self.reporter = reporter or ErrorCollector()
+        self.chunk_size = chunk_size
+        self.frame_rows = frame_rows
+        self.trace_memory = trace_memory
+        self.parallel = parallel and not trace_memory
+        self.read_csv_args = read_csv_args
+        self.dialect_sample_size = dialect_sample_size
+        self.detect = dialect is None
+        self.dialect = dialect
+        self.shard = shard
+        self.shard_states = {}
+        self.bytes_read = 0
+        self.rows = 0
+        self.parsed = False
+        self.metrics = {}
+
+    def fingerprint(self):
+        '''Changes whenever the rule set, a rule's settings or its code do'''
+        rules = [[type(rule).__module__, type(rule).__name__, rule.config()]
+                 for rule in self.rules]
+        rules.append([self.dialect_sample_size, self.read_csv_args])
+
+        # the rules package and any rule defined outside of it
+        modules = set(name for name in sys.modules
+                      if name == 'rules' or name.startswith('rules.'))
+        modules.update(type(rule).__module__ for rule in self.rules)
+        rules.append(source_fingerprint(
+            *[sys.modules[name] for name in sorted(modules)]))
+        return hashlib.sha256(json.dumps(rules, sort_keys=True).encode('utf8')).hexdigest()
+
+    def run(self, obj):
+        started = time.perf_counter()
+        lanes = [_RuleLane(rule, self.parallel, self.trace_memory) for rule in self.rules]
+        byte_lanes = [lane for lane in lanes if lane.rule.uses_bytes]
+        frame_lanes = [lane for lane in lanes if lane.rule.uses_frames]
+        reader = _TeeReader(obj['Body'], byte_lanes)
+
+        # detect the dialect in memory before the rules see any bytes
+        detect_seconds = 0.0
+        if self.detect:
+            head = reader.peek(self.dialect_sample_size)
+            detect_started = time.perf_counter()
+            self.dialect = detect_dialect(head, complete=len(head) < self.dialect_sample_size)
+            detect_seconds = time.perf_counter() - detect_started
+        for lane in lanes:
+            lane.rule.dialect = self.dialect
+            lane.rule.shard = self.shard
+            lane.rule.reporter = self.reporter
+            lane.send('start', obj)
+
+        parse_error = None
+        parse_seconds = 0.0
+        if frame_lanes:
+            parse_error, parse_seconds = self._parse(reader, frame_lanes)
+
+        # the byte rules may still need the rest of the file
+        while any(lane.wants_more for lane in byte_lanes):
+            if not reader.read(self.chunk_size):
+                break
+
+        # stop the download early if every rule is done before EOF
+        obj['Body'].close()
+        self.bytes_read = reader.bytes_read
+
+        has_error = False
+        if reader.error is not None:
+            # whatever the rules made of the part before it, the file is broken
+            has_error = True
+            self.parsed = False
+            self.reporter.add(type(self).__name__, 'error',
+                              'File could not be decompressed: %s' % (reader.error))
+        elif parse_error is not None:
+            has_error = True
+            self.reporter.add(type(self).__name__, 'error',
+                              'CSV could not be parsed: %s' % (parse_error))
+        for lane in lanes:
+            if self.shard is not None and lane.rule.sharding == 'merge':
+                state = lane.finish('shard_state')
+                if lane.error is None:
+                    self.shard_states[lane.stats.name] = state
+                    continue
+                rule_err, rule_messages = state
+            else:
+                rule_err, rule_messages = lane.finish()
+            has_error = has_error or rule_err
+            for kind, message in rule_messages:
+                self.reporter.add(lane.stats.name, kind, message)
+
+        self.metrics = dict((lane.stats.name, lane.stats.to_dict()) for lane in lanes)
+        self.metrics['read'] = {'ms': int(reader.seconds * 1000), 'bytes': reader.bytes_read}
+        self.metrics['dialect'] = {'ms': int(detect_seconds * 1000)}
+        if frame_lanes:
+            self.metrics['parse'] = {'ms': int(parse_seconds * 1000), 'rows': self.rows}
+        self.metrics['total'] = {'ms': int((time.perf_counter() - started) * 1000)}
+        return has_error, self.reporter.messages
+
+    def merge_shards(self, shard_states):
+        '''Finishes the rules that merge their shards from the shard_states
+        of every shard, in order, returns whether they found an error'''
+        has_error = False
+        for rule in self.rules:
+            if rule.sharding != 'merge':
+                continue
+            name = type(rule).__name__
+            rule.dialect = self.dialect
+            rule.reporter = self.reporter
+            try:
+                rule.merge_shards([states[name] for states in shard_states])
+                rule_err, rule_messages = rule.finish()
+            except Exception as e:
+                rule_err, rule_messages = True, [['error', 'Rule %s failed: %s' % (name, e)]]
+            has_error = has_error or rule_err
+            for kind, message in rule_messages:
+                self.reporter.add(name, kind, message)
+        return has_error
+
+    def _parse(self, reader, lanes):
+        '''Parse the stream once and send every frame to the frame rules'''
+        started = time.perf_counter()
+        read_seconds = reader.seconds
+        parse_error = None
+        args = self.read_csv_args or read_csv_args(self.dialect)
+        try:
+            # keep the raw strings, only empty fields become NaN
+            frames = pd.read_csv(reader, chunksize=self.frame_rows, dtype=str,
+                                 keep_default_na=False, na_values=[''],
+                                 encoding='utf8', **args)
+            first_row = self.shard['first_row'] if self.shard is not None else 0
+            for frame in frames:
+                for lane in lanes:
+                    lane.send('process_frame', frame, first_row + self.rows)
+                self.rows += len(frame)
+                if not any(lane.wants_more for lane in lanes):
+                    break
+            else:
+                # every row reached the frame rules
+                self.parsed = True
+        except UnicodeDecodeError:
+            # reported in detail by the encoding rule
+            pass
+        except (ValueError, pd.errors.ParserError) as e:
+            parse_error = str(e).strip()
+            if self.shard is not None:
+                # the parser counts the lines of the shard
+                parse_error = re.sub(r'line (\d+)', lambda match: 'line %d' % (
+                    int(match.group(1)) + self.shard['first_line']), parse_error)
+
+        seconds = time.perf_counter() - started - (reader.seconds - read_seconds)
+        return parse_error, seconds
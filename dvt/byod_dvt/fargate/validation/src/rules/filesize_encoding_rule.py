@@ -1,38 +1,84 @@
-import boto3
-import pandas as pd
-import os
-import io
-import re
 from rules.validation_rule import ValidationRule
+from rules.utf8_validator import Utf8Validator
+
+# Encoding guesses less sure than this are left out of the report
+MIN_GUESS_CONFIDENCE = 0.5
 
 
 class FileSizeEncodingRule(ValidationRule):
-    def validate(self, obj):
+    sharding = 'local'
+
+    # 3 GiB, for the file as stored and once decompressed
+    max_file_size = 3 * 1024 * 1024 * 1024
+
+    def __init__(self, max_encoding_errors=10):
+        self.file_size = 0
+        self.compression = None
+        self.uncompressed_size = 0
+        self.validator = Utf8Validator(max_errors=max_encoding_errors)
+
+    def config(self):
+        return {'max_encoding_errors': self.validator.max_errors}
+
+    @property
+    def wants_more(self):
+        # the decompressed size is only known once all of it was read
+        return not self.validator.done or (
+            self.compression is not None and self.uncompressed_size <= self.max_file_size)
+
+    def start(self, obj):
+        self.file_size = obj['ContentLength']
+        self.compression = obj.get('Compression')
+        if self.shard is not None:
+            # positions of errors count from the start of the file
+            self.validator.offset = self.validator.line_start = self.shard['offset']
+            self.validator.lines = self.shard['first_line']
+
+    def process_chunk(self, chunk):
+        self.uncompressed_size += len(chunk)
+        self.validator.feed(chunk)
+
+    def finish(self):
         error_messages = []
 
         '''Validate File Size'''
-        file_size_unit = 1024 * 1024 * 1024
-        file_size_limit = 3 * file_size_unit  # 3 GiB file size limit
-        file_size = obj['ContentLength']
+        file_size_limit = self.max_file_size
+        file_size = self.file_size
 
-        is_within_filesize = (file_size <= file_size_limit)
+        # the size is the whole file's, checked on the first shard only
+        is_within_filesize = (file_size <= file_size_limit or
+                              (self.shard is not None and self.shard['index'] > 0))
         if not is_within_filesize:
             error_messages.append(["error", "Exceeds maximum file size of " +
                                    "{:.2f}".format(file_size_limit/1024/1024) + " Megabytes, your file size is " +
                                    "{:.2f}".format(file_size/1024/1024) + " Megabytes"])
+        if self.compression is not None and self.uncompressed_size > file_size_limit:
+            is_within_filesize = False
+            error_messages.append(["error", "Exceeds maximum uncompressed file size of " +
+                                   "{:.2f}".format(file_size_limit/1024/1024) + " Megabytes, your %s file " % (self.compression) +
+                                   "decompresses to more than " + "{:.2f}".format(file_size_limit/1024/1024) + " Megabytes"])
 
         '''Validate utf-8 encoding'''
-        pattern = re.compile('utf-8')
-        try:
-            df = pd.read_csv(io.BytesIO(obj['Body'].read()), encoding='utf8')
-            is_UTF8 = True
-        except ValueError as e:
-            error_message = str(e)
-            if (pattern.search(error_message) == None):
-                is_UTF8 = False
-                error_messages.append(['error', error_message])
-            else:
-                is_UTF8 = False
-                error_messages.append(['error', "UTF-8 encoding error"])
+        validator = self.validator
+        validator.close()
+
+        if validator.bom == 'UTF-8':
+            error_messages.append(['warning', "File starts with a UTF-8 byte order mark"])
+
+        is_UTF8 = validator.is_valid and validator.bom in (None, 'UTF-8')
+        if not is_UTF8:
+            if validator.bom not in (None, 'UTF-8'):
+                error_messages.append(['error', "File has a %s byte order mark, expected UTF-8" % (validator.bom)])
+
+            for error in validator.errors:
+                error_messages.append(['error', "UTF-8 encoding error: invalid byte sequence 0x%s at byte offset %d (line %d, column %d)" % (
+                    error['bytes'].hex(), error['offset'], error['line'], error['column'])])
+            if validator.done:
+                error_messages.append(['warning', "Stopped after the first %d encoding errors" % (validator.max_errors)])
+
+            encoding, confidence = validator.guess_encoding()
+            if encoding is not None and confidence >= MIN_GUESS_CONFIDENCE:
+                error_messages.append(['warning', "File looks like it is encoded as %s (%d%% confidence)" % (
+                    encoding, round(confidence * 100))])
 
         return (not is_within_filesize or not is_UTF8), error_messages
@@ -0,0 +1,47 @@
+import pyarrow as pa
+import pyarrow.parquet as pq
+from rules.validation_rule import ValidationRule
+
+
+class IntermediateWriter(ValidationRule):
+    '''Writes the frames parsed by the engine to a local Parquet file.
+
+    The columns keep the raw strings of the CSV, one row group per frame,
+    so that later stages read them back without parsing the CSV again.
+    Never reports anything itself.
+    '''
+
+    uses_bytes = False
+    uses_frames = True
+
+    # one file per shard, read back in order
+    sharding = 'local'
+
+    # added by the worker when the job is converted or profiled
+    registrable = False
+
+    def __init__(self, filename, compression='snappy'):
+        self.filename = filename
+        self.compression = compression
+        self.schema = None
+        self.writer = None
+        self.rows = 0
+
+    def config(self):
+        return {'compression': self.compression}
+
+    def process_frame(self, frame, first_row):
+        frame = frame.rename(columns=str)
+        if self.writer is None:
+            self.schema = pa.schema([(name, pa.string()) for name in frame.columns])
+            self.writer = pq.ParquetWriter(
+                self.filename, self.schema, compression=self.compression)
+
+        self.writer.write_table(pa.Table.from_pandas(
+            frame, schema=self.schema, preserve_index=False))
+        self.rows += len(frame)
+
+    def finish(self):
+        if self.writer is not None:
+            self.writer.close()
+        return False, []
@@ -0,0 +1,113 @@
+import os
+import decimal
+import importlib
+from rules.validation_rule import ValidationRule
+
+# Entry point group other packages can use to ship their own rules
+ENTRY_POINT_GROUP = 'byod_dvt.validation_rules'
+
+# Rules run on every job unless the job says otherwise
+DEFAULT_RULES = ['CsvHeaderRule', 'FileSizeEncodingRule', 'TypeConsistencyRule']
+
+
+def _entry_points():
+    try:
+        from importlib import metadata
+    except ImportError:
+        return []
+    entry_points = metadata.entry_points()
+    if hasattr(entry_points, 'select'):
+        return entry_points.select(group=ENTRY_POINT_GROUP)
+    return entry_points.get(ENTRY_POINT_GROUP, [])
+
+
+def _plain(value):
+    '''DynamoDB numbers come back as Decimal, rules expect int or float'''
+    if isinstance(value, decimal.Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, dict):
+        return dict((key, _plain(item)) for key, item in value.items())
+    if isinstance(value, (list, set)):
+        return [_plain(item) for item in value]
+    return value
+
+
+def _subclasses(cls):
+    for subclass in cls.__subclasses__():
+        yield subclass
+        for nested in _subclasses(subclass):
+            yield nested
+
+
+class RuleRegistry:
+    '''Known ValidationRule classes by name and the ones enabled by default.
+
+    Rules are found among the subclasses of ValidationRule that have been
+    imported, in the byod_dvt.validation_rules entry point group, or loaded
+    from a "module:Class" spec. The enabled list comes from the
+    VALIDATION_RULES environment variable (comma separated names or specs)
+    and falls back to DEFAULT_RULES. Only that list loads specs, jobs pick
+    among the rules known by then.
+    '''
+
+    def __init__(self, enabled=None):
+        self.rules = {}
+        for cls in _subclasses(ValidationRule):
+            if not getattr(cls, '__abstractmethods__', None) and cls.registrable:
+                self.register(cls)
+        for entry_point in _entry_points():
+            self.register(entry_point.load(), entry_point.name)
+
+        if enabled is None:
+            enabled = [name.strip() for name in
+                       os.environ.get('VALIDATION_RULES', '').split(',') if name.strip()]
+        self.enabled = [self._resolve(name) for name in (enabled or DEFAULT_RULES)]
+
+    def register(self, cls, name=None):
+        if not issubclass(cls, ValidationRule):
+            raise TypeError('%s is not a ValidationRule' % (cls))
+        self.rules[name or cls.__name__] = cls
+        return cls
+
+    def create(self, job=None):
+        '''Instantiate the rules for a job.
+
+        The job item can add rules with enabled_rules, drop rules with
+        disabled_rules and pass keyword arguments to a rule with
+        rule_options, a map of rule name to arguments. A job with
+        constraints, a map of column name to checks, runs ConstraintRule
+        with them.
+        '''
+        job = job or {}
+        names = list(self.enabled)
+        for name in job.get('enabled_rules') or []:
+            name = self._known(name)
+            if name not in names:
+                names.append(name)
+        disabled = [self._known(name) for name in job.get('disabled_rules') or []]
+        options = _plain(job.get('rule_options') or {})
+        if job.get('constraints'):
+            if 'ConstraintRule' not in names:
+                names.append('ConstraintRule')
+            options.setdefault('ConstraintRule', {})['constraints'] = _plain(job['constraints'])
+
+        return [self.rules[name](**options.get(name, {}))
+                for name in names if name not in disabled]
+
+    def _known(self, name):
+        # jobs come from users, they never get code imported
+        if name not in self.rules:
+            raise KeyError('Unknown validation rule %s' % (name))
+        return name
+
+    def _resolve(self, name):
+        if name in self.rules:
+            return name
+        if ':' not in name:
+            raise KeyError('Unknown validation rule %s' % (name))
+
+        # a "module:Class" spec for a rule outside the rules package
+        module_name, class_name = name.split(':', 1)
+        cls = getattr(importlib.import_module(module_name), class_name)
+        self.register(cls, name)
+        return name
@@ -0,0 +1,61 @@
+import threading
+
+
+class ErrorCollector:
+    '''Counts every message the rules report and keeps the first
+    max_per_rule of each rule.
+
+    counts holds the exact number of messages of each type per rule and
+    totals the same over all rules, whatever the cap. Rules running on
+    their own threads may add at the same time.
+    '''
+
+    def __init__(self, max_per_rule=None):
+        self.max_per_rule = max_per_rule
+        self.counts = {}
+        self.totals = {}
+        self.stored = {}
+        self.messages = []
+        self.lock = threading.Lock()
+
+    def add(self, rule, kind, message):
+        with self.lock:
+            counts = self.counts.setdefault(rule, {})
+            counts[kind] = counts.get(kind, 0) + 1
+            self.totals[kind] = self.totals.get(kind, 0) + 1
+
+            stored = self.stored.get(rule, 0)
+            if self.max_per_rule is not None and stored >= self.max_per_rule:
+                return
+            self.stored[rule] = stored + 1
+            self._store(rule, kind, message)
+
+    def merge(self, counts, messages):
+        '''Adds what another collector found, e.g. on a shard of the file:
+        its counts by rule and type and the [rule, type, message] it kept'''
+        kept = {}
+        for rule, kind, message in messages:
+            self.add(rule, kind, message)
+            kept[(rule, kind)] = kept.get((rule, kind), 0) + 1
+
+        # the messages over the other collector's caps are only counted
+        with self.lock:
+            for rule, kinds in counts.items():
+                for kind, count in kinds.items():
+                    extra = int(count) - kept.get((rule, kind), 0)
+                    if extra > 0:
+                        rule_counts = self.counts.setdefault(rule, {})
+                        rule_counts[kind] = rule_counts.get(kind, 0) + extra
+                        self.totals[kind] = self.totals.get(kind, 0) + extra
+
+    def dropped(self):
+        '''Number of messages over the cap, by rule'''
+        dropped = {}
+        for rule, counts in self.counts.items():
+            count = sum(counts.values()) - self.stored.get(rule, 0)
+            if count > 0:
+                dropped[rule] = count
+        return dropped
+
+    def _store(self, rule, kind, message):
+        self.messages.append([kind, message])
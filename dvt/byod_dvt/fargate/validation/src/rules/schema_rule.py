@@ -0,0 +1,62 @@
+import io
+import csv
+from common import csv_reader_args
+from rules.validation_rule import ValidationRule
+
+
+class SchemaRule(ValidationRule):
+    '''Checks that the file has the columns of the other files of its
+    batch, by name and in order, or only their number without a header'''
+
+    # the header is on the first shard
+    sharding = 'local'
+
+    # added by batch jobs with the columns of the batch
+    registrable = False
+
+    def __init__(self, columns, sample_size=64 * 1024):
+        self.columns = list(columns)
+        self.sample_size = sample_size
+        self.sample = b''
+
+    def config(self):
+        return {'columns': self.columns, 'sample_size': self.sample_size}
+
+    @property
+    def wants_more(self):
+        if self.shard is not None and self.shard['index'] > 0:
+            return False
+        return b'\n' not in self.sample and len(self.sample) < self.sample_size
+
+    def process_chunk(self, chunk):
+        self.sample += chunk[:self.sample_size - len(self.sample)]
+
+    def finish(self):
+        if self.shard is not None and self.shard['index'] > 0:
+            return False, []
+        if self.dialect is None:
+            # reported by CsvHeaderRule
+            return False, []
+
+        text = self.sample.decode('utf8', 'replace').lstrip('\ufeff')
+        columns = next(csv.reader(io.StringIO(text), **csv_reader_args(self.dialect)), [])
+
+        if not self.dialect['has_header']:
+            if len(columns) == len(self.columns):
+                return False, []
+            return True, [['error', 'File has %d columns, the other files of the batch have %d' % (
+                len(columns), len(self.columns))]]
+
+        if columns == self.columns:
+            return False, []
+        error_messages = []
+        missing = [name for name in self.columns if name not in columns]
+        extra = [name for name in columns if name not in self.columns]
+        if missing:
+            error_messages.append(['error', 'Missing columns of the batch: %s' % (', '.join(missing))])
+        if extra:
+            error_messages.append(['error', 'Columns not in the batch: %s' % (', '.join(extra))])
+        if not missing and not extra:
+            error_messages.append(['error', 'Columns are in a different order than in the batch: %s' % (
+                ', '.join(columns))])
+        return True, error_messages
@@ -0,0 +1,140 @@
+import numpy as np
+import pandas as pd
+from rules.validation_rule import ValidationRule
+
+TYPES = ['integer', 'float', 'boolean', 'date', 'string']
+INTEGER, FLOAT, BOOLEAN, DATE, STRING = range(len(TYPES))
+
+BOOLEANS = ['true', 'false', 'yes', 'no']
+DATE_PATTERN = r'\d{4}-\d{1,2}-\d{1,2}|\d{1,2}[/.-]\d{1,2}[/.-]\d{2,4}'
+
+
+def classify(values):
+    '''Type code of each value of an array of non-null strings'''
+    values = pd.Series(values, dtype=object)
+    types = np.full(len(values), STRING, dtype='int8')
+
+    # NumPy's own conversion is much faster than to_numeric on clean columns
+    try:
+        numbers = values.values.astype('float64')
+    except (ValueError, TypeError):
+        numbers = pd.to_numeric(values, errors='coerce').values.astype('float64')
+    is_number = np.isfinite(numbers)
+
+    # only integral numbers can be written either way, 1 or 1.0
+    types[is_number] = FLOAT
+    integral = np.flatnonzero(is_number & (np.floor(numbers) == numbers))
+    try:
+        values.values[integral].astype('int64')
+        written_as_integer = np.ones(len(integral), dtype=bool)
+    except (ValueError, TypeError, OverflowError):
+        written_as_integer = ~values.iloc[integral].str.contains('[.eE]', regex=True).values.astype(bool)
+    types[integral[written_as_integer]] = INTEGER
+
+    rest = np.flatnonzero(~is_number)
+    is_boolean = values.iloc[rest].str.lower().isin(BOOLEANS).values
+    types[rest[is_boolean]] = BOOLEAN
+
+    rest = rest[~is_boolean]
+    candidates = rest[values.iloc[rest].str.match(DATE_PATTERN).values.astype(bool)]
+    if len(candidates):
+        dates = pd.to_datetime(values.iloc[candidates], errors='coerce')
+        types[candidates[dates.notna().values]] = DATE
+    return types
+
+
+class TypeConsistencyRule(ValidationRule):
+    '''Infers each column's type over the whole file and reports mixed columns.
+
+    Every frame is factorized so that only its distinct values are
+    classified, then the per-row type codes are counted with NumPy. Integer
+    columns with some floats count as float columns. After finish(),
+    column_types holds each column's dominant type and schema the type
+    that every one of its values fits in.
+    '''
+
+    uses_bytes = False
+    uses_frames = True
+    sharding = 'merge'
+
+    def __init__(self, max_samples=5, severity='warning'):
+        self.max_samples = max_samples
+        self.severity = severity
+        self.counts = {}
+        self.samples = {}
+        self.column_types = {}
+        self.schema = {}
+
+    def config(self):
+        return {'max_samples': self.max_samples, 'severity': self.severity}
+
+    def process_frame(self, frame, first_row):
+        for name in frame.columns:
+            if name not in self.counts:
+                self.counts[name] = np.zeros(len(TYPES), dtype='int64')
+                self.samples[name] = [[] for _ in TYPES]
+
+            codes, uniques = pd.factorize(frame[name])
+            present = codes >= 0
+            types = classify(uniques)[codes[present]]
+            self.counts[name] += np.bincount(types, minlength=len(TYPES))
+
+            # keep the first row numbers seen for every type
+            rows = np.flatnonzero(present) + first_row + 1
+            samples = self.samples[name]
+            for code in np.unique(types):
+                if len(samples[code]) < self.max_samples:
+                    needed = self.max_samples - len(samples[code])
+                    samples[code].extend(int(row) for row in rows[types == code][:needed])
+
+    def shard_state(self):
+        return [[name, counts.tolist(), self.samples[name]]
+                for name, counts in self.counts.items()]
+
+    def merge_shards(self, states):
+        for state in states:
+            for name, counts, samples in state:
+                if name not in self.counts:
+                    self.counts[name] = np.zeros(len(TYPES), dtype='int64')
+                    self.samples[name] = [[] for _ in TYPES]
+                self.counts[name] += np.array(counts, dtype='int64')
+                for kept, rows in zip(self.samples[name], samples):
+                    kept.extend(rows[:self.max_samples - len(kept)])
+
+    def finish(self):
+        error_messages = []
+        for name, counts in self.counts.items():
+            total = counts.sum()
+            if total == 0:
+                self.column_types[name] = None
+                self.schema[name] = 'string'
+                continue
+            dominant = int(np.argmax(counts))
+
+            # integers fit in a float column, not the other way round
+            counts = counts.copy()
+            samples = self.samples[name]
+            if dominant == FLOAT:
+                counts[FLOAT] += counts[INTEGER]
+                counts[INTEGER] = 0
+            self.column_types[name] = TYPES[dominant]
+
+            mismatched = total - counts[dominant]
+            if mismatched == 0:
+                self.schema[name] = TYPES[dominant]
+                continue
+            if counts[INTEGER] + counts[FLOAT] == total:
+                self.schema[name] = 'float'
+            else:
+                self.schema[name] = 'string'
+
+            offenders = sorted((row, TYPES[code]) for code, rows in enumerate(samples)
+                               if counts[code] and code != dominant for row in rows)
+            offenders = ', '.join('%d (%s)' % (row, type_name)
+                                  for row, type_name in offenders[:self.max_samples])
+            error_messages.append([self.severity,
+                                   "Column <{}> is mostly {} but {} of {} values ({:.2f}%) are not, e.g. rows {}".format(
+                                       name, TYPES[dominant], mismatched, total,
+                                       100.0 * mismatched / total, offenders)])
+
+        return self.severity == 'error' and len(error_messages) > 0, error_messages
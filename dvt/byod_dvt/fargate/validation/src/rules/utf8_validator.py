@@ -0,0 +1,157 @@
+import codecs
+
+# Size of the slices handed to the decoder, bounds the temporary str it builds
+DECODE_WINDOW = 64 * 1024
+
+# Number of leading bytes kept for guessing the real encoding of a bad file
+SAMPLE_SIZE = 64 * 1024
+
+# Longest first so that UTF-32-LE is not mistaken for UTF-16-LE
+BOMS = [
+    (codecs.BOM_UTF32_LE, 'UTF-32-LE'),
+    (codecs.BOM_UTF32_BE, 'UTF-32-BE'),
+    (codecs.BOM_UTF8, 'UTF-8'),
+    (codecs.BOM_UTF16_LE, 'UTF-16-LE'),
+    (codecs.BOM_UTF16_BE, 'UTF-16-BE')
+]
+
+
+class Utf8Validator:
+    '''Incrementally checks that a byte stream is valid UTF-8.
+
+    Chunks are fed in order with feed() and close() must be called at the
+    end of the stream. Pure ASCII chunks are never decoded, other chunks are
+    decoded in small windows so the memory used does not depend on the
+    chunk size. The positions of the first max_errors invalid sequences are
+    kept as dicts of offset (0-based byte offset), line and column (1-based,
+    column counted in bytes) and the offending bytes.
+    '''
+
+    def __init__(self, max_errors=10):
+        self.max_errors = max_errors
+        self.errors = []
+        self.bom = None
+        self.offset = 0
+        self.lines = 0
+        self.line_start = 0
+        self.sample = bytearray()
+        self.carry = b''
+        self._chunk = b''
+        self._chunk_offset = 0
+
+    @property
+    def done(self):
+        return len(self.errors) >= self.max_errors
+
+    @property
+    def is_valid(self):
+        return not self.errors
+
+    def feed(self, chunk):
+        if self.done or not chunk:
+            return
+
+        if self.offset == 0:
+            self._detect_bom(chunk)
+        if len(self.sample) < SAMPLE_SIZE:
+            self.sample += chunk[:SAMPLE_SIZE - len(self.sample)]
+
+        self._chunk = chunk
+        self._chunk_offset = self.offset
+
+        # plain ASCII is always valid UTF-8 and needs no decoding
+        if self.carry or not chunk.isascii():
+            self._scan_chunk(chunk)
+
+        self.lines += chunk.count(b'\n')
+        last_newline = chunk.rfind(b'\n')
+        if last_newline >= 0:
+            self.line_start = self.offset + last_newline + 1
+        self.offset += len(chunk)
+
+    def close(self):
+        # a sequence still pending at the end of the stream is truncated
+        if self.carry and not self.done:
+            self._chunk = b''
+            self._chunk_offset = self.offset
+            self._scan(self.carry, self.offset - len(self.carry), True)
+        self.carry = b''
+
+    def guess_encoding(self):
+        '''Return (encoding, confidence) for the sampled bytes, if known'''
+        if self.bom is not None and self.bom != 'UTF-8':
+            return self.bom, 1.0
+
+        import chardet
+        sample = bytes(self.sample)
+        for error in self.errors:
+            if error['offset'] >= len(self.sample):
+                sample += error['context']
+        result = chardet.detect(sample)
+        return result.get('encoding'), result.get('confidence') or 0.0
+
+    def _detect_bom(self, chunk):
+        for bom, name in BOMS:
+            if chunk.startswith(bom):
+                self.bom = name
+                return
+
+    def _scan_chunk(self, chunk):
+        if self.carry and len(chunk) < 4:
+            # too short to complete the pending sequence on its own
+            head = self.carry + chunk
+            consumed = self._scan(head, self.offset - len(self.carry), False)
+            self.carry = head[consumed:]
+            return
+
+        start = 0
+        if self.carry:
+            # finish the sequence split across the previous chunk
+            head = self.carry + chunk[:3]
+            consumed = self._scan(head, self.offset - len(self.carry), False)
+            start = max(consumed - len(self.carry), 0)
+        consumed = self._scan(memoryview(chunk)[start:], self.offset + start, False)
+        self.carry = bytes(chunk[start + consumed:])
+
+    def _scan(self, data, base_offset, final):
+        view = memoryview(data)
+        size = len(view)
+        pos = 0
+        while pos < size and not self.done:
+            end = min(pos + DECODE_WINDOW, size)
+            try:
+                _, consumed = codecs.utf_8_decode(
+                    view[pos:end], 'strict', final and end == size)
+            except UnicodeDecodeError as e:
+                self._add_error(base_offset + pos + e.start,
+                                bytes(view[pos + e.start:pos + e.end]))
+                pos += e.end
+                continue
+            pos += consumed
+            if end == size:
+                break
+        return size if self.done else pos
+
+    def _add_error(self, offset, sequence):
+        line, column = self._position(offset)
+        relative = max(offset - self._chunk_offset, 0)
+        self.errors.append({
+            'offset': offset,
+            'line': line,
+            'column': column,
+            'bytes': sequence,
+            'context': bytes(self._chunk[max(relative - 128, 0):relative + 128])
+        })
+
+    def _position(self, offset):
+        relative = offset - self._chunk_offset
+        if relative <= 0:
+            return self.lines + 1, offset - self.line_start + 1
+
+        line = self.lines + self._chunk.count(b'\n', 0, relative) + 1
+        newline = self._chunk.rfind(b'\n', 0, relative)
+        if newline >= 0:
+            line_start = self._chunk_offset + newline + 1
+        else:
+            line_start = self.line_start
+        return line, offset - line_start + 1
@@ -1,14 +1,90 @@
 import abc
-from clevercsv.detect_type import TypeDetector
+
+# Size of the chunks pulled from the S3 body
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
 
 
 class ValidationRule(metaclass=abc.ABCMeta):
+    '''A check run over one pass of the file.
+
+    Rules with uses_bytes get the raw bytes through process_chunk(), rules
+    with uses_frames get the rows parsed once by the engine through
+    process_frame(). finish() returns a tuple of (has_error,
+    error_messages) where each message is a [type, message] list.
+    '''
+
+    uses_bytes = True
+    uses_frames = False
+
+    # Detected delimiter, quotechar, escapechar and has_header of the file,
+    # set by the engine before start(), None when no dialect fits
+    dialect = None
+
+    # Receives the messages of report(), set by the engine before start()
+    reporter = None
+
+    # The part of the file this run covers, None for the whole file, set by
+    # the engine before start(). A dict of index and count of the shard,
+    # offset and end in bytes and the number of data rows (first_row) and
+    # lines (first_line) before it
+    shard = None
+
+    # How the rule runs on shards of a file, files are only sharded when
+    # every rule can be: None when it needs the whole file, 'local' when
+    # finish() on every shard gives the same messages as on the whole file,
+    # 'merge' when shard_state() is taken on every shard and finish() is
+    # called once after merge_shards() got all of them
+    sharding = None
+
+    # Whether jobs can enable and disable the rule by name, False for the
+    # ones the workers add themselves
+    registrable = True
+
     @classmethod
     def __subclasshook__(cls, subclass):
-        return (hasattr(subclass, 'validate') and
-                callable(subclass.validate) or
+        return (hasattr(subclass, 'finish') and
+                callable(subclass.finish) or
                 NotImplemented)
 
+    @property
+    def wants_more(self):
+        '''Whether the rule still needs to see more of the file'''
+        return True
+
+    def config(self):
+        '''Settings that change the rule's result, part of the cache key'''
+        return {}
+
+    def start(self, obj):
+        '''Called once with the S3 object before the first chunk'''
+        pass
+
+    def process_chunk(self, chunk):
+        pass
+
+    def process_frame(self, frame, first_row):
+        '''frame holds the fields as strings, NaN for empty ones. first_row
+        is the number of data rows before it, so frame row i is data row
+        first_row + i + 1 counting from 1 after the header'''
+        pass
+
     @abc.abstractmethod
-    def validate(self, obj):
+    def finish(self):
+        raise NotImplementedError
+
+    def shard_state(self):
+        '''What finish() needs from this shard, as JSON'''
+        raise NotImplementedError
+
+    def merge_shards(self, states):
+        '''Takes the shard_state() of every shard, in order'''
         raise NotImplementedError
+
+    def report(self, kind, message):
+        '''Hands a message over as soon as it is found, for rules that may
+        find too many to keep until finish()'''
+        self.reporter.add(type(self).__name__, kind, message)
+
+    def validate(self, obj, chunk_size=DEFAULT_CHUNK_SIZE):
+        from rules.engine import ValidationEngine
+        return ValidationEngine([self], chunk_size=chunk_size, parallel=False).run(obj)
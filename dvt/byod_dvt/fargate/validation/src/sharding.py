@@ -0,0 +1,137 @@
+import io
+import codecs
+import numpy as np
+import pandas as pd
+from rules import ErrorCollector
+
+# Bytes scanned at a time while looking for record boundaries
+SCAN_CHUNK_SIZE = 16 * 1024 * 1024
+
+NEWLINE = ord('\n')
+CARRIAGE_RETURN = ord('\r')
+
+
+class ShardReport(ErrorCollector):
+    '''Keeps the messages of a shard with their rule, for merge()'''
+
+    def _store(self, rule, kind, message):
+        self.messages.append([rule, kind, message])
+
+
+def scan_records(body, targets, quotechar, delimiter, head=b'', chunk_size=SCAN_CHUNK_SIZE):
+    '''Finds the start of the first record at or after each of the sorted
+    target offsets.
+
+    Newlines inside quoted fields are told apart by the parity of the quote
+    characters before them, which holds as long as quotes are escaped by
+    doubling them and only open or close fields. Returns a list of
+    (offset, records, lines) with the number of non-blank records and of
+    lines before each start, the targets past the last record are left
+    out, or None when a quote does neither and the records can not be
+    told apart without parsing. head is what was already read of body.
+    '''
+    delimiter = ord(delimiter)
+    # as when parsing, a file without a detected quote character may
+    # still quote fields after the sample
+    quote = ord(quotechar or '"')
+    boundaries = []
+    offset = 0
+    quoted = 0
+    records = 0
+    lines = 0
+    record_start = 0
+    last_byte = NEWLINE
+    # a quote at the end of a chunk is checked against the next byte
+    closing_at_end = False
+
+    while len(boundaries) < len(targets):
+        chunk = body.read(chunk_size)
+        if head:
+            chunk, head = head + chunk, b''
+        if not chunk:
+            break
+        data = np.frombuffer(chunk, dtype=np.uint8)
+        newlines = np.flatnonzero(data == NEWLINE)
+
+        if closing_at_end and data[0] not in (delimiter, NEWLINE, CARRIAGE_RETURN, quote):
+            return None
+        quotes = np.flatnonzero(data == quote)
+        opening = (quoted + np.arange(len(quotes))) % 2 == 0
+        before = data[(quotes - 1).clip(min=0)]
+        before[quotes == 0] = last_byte
+        if offset == 0 and chunk.startswith(codecs.BOM_UTF8):
+            before[quotes == len(codecs.BOM_UTF8)] = NEWLINE
+        after = data[(quotes + 1).clip(max=len(data) - 1)]
+        after[quotes == len(data) - 1] = delimiter
+        fits_open = np.isin(before, [delimiter, NEWLINE, CARRIAGE_RETURN, quote])
+        fits_close = np.isin(after, [delimiter, NEWLINE, CARRIAGE_RETURN, quote])
+        if not (fits_open[opening].all() and fits_close[~opening].all()):
+            return None
+        closing_at_end = bool(len(quotes) and quotes[-1] == len(data) - 1 and not opening[-1])
+
+        ends = newlines[(quoted + np.searchsorted(quotes, newlines)) % 2 == 0]
+        quoted = (quoted + len(quotes)) % 2
+
+        if len(ends):
+            # blank records, \n or \r\n alone, are skipped by the parser
+            starts = np.empty(len(ends), dtype='int64')
+            starts[0] = record_start - offset
+            starts[1:] = ends[:-1] + 1
+            previous = data[(ends - 1).clip(min=0)]
+            previous[ends == 0] = last_byte
+            blank = (ends == starts) | ((ends - starts == 1) & (previous == CARRIAGE_RETURN))
+            records_through = records + np.cumsum(~blank)
+            lines_through = lines + np.searchsorted(newlines, ends, side='right')
+
+            while len(boundaries) < len(targets):
+                found = np.searchsorted(ends, targets[len(boundaries)] - 1 - offset)
+                if found == len(ends):
+                    break
+                boundaries.append((offset + int(ends[found]) + 1, int(records_through[found]),
+                                   int(lines_through[found])))
+            records = int(records_through[-1])
+            record_start = offset + int(ends[-1]) + 1
+
+        lines += len(newlines)
+        last_byte = data[-1]
+        offset += len(data)
+    return boundaries
+
+
+def plan_shards(body, size, dialect, shard_size, head=b''):
+    '''Splits a file of size bytes into about shard_size parts that start
+    on a record, returns the shard dicts the engine takes or None when
+    the file can not be split'''
+    if dialect is None or dialect['escapechar'] not in ('', dialect['quotechar']):
+        return None
+    targets = list(range(shard_size, size, shard_size))
+    boundaries = scan_records(body, targets, dialect['quotechar'], dialect['delimiter'] or ',', head)
+    if not boundaries:
+        return None
+
+    shards = [{'offset': 0, 'first_row': 0, 'first_line': 0}]
+    for offset, records, lines in boundaries:
+        # a record longer than shard_size can cover several targets
+        if offset >= size or offset == shards[-1]['offset']:
+            continue
+        shards.append({
+            'offset': offset,
+            'first_row': records - (1 if dialect['has_header'] else 0),
+            'first_line': lines
+        })
+    if len(shards) == 1:
+        return None
+    for i, shard in enumerate(shards):
+        shard['index'] = i
+        shard['count'] = len(shards)
+        shard['end'] = shards[i + 1]['offset'] if i + 1 < len(shards) else size
+    return shards
+
+
+def shard_read_csv_args(head, args):
+    '''pd.read_csv arguments for the shards after the first, which have no
+    header: the column names parsed from the head of the file'''
+    if args.get('header') is None:
+        return args
+    columns = pd.read_csv(io.BytesIO(head), nrows=0, dtype=str, encoding='utf8', **args).columns
+    return dict(args, header=None, names=list(columns))
@@ -1,21 +1,146 @@
 var AWS = require('aws-sdk');
 AWS.config.update({region: process.env['REGION']});
 s3 = new AWS.S3();
+dynamodb = new AWS.DynamoDB.DocumentClient();
 
-exports.handler = async (event, context, callback) => {
-    let source_object = process.env['SOURCE_BUCKET'] + '/' + event.source_object + '?versionId=' + event.source_version;
-    let dest_object = process.env['STAGE_BUCKET'] + '/' + event.source_object;
+const MiB = 1024 * 1024;
 
-    s3.copyObject({
-      CopySource: source_object,
-      Bucket: process.env['STAGE_BUCKET'],
-      Key: event.source_object
-    }, function(err, res) {
-      if (err) {
-        console.log('[ERROR]: ', err);
-      } else {
-        console.log('[SUCCESS]');
+// S3 limits of a multipart upload
+const MIN_PART_SIZE = 5 * MiB;
+const MAX_PART_SIZE = 5 * 1024 * MiB;
+const MAX_PARTS = 10000;
+
+const PART_SIZE = Math.max(parseInt(process.env['STAGE_PART_SIZE_MB'] || '64') * MiB, MIN_PART_SIZE);
+const CONCURRENCY = parseInt(process.env['STAGE_CONCURRENCY'] || '16');
+
+function partSize(size) {
+  // larger parts when the object would not fit in MAX_PARTS
+  return Math.min(Math.max(PART_SIZE, Math.ceil(size / MAX_PARTS)), MAX_PART_SIZE);
+}
+
+function copySource(bucket, key, version) {
+  return bucket + '/' + key.split('/').map(encodeURIComponent).join('/') + '?versionId=' + encodeURIComponent(version);
+}
+
+async function multipartCopy(source, head, key) {
+  let bucket = process.env['STAGE_BUCKET'];
+  let upload = await s3.createMultipartUpload({
+    Bucket: bucket,
+    Key: key,
+    // what copyObject keeps of the source, undefined when it has none
+    ContentType: head.ContentType,
+    ContentEncoding: head.ContentEncoding,
+    CacheControl: head.CacheControl,
+    ContentDisposition: head.ContentDisposition,
+    Metadata: head.Metadata
+  }).promise();
+
+  let size = partSize(head.ContentLength);
+  let count = Math.ceil(head.ContentLength / size);
+  let parts = new Array(count);
+  let next = 0;
+  let failed = false;
+
+  // each worker copies the next part until there are none left
+  async function copyParts() {
+    while (next < count && !failed) {
+      let i = next++;
+      let start = i * size;
+      let end = Math.min(start + size, head.ContentLength) - 1;
+      try {
+        let res = await s3.uploadPartCopy({
+          Bucket: bucket,
+          Key: key,
+          UploadId: upload.UploadId,
+          PartNumber: i + 1,
+          CopySource: source,
+          CopySourceRange: 'bytes=' + start + '-' + end
+        }).promise();
+        parts[i] = {ETag: res.CopyPartResult.ETag, PartNumber: i + 1};
+      } catch (err) {
+        failed = true;
+        throw err;
       }
-    });
-    callback(null, 'DONE');
-};
\ No newline at end of file
+    }
+  }
+
+  try {
+    let workers = [];
+    for (let i = 0; i < Math.min(CONCURRENCY, count); i++) {
+      workers.push(copyParts());
+    }
+    // let the parts in flight finish so that the abort removes them all
+    let results = await Promise.allSettled(workers);
+    let rejected = results.find(result => result.status === 'rejected');
+    if (rejected) {
+      throw rejected.reason;
+    }
+    await s3.completeMultipartUpload({
+      Bucket: bucket,
+      Key: key,
+      UploadId: upload.UploadId,
+      MultipartUpload: {Parts: parts}
+    }).promise();
+  } catch (err) {
+    await s3.abortMultipartUpload({Bucket: bucket, Key: key, UploadId: upload.UploadId}).promise();
+    throw err;
+  }
+  return count;
+}
+
+async function stage(key, version) {
+  let head = await s3.headObject({
+    Bucket: process.env['SOURCE_BUCKET'],
+    Key: key,
+    VersionId: version
+  }).promise();
+  let source = copySource(process.env['SOURCE_BUCKET'], key, version);
+
+  // a single copy is limited to 5 GB and is quicker for small objects
+  if (head.ContentLength <= partSize(head.ContentLength)) {
+    await s3.copyObject({
+      CopySource: source,
+      Bucket: process.env['STAGE_BUCKET'],
+      Key: key
+    }).promise();
+    console.log('Copied %d bytes', head.ContentLength);
+  } else {
+    let parts = await multipartCopy(source, head, key);
+    console.log('Copied %d bytes in %d parts', head.ContentLength, parts);
+  }
+}
+
+async function updateJob(jobId, staged, ms, error) {
+  let expression = 'set staged = :s, staged_ms = :m, staged_ts = :t';
+  let values = {':s': staged, ':m': ms, ':t': new Date().toISOString()};
+  if (error) {
+    expression += ', staged_error = :e';
+    values[':e'] = error;
+  }
+  await dynamodb.update({
+    TableName: process.env['TABLE_NAME'],
+    Key: {id: jobId},
+    UpdateExpression: expression,
+    ExpressionAttributeValues: values
+  }).promise();
+}
+
+exports.handler = async (event, context) => {
+  let started = Date.now();
+  let error = null;
+  try {
+    await stage(event.source_object, event.source_version);
+    console.log('[SUCCESS]');
+  } catch (err) {
+    console.log('[ERROR]: ', err);
+    error = err;
+  }
+
+  if (event.job_id) {
+    await updateJob(event.job_id, error ? 'failed' : 'yes', Date.now() - started, error ? error.message : null);
+  }
+  if (error) {
+    throw error;
+  }
+  return 'DONE';
+};
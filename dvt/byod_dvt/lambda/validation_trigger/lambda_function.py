@@ -1,44 +1,203 @@
 import os
-import boto3
 import uuid
 import datetime
+from urllib.parse import unquote_plus
+import boto3
 
-dynamodb = boto3.resource('dynamodb')
+# plain clients, resources load much more at cold start
+dynamodb = boto3.client('dynamodb')
 sqs = boto3.client('sqs')
 
 TABLE_NAME = os.environ['TABLE_NAME']
 QUEUE_URL = os.environ['QUEUE_URL']
 
+# Files under FAST_PATH_MAX_MB go to the queue of the validation Lambda,
+# larger ones to the Fargate tasks
+FAST_QUEUE_URL = os.environ.get('FAST_QUEUE_URL')
+FAST_PATH_MAX_BYTES = int(float(os.environ.get('FAST_PATH_MAX_MB', '16')) * 1024 * 1024)
 
-def lambda_handler(event, context):
-    print('Received event: \n' + str(event))
+# Compressed files count as this many times their size, CSV compresses
+# about that well
+COMPRESSED_EXTENSIONS = ('.gz', '.gzip', '.bz2', '.zst', '.zstd')
+COMPRESSION_RATIO = 8
 
-    table = dynamodb.Table(TABLE_NAME)
+# An upload ending in MANIFEST_SUFFIX starts a batch job over the files it
+# lists, files under BATCH_PREFIX are only validated by their batch
+MANIFEST_SUFFIX = '.manifest.json'
+BATCH_PREFIX = os.environ.get('BATCH_PREFIX', 'batch/')
 
-    for record in event['Records']:
-        job_id = str(uuid.uuid4())
-        d = datetime.datetime.utcnow()
-
-        response = table.put_item(
-            Item={
-                'id': job_id,
-                'start_ts': datetime.datetime.utcnow().isoformat(),
-                'createdAt': d.isoformat() + 'Z',
-                'updatedAt': d.isoformat() + 'Z',
-                'filename': record['s3']['object']['key'],
-                'filename_version': record['s3']['object']['versionId'],
-                'status': 'pending',
-                'warnings': 0,
-                'errors': 0,
-                'staged': 'no'
-            }
-        )
-        print('DynamoDB response: %s' % (response))
+# Largest DynamoDB transaction and read batch, and SQS batch
+TRANSACTION_SIZE = 25
+READ_BATCH_SIZE = 100
+MESSAGE_BATCH_SIZE = 10
+
+
+def make_job_id(bucket, key, version):
+    # the same object version always maps to the same job
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, 's3://%s/%s?versionId=%s' % (bucket, key, version)))
+
+
+def job_item(record):
+    obj = record['s3']['object']
+    key = unquote_plus(obj['key'])
+    d = datetime.datetime.utcnow()
+
+    item = {
+        'id': {'S': make_job_id(record['s3']['bucket']['name'], key, obj['versionId'])},
+        'start_ts': {'S': d.isoformat()},
+        'createdAt': {'S': d.isoformat() + 'Z'},
+        'updatedAt': {'S': d.isoformat() + 'Z'},
+        'filename': {'S': key},
+        'filename_version': {'S': obj['versionId']},
+        'status': {'S': 'pending'},
+        'warnings': {'N': '0'},
+        'errors': {'N': '0'},
+        'staged': {'S': 'no'}
+    }
+    # from the event, so routing needs no HEAD request
+    if 'size' in obj:
+        item['size'] = {'N': str(obj['size'])}
+    if obj.get('eTag'):
+        item['etag'] = {'S': obj['eTag']}
+    if key.endswith(MANIFEST_SUFFIX):
+        item['job_type'] = {'S': 'batch'}
+    return item
+
+
+def in_batch(item):
+    '''Whether the file is left to the batch job of its manifest'''
+    return 'job_type' not in item and item['filename']['S'].startswith(BATCH_PREFIX)
+
+
+def is_small(item):
+    # the size of a batch is that of its manifest
+    if FAST_QUEUE_URL is None or 'size' not in item or 'job_type' in item:
+        return False
+    size = int(item['size']['N'])
+    if item['filename']['S'].lower().endswith(COMPRESSED_EXTENSIONS):
+        size *= COMPRESSION_RATIO
+    return size < FAST_PATH_MAX_BYTES
 
-        response = sqs.send_message(
-            QueueUrl=QUEUE_URL,
-            DelaySeconds=10,
-            MessageAttributes={},
-            MessageBody=(job_id)
+
+def put_new_jobs(items):
+    '''Writes the job items that do not exist yet, returns their ids and
+    the ids of the ones that did'''
+    created = []
+    existing_ids = []
+    for i in range(0, len(items), TRANSACTION_SIZE):
+        batch = items[i:i + TRANSACTION_SIZE]
+        while batch:
+            try:
+                dynamodb.transact_write_items(TransactItems=[{
+                    'Put': {
+                        'TableName': TABLE_NAME,
+                        'Item': item,
+                        'ConditionExpression': 'attribute_not_exists(id)'
+                    }
+                } for item in batch])
+                created += [item['id']['S'] for item in batch]
+                break
+            except dynamodb.exceptions.TransactionCanceledException as e:
+                # a redelivered event, set aside the jobs that exist and retry the rest
+                reasons = e.response.get('CancellationReasons', [])
+                existing = [item for item, reason in zip(batch, reasons)
+                            if reason.get('Code') == 'ConditionalCheckFailed']
+                if not existing:
+                    raise
+                existing_ids += [item['id']['S'] for item in existing]
+                batch = [item for item in batch if item not in existing]
+    return created, existing_ids
+
+
+def unqueued_jobs(job_ids):
+    '''The jobs no worker has started, an invocation may have written them
+    and died before queueing them. Workers mark the jobs they start with
+    started_ts, the queue retries those itself.'''
+    found = []
+    for i in range(0, len(job_ids), READ_BATCH_SIZE):
+        keys = [{'id': {'S': job_id}} for job_id in job_ids[i:i + READ_BATCH_SIZE]]
+        while keys:
+            response = dynamodb.batch_get_item(RequestItems={
+                TABLE_NAME: {
+                    'Keys': keys,
+                    'ConsistentRead': True,
+                    'ProjectionExpression': 'id, #status, started_ts, end_ts, shards',
+                    'ExpressionAttributeNames': {'#status': 'status'}
+                }
+            })
+            found += response['Responses'].get(TABLE_NAME, [])
+            keys = response.get('UnprocessedKeys', {}).get(TABLE_NAME, {}).get('Keys', [])
+    # split jobs are queued as shards
+    return [item['id']['S'] for item in found if item['status']['S'] == 'pending' and
+            'started_ts' not in item and 'end_ts' not in item and 'shards' not in item]
+
+
+def send_jobs(queue_url, job_ids, delay_seconds=10):
+    '''Queues the jobs in batches, returns the ids that could not be sent'''
+    failed = []
+    for i in range(0, len(job_ids), MESSAGE_BATCH_SIZE):
+        batch = job_ids[i:i + MESSAGE_BATCH_SIZE]
+        response = sqs.send_message_batch(
+            QueueUrl=queue_url,
+            Entries=[{
+                'Id': str(n),
+                'DelaySeconds': delay_seconds,
+                'MessageBody': job_id
+            } for n, job_id in enumerate(batch)]
         )
-        print('SQS response: %s' % (response))
+        failed += [batch[int(entry['Id'])] for entry in response.get('Failed', [])]
+    return failed
+
+
+def delete_jobs(job_ids):
+    for i in range(0, len(job_ids), TRANSACTION_SIZE):
+        requests = {
+            TABLE_NAME: [{'DeleteRequest': {'Key': {'id': {'S': job_id}}}}
+                         for job_id in job_ids[i:i + TRANSACTION_SIZE]]
+        }
+        # the ones DynamoDB throttled come back unprocessed
+        while requests:
+            requests = dynamodb.batch_write_item(RequestItems=requests).get('UnprocessedItems')
+
+
+def lambda_handler(event, context):
+    print('Received %d records' % (len(event['Records'])))
+
+    # drop duplicate records within the event
+    items = {}
+    for record in event['Records']:
+        item = job_item(record)
+        if in_batch(item):
+            print('%s is part of a batch, no job of its own' % (item['filename']['S']))
+            continue
+        items.setdefault(item['id']['S'], item)
+
+    created, existing_ids = put_new_jobs(list(items.values()))
+    print('Created %d jobs' % (len(created)))
+    job_ids = list(created)
+    if existing_ids:
+        # a redelivered event, queue again what it may not have queued,
+        # workers skip a job that is queued twice once it is done
+        requeued = unqueued_jobs(existing_ids)
+        print('Dropping duplicate events for jobs %s, queueing %d of them again' % (
+            ', '.join(existing_ids), len(requeued)))
+        job_ids += requeued
+
+    # the validation Lambda reads the job consistently, no need to wait
+    small = [job_id for job_id in job_ids if is_small(items[job_id])]
+    large = [job_id for job_id in job_ids if not is_small(items[job_id])]
+    failed = []
+    for queue_url, queued, delay_seconds in [(FAST_QUEUE_URL, small, 0), (QUEUE_URL, large, 10)]:
+        if not queued:
+            continue
+        not_sent = send_jobs(queue_url, queued, delay_seconds)
+        if not_sent:
+            not_sent = send_jobs(queue_url, not_sent, delay_seconds)
+        failed += not_sent
+    if failed:
+        # remove the jobs so that the retried event creates them again, the
+        # ones an earlier invocation created are queued again by the retry
+        delete_jobs([job_id for job_id in failed if job_id in created])
+        raise Exception('Could not queue jobs %s' % (', '.join(failed)))
+    print('Queued %d small jobs for the validation Lambda and %d for Fargate' % (
+        len(small), len(large)))
@@ -0,0 +1,15 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+
+from stand_in import StandIn
+
+
+@pytest.fixture(scope='session')
+def stand_in():
+    '''The workers' buckets, table and queues, for every test of the run'''
+    stand_in = StandIn().start()
+    yield stand_in
+    stand_in.stop()
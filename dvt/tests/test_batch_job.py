@@ -0,0 +1,38 @@
+import json
+import pytest
+from stand_in import SOURCE_BUCKET_NAME
+from stand_in import load_worker
+from test_validation_job import read_report
+
+
+def run_batch(stand_in, tmp_path, job_id, manifest):
+    path = tmp_path / ('%s.manifest.json' % (job_id))
+    path.write_text(json.dumps(manifest))
+    stand_in.add_job(job_id, str(path), job_type='batch')
+    load_worker('validation').validate_job({'Body': job_id})
+    return stand_in.job(job_id)
+
+
+def test_batch_of_files(stand_in, tmp_path):
+    for name in ['first', 'second']:
+        stand_in.s3.put_object(Bucket=SOURCE_BUCKET_NAME, Key='batch/%s.csv' % (name),
+                               Body=b'id,amount\n1,10\n2,20\n')
+    job = run_batch(stand_in, tmp_path, 'twofiles', {'files': ['batch/first.csv', {'key': 'batch/second.csv'}]})
+    assert job['status'] == 'success'
+    assert job['batch_files'] == 2
+    assert job['batch_failed'] == 0
+
+
+@pytest.mark.parametrize('manifest', [
+    {'files': 'batch/first.csv'},
+    {'files': [{'version_id': 'v1'}]},
+    {'files': [7]},
+    {'prefix': ['batch/']},
+    {'prefix': 'batch/', 'columns': 'id,amount'},
+    {'prefix': 'batch/', 'dialect': ','},
+])
+def test_malformed_manifest_fails_the_job(stand_in, tmp_path, manifest):
+    job = run_batch(stand_in, tmp_path, 'malformed', manifest)
+    assert job['status'] == 'failed'
+    assert any('Could not read the manifest' in line for line in read_report(stand_in, 'malformed'))
+    stand_in.table.delete_item(Key={'id': 'malformed'})
@@ -0,0 +1,49 @@
+import io
+import bz2
+import gzip
+import sys
+import tracemalloc
+import pytest
+from stand_in import FARGATE_DIR
+
+sys.path.insert(0, FARGATE_DIR)
+
+from common.compression import DecompressingReader
+
+MiB = 1024 * 1024
+
+# rows that compress about 1000:1
+ROWS = b'1,0.0,same text on every row\n' * (64 * MiB // 29)
+
+
+def compress(codec, data):
+    if codec == 'gzip':
+        return gzip.compress(data)
+    if codec == 'bzip2':
+        return bz2.compress(data)
+    zstandard = pytest.importorskip('zstandard')
+    return zstandard.ZstdCompressor().compress(data)
+
+
+@pytest.mark.parametrize('codec', ['gzip', 'bzip2', 'zstd'])
+def test_output_is_bounded(codec):
+    data = compress(codec, ROWS)
+    assert len(data) < len(ROWS) // 100
+
+    tracemalloc.start()
+    try:
+        reader = DecompressingReader(io.BytesIO(data), codec, chunk_size=MiB, workers=2)
+        size = 0
+        while True:
+            chunk = reader.read(64 * 1024)
+            if not chunk:
+                break
+            size += len(chunk)
+        reader.close()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    assert size == len(ROWS)
+    # the reader holds a few chunks per worker, not the 64 MB
+    assert peak < 16 * MiB
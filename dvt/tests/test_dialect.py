@@ -0,0 +1,32 @@
+import io
+import sys
+import pandas as pd
+from stand_in import FARGATE_DIR
+
+sys.path.insert(0, FARGATE_DIR)
+
+from common import read_csv_args
+from common import csv_reader_args
+
+# what clevercsv detects in a sample without any quotes
+UNQUOTED = {'delimiter': ',', 'quotechar': '', 'escapechar': '', 'has_header': True}
+
+DATA = b'id,name,amount\n' + b''.join(b'%d,Smith,%d\n' % (i, i) for i in range(1, 5000)) + \
+    b'5000,"Smith, John",5\n5001,"two\nlines",6\n'
+
+
+def test_quotes_after_the_sample_are_parsed():
+    frame = pd.read_csv(io.BytesIO(DATA), **read_csv_args(UNQUOTED))
+    assert len(frame) == 5001
+    assert list(frame['name'].iloc[-2:]) == ['Smith, John', 'two\nlines']
+    assert csv_reader_args(UNQUOTED)['quotechar'] == '"'
+
+
+def test_shards_do_not_start_inside_quotes():
+    sys.path.insert(0, FARGATE_DIR + '/validation/src')
+    from sharding import scan_records
+
+    quoted_newline = DATA.index(b'two\n') + 4
+    boundaries = scan_records(io.BytesIO(DATA), [quoted_newline - 2], '', ',')
+    # the header and 5001 rows, one of them on two lines
+    assert boundaries == [(len(DATA), 5002, 5003)]
@@ -0,0 +1,25 @@
+import gzip
+from stand_in import TARGET_BUCKET_NAME
+from stand_in import load_worker
+
+
+def read_report(stand_in, job_id):
+    body = stand_in.s3.get_object(Bucket=TARGET_BUCKET_NAME, Key='validation/%s.csv.gz' % (job_id))['Body']
+    return gzip.decompress(body.read()).decode('utf8').splitlines()
+
+
+def test_duplicates_reach_the_report(stand_in, tmp_path):
+    path = tmp_path / 'duplicates.csv'
+    path.write_text('id,amount\n1,10\n2,20\n1,30\n3,40\n2,50\n')
+    stand_in.add_job('duplicates', str(path), enabled_rules=['DuplicateRowRule'],
+                     rule_options={'DuplicateRowRule': {'columns': ['id']}})
+
+    load_worker('validation').validate_job({'Body': 'duplicates'})
+
+    job = stand_in.job('duplicates')
+    assert job['status'] == 'success'
+    assert job['warnings'] == 3
+    report = read_report(stand_in, 'duplicates')
+    assert 'warning,Row 3 duplicates row 1,DuplicateRowRule' in report
+    assert 'warning,Row 5 duplicates row 2,DuplicateRowRule' in report
+    assert 'warning,Found 2 duplicate rows on id,DuplicateRowRule' in report
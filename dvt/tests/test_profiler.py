@@ -0,0 +1,47 @@
+import os
+import sys
+import pandas as pd
+from stand_in import FARGATE_DIR
+
+# after the validation worker's modules, only the profiler is taken from here
+sys.path.append(os.path.abspath(os.path.join(FARGATE_DIR, 'profiling', 'src')))
+
+from profiler import ColumnProfile
+from profiler import choose_preset
+from profiler.presets import SAMPLE_ROWS
+from profiler.presets import SAMPLE_SEED
+
+
+def test_null_settings_take_the_defaults():
+    preset = choose_preset(1024, 3, {'profile_sample_rows': None, 'profile_seed': None})
+    assert preset == {'preset': 'full', 'sample_rows': SAMPLE_ROWS, 'seed': SAMPLE_SEED}
+
+
+def test_settings_override_the_defaults():
+    preset = choose_preset(1024, 3, {'profile_preset': 'sampled', 'profile_sample_rows': 10,
+                                     'profile_seed': 0})
+    assert preset == {'preset': 'sampled', 'sample_rows': 10, 'seed': 0}
+
+
+def profile(*chunks):
+    column = ColumnProfile('amount')
+    for chunk in chunks:
+        column.update(pd.Series(chunk, dtype=object))
+    return column
+
+
+def test_numeric_column():
+    numeric = profile(['1', '2'], [None, '3.5']).to_dict()['numeric']
+    assert numeric['min'] == 1
+    assert numeric['max'] == 3.5
+
+
+def test_text_after_the_first_chunk_makes_the_column_text():
+    assert profile(['1', '2'], ['3', 'n/a']).to_dict()['numeric'] is None
+    assert profile(['1', '2'], ['3', '4'], ['5', 'x']).to_dict()['numeric'] is None
+
+
+def test_merge_with_a_text_profile_is_text():
+    merged = profile(['1', '2'])
+    merged.merge(profile(['abc']))
+    assert merged.to_dict()['numeric'] is None
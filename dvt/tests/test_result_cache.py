@@ -0,0 +1,42 @@
+import boto3
+import pytest
+from stand_in import REGION
+from stand_in import TARGET_BUCKET_NAME
+from stand_in import load_worker
+from test_validation_job import validate
+
+
+@pytest.fixture
+def cached(stand_in, monkeypatch):
+    '''The validation worker with a result cache'''
+    app = load_worker('validation')
+    table = boto3.resource('dynamodb', region_name=REGION).create_table(
+        TableName='bench-cache',
+        KeySchema=[{'AttributeName': 'cache_key', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[{'AttributeName': 'cache_key', 'AttributeType': 'S'}],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    monkeypatch.setattr(app, 'result_cache', app.ResultCache(table))
+    yield app
+    table.delete()
+
+
+TEXT = 'id,amount\n1,10\n2,20\n3,30\n'
+
+
+def test_same_object_reuses_the_result(stand_in, tmp_path, cached):
+    first = validate(stand_in, tmp_path, 'cachemiss', TEXT)
+    assert 'cached_from' not in first
+    second = validate(stand_in, tmp_path, 'cachehit', TEXT)
+    assert second['cached_from'] == 'cachemiss'
+    assert second['status'] == first['status']
+    assert second['intermediate_key'] == first['intermediate_key']
+
+
+def test_expired_intermediate_is_not_reused(stand_in, tmp_path, cached):
+    first = validate(stand_in, tmp_path, 'expiring', TEXT + '4,40\n')
+    stand_in.s3.delete_object(Bucket=TARGET_BUCKET_NAME, Key=first['intermediate_key'])
+    second = validate(stand_in, tmp_path, 'afterexpiry', TEXT + '4,40\n')
+    assert 'cached_from' not in second
+    assert second['intermediate_key'] != first['intermediate_key']
+    assert validate(stand_in, tmp_path, 'rehit', TEXT + '4,40\n')['cached_from'] == 'afterexpiry'
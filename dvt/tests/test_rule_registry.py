@@ -0,0 +1,43 @@
+import os
+import sys
+import pytest
+from stand_in import FARGATE_DIR
+
+sys.path.insert(0, os.path.join(FARGATE_DIR, 'validation', 'src'))
+sys.path.insert(0, FARGATE_DIR)
+
+from rules import RuleRegistry
+
+
+def names(rules):
+    return [type(rule).__name__ for rule in rules]
+
+
+def test_jobs_pick_known_rules():
+    registry = RuleRegistry(['CsvHeaderRule'])
+    rules = registry.create({'enabled_rules': ['DuplicateRowRule'], 'disabled_rules': ['CsvHeaderRule'],
+                             'rule_options': {'DuplicateRowRule': {'columns': ['id']}}})
+    assert names(rules) == ['DuplicateRowRule']
+    assert rules[0].columns == ['id']
+
+
+def test_jobs_can_not_import_code():
+    registry = RuleRegistry(['CsvHeaderRule'])
+    with pytest.raises(KeyError):
+        registry.create({'enabled_rules': ['os:system']})
+    assert 'os:system' not in registry.rules
+
+
+def test_the_environment_can_load_specs():
+    registry = RuleRegistry(['CsvHeaderRule', 'rules.duplicate_row_rule:DuplicateRowRule'])
+    rules = registry.create({'disabled_rules': ['rules.duplicate_row_rule:DuplicateRowRule']})
+    assert names(rules) == ['CsvHeaderRule']
+
+
+@pytest.mark.parametrize('name', ['IntermediateWriter', 'SchemaRule'])
+def test_internal_rules_are_not_registered(name):
+    registry = RuleRegistry(['CsvHeaderRule'])
+    with pytest.raises(KeyError):
+        registry.create({'enabled_rules': [name]})
+    with pytest.raises(KeyError):
+        registry.create({'disabled_rules': [name]})
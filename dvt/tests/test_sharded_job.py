@@ -0,0 +1,81 @@
+import pytest
+from stand_in import TARGET_BUCKET_NAME
+from stand_in import load_worker
+from test_validation_job import read_report
+from test_validation_job import validate
+
+# a few values of another type, in different shards
+ROWS = 'id,amount\n' + ''.join('%d,%s\n' % (i, 'n/a' if i % 700 == 5 else i * 10) for i in range(2000))
+
+
+def shard_messages(stand_in, job_id):
+    '''Takes the job's shard messages off the queue'''
+    sqs = load_worker('validation').sqs
+    messages = []
+    while True:
+        response = sqs.receive_message(
+            QueueUrl=stand_in.queue_url, MaxNumberOfMessages=10, MessageAttributeNames=['All'])
+        if not response.get('Messages'):
+            return sorted(messages, key=lambda message: int(message['MessageAttributes']['shard']['StringValue']))
+        for message in response['Messages']:
+            sqs.delete_message(QueueUrl=stand_in.queue_url, ReceiptHandle=message['ReceiptHandle'])
+            if message['Body'] == job_id:
+                messages.append(message)
+
+
+def split(stand_in, tmp_path, monkeypatch, job_id, text=ROWS):
+    app = load_worker('validation')
+    monkeypatch.setattr(app, 'SHARD_SIZE', 4096)
+    path = tmp_path / ('%s.csv' % (job_id))
+    path.write_text(text)
+    stand_in.add_job(job_id, str(path))
+    app.validate_job({'Body': job_id})
+    messages = shard_messages(stand_in, job_id)
+    assert len(messages) > 2
+    return messages
+
+
+def receive(message, count):
+    return dict(message, Attributes={'ApproximateReceiveCount': str(count)})
+
+
+def test_failed_shard_fails_the_job(stand_in, tmp_path, monkeypatch):
+    app = load_worker('validation')
+    messages = split(stand_in, tmp_path, monkeypatch, 'lostshard')
+    validate_shard = app.validate_shard
+
+    def failing(job_id, job, index, metrics):
+        if index == 1:
+            raise IOError('connection reset')
+        return validate_shard(job_id, job, index, metrics)
+    monkeypatch.setattr(app, 'validate_shard', failing)
+
+    # the queue retries the shard until its last receive
+    with pytest.raises(IOError):
+        app.validate_job(receive(messages[1], 1))
+    for message in messages:
+        app.validate_job(receive(message, app.MAX_RECEIVES))
+
+    job = stand_in.job('lostshard')
+    assert job['status'] == 'failed'
+    assert job['errors'] == 1
+    assert job['shards_failed'] == set([1])
+    assert 'Shard 2 of %d could not be validated: connection reset' % (len(messages)) in \
+        ','.join(read_report(stand_in, 'lostshard'))
+    assert stand_in.s3.list_objects_v2(Bucket=TARGET_BUCKET_NAME, Prefix='shards/lostshard/')['KeyCount'] == 0
+
+
+def test_merged_shards_match_the_unsplit_file(stand_in, tmp_path, monkeypatch):
+    whole = validate(stand_in, tmp_path, 'unsplit', ROWS)
+    assert whole['warnings'] > 0
+
+    app = load_worker('validation')
+    for message in split(stand_in, tmp_path, monkeypatch, 'merged'):
+        assert stand_in.job('merged')['status'] == 'pending'
+        app.validate_job(receive(message, 1))
+
+    job = stand_in.job('merged')
+    for name in ['status', 'warnings', 'errors', 'error_counts', 'dialect']:
+        assert job[name] == whole[name]
+    assert read_report(stand_in, 'merged') == read_report(stand_in, 'unsplit')
+    assert stand_in.s3.list_objects_v2(Bucket=TARGET_BUCKET_NAME, Prefix='shards/merged/')['KeyCount'] == 0
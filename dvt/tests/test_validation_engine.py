@@ -0,0 +1,54 @@
+import io
+import os
+import sys
+import pytest
+from stand_in import FARGATE_DIR
+
+sys.path.insert(0, os.path.join(FARGATE_DIR, 'validation', 'src'))
+sys.path.insert(0, FARGATE_DIR)
+
+from rules import RuleRegistry
+from rules import ValidationEngine
+from rules.utf8_validator import Utf8Validator
+
+# a bad header, a mixed type column and multi-byte characters
+TEXT = ('id,my name,amount\n' + ''.join('%d,Zoë Ångström,%d\n' % (i, i) for i in range(3000)) +
+        '3000,x,abc\n').encode('utf8')
+
+# and two invalid UTF-8 sequences, the second a truncated character
+DATA = TEXT + b'3001,caf\xe9,1\n3002,\xe2\x82,2\n'
+
+
+def positions(data, chunk_size):
+    validator = Utf8Validator()
+    for i in range(0, len(data), chunk_size):
+        validator.feed(data[i:i + chunk_size])
+    validator.close()
+    return [(error['offset'], error['line']) for error in validator.errors]
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 7, 4096])
+def test_chunked_utf8_validation_finds_what_decode_does(chunk_size):
+    first = len(TEXT) + len(b'3001,caf')
+    with pytest.raises(UnicodeDecodeError) as error:
+        DATA.decode('utf8')
+    assert error.value.start == first
+    found = positions(DATA, chunk_size)
+    assert found == positions(DATA, len(DATA))
+    assert found[0] == (first, 3003)
+    assert len(found) == 2
+
+
+def run(chunk_size, frame_rows, parallel):
+    engine = ValidationEngine(RuleRegistry().create({}), chunk_size=chunk_size,
+                              frame_rows=frame_rows, parallel=parallel)
+    has_error, messages = engine.run({'Body': io.BytesIO(TEXT), 'ContentLength': len(TEXT)})
+    return has_error, engine.reporter.totals, sorted(map(tuple, messages)), engine.rows
+
+
+def test_chunked_parallel_run_matches_a_single_pass():
+    single = run(len(TEXT), len(TEXT), False)
+    assert single[0]
+    assert single[1] == {'error': 1, 'warning': 1, 'info': 2}
+    assert single[3] == 3001
+    assert run(1000, 100, True) == single
@@ -0,0 +1,39 @@
+import gzip
+from stand_in import TARGET_BUCKET_NAME
+from stand_in import load_worker
+
+
+def validate(stand_in, tmp_path, job_id, text, **extra):
+    path = tmp_path / ('%s.csv' % (job_id))
+    path.write_text(text)
+    stand_in.add_job(job_id, str(path), **extra)
+    load_worker('validation').validate_job({'Body': job_id})
+    return stand_in.job(job_id)
+
+
+def read_report(stand_in, job_id):
+    body = stand_in.s3.get_object(Bucket=TARGET_BUCKET_NAME, Key='validation/%s.csv.gz' % (job_id))['Body']
+    return gzip.decompress(body.read()).decode('utf8').splitlines()
+
+
+def test_clean_file_has_no_report(stand_in, tmp_path):
+    job = validate(stand_in, tmp_path, 'clean', 'id,amount\n1,10\n2,20\n')
+    assert job['status'] == 'success'
+    assert 'result_uri' not in job
+    assert stand_in.s3.list_objects_v2(Bucket=TARGET_BUCKET_NAME, Prefix='validation/clean')['KeyCount'] == 0
+
+
+def test_warnings_are_reported(stand_in, tmp_path):
+    job = validate(stand_in, tmp_path, 'mixed', 'id,amount\n1,10\n2,20\n3,30\n4,abc\n5,50\n')
+    assert job['status'] == 'success'
+    assert job['warnings'] == 1
+    assert job['errors'] == 0
+    report = read_report(stand_in, 'mixed')
+    assert any(line.startswith('warning,') and 'TypeConsistencyRule' in line for line in report)
+
+
+def test_errors_fail_the_job(stand_in, tmp_path):
+    job = validate(stand_in, tmp_path, 'badname', 'id,my col\n1,2\n')
+    assert job['status'] == 'failed'
+    assert job['errors'] == 1
+    assert 'error,Column name <my col> is not valid,CsvHeaderRule' in read_report(stand_in, 'badname')
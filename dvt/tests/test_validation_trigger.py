@@ -0,0 +1,66 @@
+import os
+import importlib.util
+import pytest
+from stand_in import SOURCE_BUCKET_NAME
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'byod_dvt', 'lambda')
+
+
+@pytest.fixture
+def trigger(stand_in, monkeypatch):
+    '''The trigger Lambda, with the jobs it queues kept in trigger.queued'''
+    spec = importlib.util.spec_from_file_location(
+        'validation_trigger', os.path.join(LAMBDA_DIR, 'validation_trigger', 'lambda_function.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.queued = []
+    module.unsent = []
+
+    def send_jobs(queue_url, job_ids, delay_seconds=10):
+        module.queued += job_ids
+        return [job_id for job_id in job_ids if job_id in module.unsent]
+    monkeypatch.setattr(module, 'send_jobs', send_jobs)
+    return module
+
+
+def event(*keys):
+    return {'Records': [{
+        's3': {
+            'bucket': {'name': SOURCE_BUCKET_NAME},
+            'object': {'key': key, 'versionId': 'v1', 'size': 1024}
+        }
+    } for key in keys]}
+
+
+def job_id(trigger, key):
+    return trigger.make_job_id(SOURCE_BUCKET_NAME, key, 'v1')
+
+
+def test_redelivered_event_queues_unstarted_jobs_again(stand_in, trigger):
+    trigger.lambda_handler(event('upload/again.csv'), None)
+    trigger.lambda_handler(event('upload/again.csv'), None)
+    assert trigger.queued == [job_id(trigger, 'upload/again.csv')] * 2
+
+
+def test_redelivered_event_skips_started_jobs(stand_in, trigger):
+    trigger.lambda_handler(event('upload/started.csv'), None)
+    stand_in.table.update_item(
+        Key={'id': job_id(trigger, 'upload/started.csv')},
+        UpdateExpression='set started_ts = :t',
+        ExpressionAttributeValues={':t': '2026-01-01T00:00:00'})
+    trigger.lambda_handler(event('upload/started.csv'), None)
+    assert trigger.queued == [job_id(trigger, 'upload/started.csv')]
+
+
+def test_unqueued_jobs_are_deleted_only_if_new(stand_in, trigger):
+    trigger.lambda_handler(event('upload/earlier.csv'), None)
+    trigger.unsent = [job_id(trigger, 'upload/earlier.csv'), job_id(trigger, 'upload/new.csv')]
+    with pytest.raises(Exception, match='Could not queue jobs'):
+        trigger.lambda_handler(event('upload/earlier.csv', 'upload/new.csv'), None)
+    assert 'Item' in stand_in.table.get_item(Key={'id': job_id(trigger, 'upload/earlier.csv')})
+    assert 'Item' not in stand_in.table.get_item(Key={'id': job_id(trigger, 'upload/new.csv')})
+
+
+def test_only_files_under_the_batch_prefix_are_left_to_their_batch(stand_in, trigger):
+    trigger.lambda_handler(event('batch/part.csv', 'upload/batch/part.csv', 'batch/day.manifest.json'), None)
+    assert trigger.queued == [job_id(trigger, 'upload/batch/part.csv'), job_id(trigger, 'batch/day.manifest.json')]